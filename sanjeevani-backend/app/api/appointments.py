@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Path, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Path, Body, Response
 from typing import List, Optional
 from datetime import datetime, timedelta
 
@@ -10,17 +10,23 @@ from models.user import UserRole
 from services.auth_service import get_current_active_user, check_user_role
 from services.appointment_service import (
     create_appointment, get_appointment, get_appointments_by_patient,
-    get_appointments_by_doctor, update_appointment, cancel_appointment
+    get_appointments_by_doctor, get_appointments_by_hospital, get_all_appointments,
+    update_appointment, cancel_appointment, DEFAULT_PAGE_SIZE
 )
 from services.emergency_service import (
     create_emergency_request, get_emergency_request, update_emergency_status
 )
 from integrations.google_maps_integration import geocode_address, find_nearby_hospitals
 from integrations.twilio_integration import send_appointment_reminder
+from config import COLLECTIONS
+from db.repository import get_collection
 
 # Create router
 router = APIRouter()
 
+# MongoDB collections
+users_collection = get_collection(COLLECTIONS["users"])
+
 @router.post("/", response_model=AppointmentResponse, status_code=status.HTTP_201_CREATED)
 async def book_appointment(
     appointment: AppointmentCreate,
@@ -53,39 +59,47 @@ async def get_appointment_by_id(
 
 @router.get("/", response_model=List[AppointmentResponse])
 async def get_appointments(
+    response: Response,
     role: Optional[str] = Query(None, description="Filter by role (patient, doctor, hospital)"),
-    status: Optional[AppointmentStatus] = Query(None, description="Filter by status"),
+    status_filter: Optional[AppointmentStatus] = Query(None, alias="status", description="Filter by status"),
     from_date: Optional[datetime] = Query(None, description="Filter from date"),
     to_date: Optional[datetime] = Query(None, description="Filter to date"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=100, description="Maximum number of appointments to return"),
+    cursor: Optional[str] = Query(None, description="The X-Next-Cursor header of the previous page"),
     current_user: dict = Depends(get_current_active_user)
 ):
-    """Get appointments"""
+    """Get appointments ordered by date, one page at a time.
+
+    When there are more appointments, the X-Next-Cursor response header holds
+    the cursor of the next page.
+    """
+    filters = {
+        "status": status_filter,
+        "from_date": from_date,
+        "to_date": to_date,
+        "limit": limit,
+        "cursor": cursor
+    }
+
     # Get appointments based on user role
     if current_user["role"] == UserRole.PATIENT.value:
-        appointments = await get_appointments_by_patient(current_user["id"])
+        appointments, next_cursor = await get_appointments_by_patient(current_user["id"], **filters)
     elif current_user["role"] == UserRole.DOCTOR.value:
-        appointments = await get_appointments_by_doctor(current_user["id"])
+        appointments, next_cursor = await get_appointments_by_doctor(current_user["id"], **filters)
     elif current_user["role"] == UserRole.HOSPITAL.value:
         # Get all appointments for this hospital
-        appointments = await get_appointments_by_hospital(current_user["id"])
+        appointments, next_cursor = await get_appointments_by_hospital(current_user["id"], **filters)
     elif current_user["role"] == UserRole.ADMIN.value:
         # Admins can see all appointments
-        appointments = await get_all_appointments()
+        appointments, next_cursor = await get_all_appointments(**filters)
     else:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to view appointments"
         )
 
-    # Apply filters
-    if status:
-        appointments = [a for a in appointments if a["status"] == status.value]
-
-    if from_date:
-        appointments = [a for a in appointments if a["appointment_date"] >= from_date]
-
-    if to_date:
-        appointments = [a for a in appointments if a["appointment_date"] <= to_date]
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
 
     return appointments
 
@@ -146,14 +160,7 @@ async def send_appointment_reminder_by_id(
     appointment = await get_appointment(appointment_id)
 
     # Get patient phone number
-    from pymongo import MongoClient
-    from config import settings, COLLECTIONS
-
-    client = MongoClient(settings.MONGODB_URL)
-    db = client[settings.MONGODB_DB_NAME]
-    users_collection = db[COLLECTIONS["users"]]
-
-    patient = users_collection.find_one({"_id": appointment["patient_id"]})
+    patient = await users_collection.find_one({"_id": appointment["patient_id"]}, {"phone": 1})
     if not patient or not patient.get("phone"):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -161,7 +168,7 @@ async def send_appointment_reminder_by_id(
         )
 
     # Get doctor name
-    doctor = users_collection.find_one({"_id": appointment["doctor_id"]})
+    doctor = await users_collection.find_one({"_id": appointment["doctor_id"]}, {"name": 1})
     doctor_name = doctor.get("name", "your doctor") if doctor else "your doctor"
 
     # Get hospital name and location
@@ -169,7 +176,7 @@ async def send_appointment_reminder_by_id(
     hospital_location = "the scheduled location"
 
     if appointment.get("hospital_id"):
-        hospital = users_collection.find_one({"_id": appointment["hospital_id"]})
+        hospital = await users_collection.find_one({"_id": appointment["hospital_id"]}, {"name": 1, "address": 1})
         if hospital:
             hospital_name = hospital.get("name", "the clinic")
             hospital_location = hospital.get("address", {}).get("formatted_address", "the scheduled location")
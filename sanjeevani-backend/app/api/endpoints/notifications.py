@@ -5,54 +5,66 @@ Notification API endpoints for Sanjeevani 2.0
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query, Path, status
 
-from app.models.notification import (
+from models.notification import (
     NotificationResponse,
     NotificationCreate,
     NotificationUpdate,
     NotificationType
 )
-from app.models.common import PaginatedResponse
-from app.services.notification_service import NotificationService
-from app.core.security import get_current_user
-from app.models.user import User
+from models.common import PaginatedResponse
+from services.notification_service import NotificationService
+from services.auth_service import get_current_active_user
 
 router = APIRouter()
 
 
+def _response(notification) -> dict:
+    """Response of a stored notification, whose ObjectId is returned as its id"""
+    return {**notification.dict(exclude={"id"}), "id": str(notification.id)}
+
+
 @router.get("/", response_model=PaginatedResponse)
 async def get_notifications(
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
     unread_only: bool = Query(False),
-    current_user: User = Depends(get_current_user),
+    after: Optional[str] = Query(None, description="The next_after token of the previous page; page is ignored when set"),
+    current_user: dict = Depends(get_current_active_user),
     notification_service: NotificationService = Depends()
 ):
     """
     Get notifications for the current user
     """
-    return await notification_service.get_user_notifications(
-        user_id=current_user.id,
-        page=page,
-        limit=limit,
-        unread_only=unread_only
-    )
+    try:
+        return await notification_service.get_user_notifications(
+            user_id=current_user["id"],
+            page=page,
+            limit=limit,
+            unread_only=unread_only,
+            after=after
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid after token"
+        )
 
 
 @router.get("/unread-count", response_model=int)
 async def get_unread_count(
-    current_user: User = Depends(get_current_user),
+    current_user: dict = Depends(get_current_active_user),
     notification_service: NotificationService = Depends()
 ):
     """
     Get count of unread notifications for the current user
     """
-    return await notification_service.get_unread_count(current_user.id)
+    return await notification_service.get_unread_count(current_user["id"])
 
 
 @router.get("/{notification_id}", response_model=NotificationResponse)
 async def get_notification(
     notification_id: str = Path(...),
-    current_user: User = Depends(get_current_user),
+    current_user: dict = Depends(get_current_active_user),
     notification_service: NotificationService = Depends()
 ):
     """
@@ -66,19 +78,19 @@ async def get_notification(
         )
     
     # Check if notification belongs to the current user
-    if notification.user_id and notification.user_id != current_user.id:
+    if notification.user_id and notification.user_id != current_user["id"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to access this notification"
         )
         
-    return notification
+    return _response(notification)
 
 
 @router.patch("/{notification_id}/read", response_model=NotificationResponse)
 async def mark_as_read(
     notification_id: str = Path(...),
-    current_user: User = Depends(get_current_user),
+    current_user: dict = Depends(get_current_active_user),
     notification_service: NotificationService = Depends()
 ):
     """
@@ -92,7 +104,7 @@ async def mark_as_read(
         )
     
     # Check if notification belongs to the current user
-    if notification.user_id and notification.user_id != current_user.id:
+    if notification.user_id and notification.user_id != current_user["id"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to access this notification"
@@ -107,26 +119,26 @@ async def mark_as_read(
     
     # Get updated notification
     updated_notification = await notification_service.get_notification(notification_id)
-    return updated_notification
+    return _response(updated_notification)
 
 
 @router.patch("/mark-all-read", response_model=int)
 async def mark_all_as_read(
-    current_user: User = Depends(get_current_user),
+    current_user: dict = Depends(get_current_active_user),
     notification_service: NotificationService = Depends()
 ):
     """
     Mark all notifications as read for the current user
     Returns the number of notifications marked as read
     """
-    count = await notification_service.mark_all_as_read(current_user.id)
+    count = await notification_service.mark_all_as_read(current_user["id"])
     return count
 
 
 @router.delete("/{notification_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_notification(
     notification_id: str = Path(...),
-    current_user: User = Depends(get_current_user),
+    current_user: dict = Depends(get_current_active_user),
     notification_service: NotificationService = Depends()
 ):
     """
@@ -140,7 +152,7 @@ async def delete_notification(
         )
     
     # Check if notification belongs to the current user
-    if notification.user_id and notification.user_id != current_user.id:
+    if notification.user_id and notification.user_id != current_user["id"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to delete this notification"
@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends, Query
+
+from services.auth_service import get_current_active_user
+from services.hospital_service import find_nearby_hospitals, HOSPITAL_SEARCH_RADIUS
+
+# Create router
+router = APIRouter()
+
+@router.get("/nearby")
+async def get_nearby_hospitals(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    radius: float = Query(HOSPITAL_SEARCH_RADIUS, gt=0, le=500000, description="Search radius in meters"),
+    limit: int = Query(10, ge=1, le=100),
+    emergency: bool = Query(False, description="Only hospitals with emergency services"),
+    current_user: dict = Depends(get_current_active_user)
+):
+    """Find registered hospitals near a point, nearest first, with their distance in meters"""
+    hospitals = await find_nearby_hospitals(latitude, longitude, radius, limit, emergency_only=emergency)
+    return {"hospitals": hospitals}
@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Path
 from fastapi.security import OAuth2PasswordRequestForm
-from pymongo import MongoClient
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
 from datetime import datetime, timedelta
 import random
 import string
@@ -13,33 +14,34 @@ from models.user import (
 )
 from services.auth_service import (
     authenticate_user, create_access_token, get_current_user,
-    get_current_active_user, check_user_role, get_password_hash
+    get_current_active_user, check_user_role, get_password_hash,
+    invalidate_principal, deactivate_user, get_user_by_email, CURRENT_USER_PROJECTION
+)
+from services.hospital_index import hospital_index
+from services.otp_service import issue_otp, verify_otp as check_otp, OTPRateLimited
+from services.refresh_token_service import (
+    create_refresh_token, rotate_refresh_token, revoke_refresh_token
 )
 from integrations.twilio_integration import send_otp, verify_phone_number
 from firebase.firebase_admin_config import verify_firebase_token
 from config import settings, COLLECTIONS, LANGUAGES
+from db.repository import get_collection, serialize_document
+from core.geo import geo_point
 
 # Create router
 router = APIRouter()
 
-# MongoDB connection
-client = MongoClient(settings.MONGODB_URL)
-db = client[settings.MONGODB_DB_NAME]
-users_collection = db[COLLECTIONS["users"]]
-patients_collection = db[COLLECTIONS["patients"]]
-doctors_collection = db[COLLECTIONS["doctors"]]
-hospitals_collection = db[COLLECTIONS["hospitals"]]
-
-# Helper functions
-def generate_otp(length=6):
-    """Generate a random OTP"""
-    return ''.join(random.choices(string.digits, k=length))
+# MongoDB collections
+users_collection = get_collection(COLLECTIONS["users"])
+patients_collection = get_collection(COLLECTIONS["patients"])
+doctors_collection = get_collection(COLLECTIONS["doctors"])
+hospitals_collection = get_collection(COLLECTIONS["hospitals"])
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register_user(user: UserCreate):
     """Register a new user"""
     # Check if email already exists
-    if users_collection.find_one({"email": user.email}):
+    if await users_collection.find_one({"email": user.email}, {"_id": 1}):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
@@ -53,7 +55,7 @@ async def register_user(user: UserCreate):
         )
 
     # Hash password
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
 
     # Create user
     user_dict = user.dict()
@@ -66,7 +68,7 @@ async def register_user(user: UserCreate):
     })
 
     # Insert user
-    result = users_collection.insert_one(user_dict)
+    result = await users_collection.insert_one(user_dict)
 
     # Create profile based on role
     user_id = str(result.inserted_id)
@@ -78,7 +80,7 @@ async def register_user(user: UserCreate):
             "created_at": datetime.now(),
             "updated_at": datetime.now()
         }
-        patients_collection.insert_one(patient_profile)
+        await patients_collection.insert_one(patient_profile)
 
     elif user.role == UserRole.DOCTOR:
         # Create doctor profile
@@ -87,7 +89,7 @@ async def register_user(user: UserCreate):
             "created_at": datetime.now(),
             "updated_at": datetime.now()
         }
-        doctors_collection.insert_one(doctor_profile)
+        await doctors_collection.insert_one(doctor_profile)
 
     elif user.role == UserRole.HOSPITAL:
         # Create hospital profile
@@ -96,12 +98,10 @@ async def register_user(user: UserCreate):
             "created_at": datetime.now(),
             "updated_at": datetime.now()
         }
-        hospitals_collection.insert_one(hospital_profile)
+        await hospitals_collection.insert_one(hospital_profile)
 
-    # Get created user
-    created_user = users_collection.find_one({"_id": result.inserted_id})
-    created_user["id"] = str(created_user["_id"])
-    del created_user["_id"]
+    # insert_one adds the _id to the document, so it doesn't need to be read back
+    created_user = serialize_document(user_dict)
     del created_user["password"]  # Don't return password
 
     return created_user
@@ -132,9 +132,44 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     return {
         "access_token": access_token,
         "token_type": "bearer",
+        "refresh_token": await create_refresh_token(user["email"]),
+        "user": user
+    }
+
+@router.post("/refresh", response_model=Token)
+async def refresh_access_token(refresh_token: str = Body(..., embed=True)):
+    """Exchange a refresh token for a new access token and refresh token"""
+    email, new_refresh_token = await rotate_refresh_token(refresh_token)
+
+    user = await get_user_by_email(email)
+    if not user or user.get("is_active") is False:
+        # Don't leave the token just issued usable for a deactivated user
+        await revoke_refresh_token(new_refresh_token)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    access_token_expires = timedelta(minutes=settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user["email"], "role": user["role"]},
+        expires_delta=access_token_expires
+    )
+
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": new_refresh_token,
         "user": user
     }
 
+@router.post("/logout")
+async def logout(refresh_token: str = Body(..., embed=True)):
+    """Revoke a refresh token and every token refreshed from the same login"""
+    await revoke_refresh_token(refresh_token)
+    return {"message": "Logged out successfully"}
+
 @router.post("/firebase-login", response_model=Token)
 async def firebase_login(id_token: str = Body(..., embed=True)):
     """Login with Firebase ID token"""
@@ -155,13 +190,13 @@ async def firebase_login(id_token: str = Body(..., embed=True)):
             detail="Email not found in Firebase token"
         )
 
-    user = users_collection.find_one({"email": email})
+    user = await users_collection.find_one({"email": email}, CURRENT_USER_PROJECTION)
 
     # If user doesn't exist, create a new one
     if not user:
         # Create user with random password (not used for Firebase auth)
         random_password = ''.join(random.choices(string.ascii_letters + string.digits, k=16))
-        hashed_password = get_password_hash(random_password)
+        hashed_password = await get_password_hash(random_password)
 
         # Create user
         user_dict = {
@@ -177,7 +212,7 @@ async def firebase_login(id_token: str = Body(..., embed=True)):
         }
 
         # Insert user
-        result = users_collection.insert_one(user_dict)
+        result = await users_collection.insert_one(user_dict)
 
         # Create patient profile
         patient_profile = {
@@ -185,10 +220,9 @@ async def firebase_login(id_token: str = Body(..., embed=True)):
             "created_at": datetime.now(),
             "updated_at": datetime.now()
         }
-        patients_collection.insert_one(patient_profile)
+        await patients_collection.insert_one(patient_profile)
 
-        # Get created user
-        user = users_collection.find_one({"_id": result.inserted_id})
+        user = user_dict
 
     # Create access token
     access_token_expires = timedelta(minutes=settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -198,31 +232,28 @@ async def firebase_login(id_token: str = Body(..., embed=True)):
     )
 
     # Convert ObjectId to string
-    user["id"] = str(user["_id"])
-    del user["_id"]
-    del user["password"]  # Don't return password
+    user = serialize_document(user)
+    user.pop("password", None)  # Don't return password
 
     return {
         "access_token": access_token,
         "token_type": "bearer",
+        "refresh_token": await create_refresh_token(user["email"]),
         "user": user
     }
 
 @router.post("/send-otp")
 async def send_verification_otp(phone: str = Body(..., embed=True)):
     """Send OTP to phone number"""
-    # Generate OTP
-    otp = generate_otp()
-
-    # Store OTP in database (with expiration)
-    users_collection.update_one(
-        {"phone": phone},
-        {"$set": {
-            "otp": otp,
-            "otp_expiry": datetime.now() + timedelta(minutes=10)
-        }},
-        upsert=True
-    )
+    # Generate and store OTP (with expiration)
+    try:
+        otp = await issue_otp(phone)
+    except OTPRateLimited as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many OTP requests, please retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
 
     # Send OTP
     success = await send_otp(phone, otp)
@@ -238,25 +269,12 @@ async def send_verification_otp(phone: str = Body(..., embed=True)):
 @router.post("/verify-otp")
 async def verify_otp(phone: str = Body(...), otp: str = Body(...)):
     """Verify OTP"""
-    # Get user by phone
-    user = users_collection.find_one({
-        "phone": phone,
-        "otp": otp,
-        "otp_expiry": {"$gt": datetime.now()}
-    })
-
-    if not user:
+    if not await check_otp(phone, otp):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid or expired OTP"
         )
 
-    # Clear OTP
-    users_collection.update_one(
-        {"_id": user["_id"]},
-        {"$unset": {"otp": "", "otp_expiry": ""}}
-    )
-
     return {"message": "OTP verified successfully"}
 
 @router.get("/me", response_model=UserResponse)
@@ -282,20 +300,43 @@ async def update_language_preference(
         )
 
     # Update language preference
-    users_collection.update_one(
+    await users_collection.update_one(
         {"_id": ObjectId(current_user["id"])},
         {"$set": {
             "preferred_language": language,
             "updated_at": datetime.now()
         }}
     )
+    invalidate_principal(current_user["email"])
 
     return {"message": f"Language preference updated to {LANGUAGES[language]}"}
 
+@router.post("/{user_id}/deactivate")
+async def deactivate_user_by_id(
+    user_id: str = Path(..., description="The ID of the user to deactivate"),
+    current_user: dict = Depends(check_user_role([UserRole.ADMIN]))
+):
+    """Deactivate a user"""
+    try:
+        deactivated = await deactivate_user(user_id)
+    except InvalidId:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid user ID"
+        )
+
+    if not deactivated:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+
+    return {"message": "User deactivated"}
+
 @router.get("/profile/patient", response_model=PatientProfile)
 async def get_patient_profile(current_user: dict = Depends(check_user_role([UserRole.PATIENT]))):
     """Get patient profile"""
-    profile = patients_collection.find_one({"user_id": current_user["id"]})
+    profile = await patients_collection.find_one({"user_id": current_user["id"]})
 
     if not profile:
         raise HTTPException(
@@ -315,20 +356,18 @@ async def update_patient_profile(
     profile_dict = profile_update.dict(exclude={"user_id"})
     profile_dict["updated_at"] = datetime.now()
 
-    patients_collection.update_one(
+    updated_profile = await patients_collection.find_one_and_update(
         {"user_id": current_user["id"]},
-        {"$set": profile_dict}
+        {"$set": profile_dict},
+        return_document=ReturnDocument.AFTER
     )
 
-    # Get updated profile
-    updated_profile = patients_collection.find_one({"user_id": current_user["id"]})
-
     return updated_profile
 
 @router.get("/profile/doctor", response_model=DoctorProfile)
 async def get_doctor_profile(current_user: dict = Depends(check_user_role([UserRole.DOCTOR]))):
     """Get doctor profile"""
-    profile = doctors_collection.find_one({"user_id": current_user["id"]})
+    profile = await doctors_collection.find_one({"user_id": current_user["id"]})
 
     if not profile:
         raise HTTPException(
@@ -348,20 +387,18 @@ async def update_doctor_profile(
     profile_dict = profile_update.dict(exclude={"user_id"})
     profile_dict["updated_at"] = datetime.now()
 
-    doctors_collection.update_one(
+    updated_profile = await doctors_collection.find_one_and_update(
         {"user_id": current_user["id"]},
-        {"$set": profile_dict}
+        {"$set": profile_dict},
+        return_document=ReturnDocument.AFTER
     )
 
-    # Get updated profile
-    updated_profile = doctors_collection.find_one({"user_id": current_user["id"]})
-
     return updated_profile
 
 @router.get("/profile/hospital", response_model=HospitalProfile)
 async def get_hospital_profile(current_user: dict = Depends(check_user_role([UserRole.HOSPITAL]))):
     """Get hospital profile"""
-    profile = hospitals_collection.find_one({"user_id": current_user["id"]})
+    profile = await hospitals_collection.find_one({"user_id": current_user["id"]})
 
     if not profile:
         raise HTTPException(
@@ -381,12 +418,19 @@ async def update_hospital_profile(
     profile_dict = profile_update.dict(exclude={"user_id"})
     profile_dict["updated_at"] = datetime.now()
 
-    hospitals_collection.update_one(
+    # Keep the stored location unless a new one is given, and mirror it as
+    # GeoJSON for the 2dsphere index
+    if profile_dict.get("location") is None:
+        profile_dict.pop("location", None)
+    else:
+        profile_dict["geo"] = geo_point(profile_dict["location"])
+
+    updated_profile = await hospitals_collection.find_one_and_update(
         {"user_id": current_user["id"]},
-        {"$set": profile_dict}
+        {"$set": profile_dict},
+        return_document=ReturnDocument.AFTER
     )
-
-    # Get updated profile
-    updated_profile = hospitals_collection.find_one({"user_id": current_user["id"]})
+    # Location and emergency services feed the nearest hospital search
+    hospital_index.invalidate()
 
     return updated_profile
\ No newline at end of file
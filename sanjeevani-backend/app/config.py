@@ -20,9 +20,12 @@ class Settings(BaseSettings):
     JWT_SECRET_KEY: str = os.getenv("JWT_SECRET_KEY", "your-secret-key")
     JWT_ALGORITHM: str = "HS256"
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    JWT_REFRESH_TOKEN_EXPIRE_DAYS: int = int(os.getenv("JWT_REFRESH_TOKEN_EXPIRE_DAYS", "30"))
 
     # Firebase settings
     FIREBASE_CREDENTIALS: str = os.getenv("FIREBASE_CREDENTIALS", "firebase-credentials.json")
+    # Defaults to the project of the credentials
+    FIREBASE_PROJECT_ID: str = os.getenv("FIREBASE_PROJECT_ID", "")
 
     # Google Maps settings
     GOOGLE_MAPS_API_KEY: str = os.getenv("GOOGLE_MAPS_API_KEY", "")
@@ -55,6 +58,10 @@ COLLECTIONS = {
     "appointments": "appointments",
     "medical_records": "medical_records",
     "emergency_requests": "emergency_requests",
+    "notifications": "notifications",
+    "notification_counters": "notification_counters",
+    "refresh_tokens": "refresh_tokens",
+    "otp_codes": "otp_codes",
 }
 
 # Language codes and names
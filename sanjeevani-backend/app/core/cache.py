@@ -0,0 +1,68 @@
+"""
+Bounded in-process caches for Sanjeevani 2.0
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from core.metrics import metrics
+
+
+class TTLCache:
+    """LRU cache whose entries also expire ttl seconds after they were set.
+
+    Holds at most maxsize entries, evicting the least recently used one when
+    full. Hits and misses are counted as <name>.hits and <name>.misses in
+    the metrics registry, with the current size as <name>.size and the
+    share of lookups that hit as <name>.hit_rate.
+
+    Not thread safe; use it from the event loop only.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._hits = metrics.counter(f"{name}.hits")
+        self._misses = metrics.counter(f"{name}.misses")
+        metrics.gauge(f"{name}.size", lambda: len(self._entries))
+        metrics.gauge(f"{name}.hit_rate", self._hit_rate)
+
+    def _hit_rate(self) -> float:
+        lookups = self._hits.value + self._misses.value
+        return self._hits.value / lookups if lookups else 0.0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Get the value of a key, or None when it is missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self._misses.inc()
+            return None
+
+        self._entries.move_to_end(key)
+        self._hits.inc()
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Cache a value for ttl seconds, by default the ttl of the cache"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """Drop a key, if it is cached"""
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
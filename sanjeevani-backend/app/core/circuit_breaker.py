@@ -0,0 +1,105 @@
+"""
+Circuit breaker for calls to external services in Sanjeevani 2.0
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Tuple, Type
+
+from core.metrics import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a service whose breaker is open"""
+
+
+class CircuitBreaker:
+    """Stops calling a failing service so callers can fall back right away.
+
+    After failure_threshold consecutive failures (errors or missed
+    deadlines) the breaker opens and calls raise CircuitOpen without being
+    made. After reset_timeout seconds one trial call is let through: success
+    closes the breaker, failure opens it again. Exceptions listed in
+    excluded are raised without counting as failures. Reports <name>.state,
+    <name>.failures, <name>.timeouts, <name>.short_circuits and
+    <name>.opened metrics.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float,
+                 clock: Callable[[], float] = time.monotonic, excluded: Tuple[Type[BaseException], ...] = ()):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.excluded = excluded
+        self.failures = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._failure_count = metrics.counter(f"{name}.failures")
+        self._timeouts = metrics.counter(f"{name}.timeouts")
+        self._short_circuits = metrics.counter(f"{name}.short_circuits")
+        self._opened = metrics.counter(f"{name}.opened")
+        metrics.gauge(f"{name}.state", lambda: self.state)
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return self._state
+
+    def _allow(self) -> bool:
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def _record_success(self) -> None:
+        self.failures = 0
+        self._state = CLOSED
+
+    def _record_failure(self) -> None:
+        self.failures += 1
+        self._failure_count.inc()
+        # Too many failures in a row, or a failed trial call, (re)opens the breaker
+        if self._state == OPEN or self.failures >= self.failure_threshold:
+            if self._state != OPEN:
+                self._opened.inc()
+            self._state = OPEN
+            self._opened_at = self.clock()
+
+    async def call(self, fn: Callable[..., Awaitable[Any]], *args: Any, deadline: float, **kwargs: Any) -> Any:
+        """Await fn(*args, **kwargs) for at most deadline seconds.
+
+        Raises CircuitOpen when the breaker is open, asyncio.TimeoutError
+        when the deadline runs out, or whatever fn raises.
+        """
+        if not self._allow():
+            self._short_circuits.inc()
+            raise CircuitOpen(f"{self.name} is open")
+
+        trial = self._trial_running
+        try:
+            result = await asyncio.wait_for(fn(*args, **kwargs), deadline)
+        except asyncio.TimeoutError:
+            self._timeouts.inc()
+            self._record_failure()
+            raise
+        except self.excluded:
+            raise
+        except Exception:
+            self._record_failure()
+            raise
+        else:
+            self._record_success()
+            return result
+        finally:
+            if trial:
+                self._trial_running = False
@@ -0,0 +1,86 @@
+"""
+Bounded thread pools for CPU-heavy work in Sanjeevani 2.0
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from core.metrics import metrics
+
+
+class ExecutorSaturated(Exception):
+    """Raised when a BoundedExecutor already has its maximum of waiting jobs"""
+
+
+class BoundedExecutor:
+    """Thread pool that keeps blocking calls off the event loop and sheds load.
+
+    At most max_workers jobs run at once and at most max_queue more wait for
+    a thread; further jobs are rejected with ExecutorSaturated instead of
+    growing the queue without bound. Metrics are reported under the name:
+    <name>.queue_wait_seconds, <name>.run_seconds, <name>.rejected and
+    <name>.in_flight.
+
+    A job counts as in flight until it finishes on its thread, even when
+    the coroutine awaiting it was cancelled first; a cancelled job that
+    hadn't started yet is dropped from the queue.
+
+    The threads start with the first job, and a pool that was shut down
+    starts again on the next one, so an app can be restarted in-process.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        # Jobs finish on the pool's threads, which release their slot
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._queue_wait = metrics.summary(f"{name}.queue_wait_seconds")
+        self._run_time = metrics.summary(f"{name}.run_seconds")
+        self._rejected = metrics.counter(f"{name}.rejected")
+        metrics.gauge(f"{name}.in_flight", lambda: self.in_flight)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(*args) on the pool and wait for its result"""
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self._rejected.inc()
+                raise ExecutorSaturated(f"{self.name} has {self.in_flight} jobs in flight")
+            self.in_flight += 1
+
+        submitted = time.monotonic()
+
+        def job():
+            started = time.monotonic()
+            self._queue_wait.observe(started - submitted)
+            try:
+                return fn(*args)
+            finally:
+                self._run_time.observe(time.monotonic() - started)
+
+        try:
+            future = self._pool().submit(job)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda future: self._release())
+        return await asyncio.wrap_future(future)
+
+    def _release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
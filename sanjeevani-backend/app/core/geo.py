@@ -0,0 +1,92 @@
+"""
+Geographic helpers for Sanjeevani 2.0
+"""
+
+import math
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000
+# Length of one degree of latitude, in meters
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points, in meters"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def estimate_travel(straight_line_m: float, road_factor: float, speed_kmh: float) -> Tuple[float, float]:
+    """Road distance in meters and travel time in seconds estimated from a
+    straight-line distance, for when no routing service is available"""
+    road_m = straight_line_m * road_factor
+    return road_m, road_m / (speed_kmh * 1000 / 3600)
+
+
+def geo_point(location: Dict[str, float]) -> Dict[str, Any]:
+    """GeoJSON point of a {latitude, longitude} location, as stored for 2dsphere indexes"""
+    return {"type": "Point", "coordinates": [location["longitude"], location["latitude"]]}
+
+
+def haversine_vector(latitudes, longitudes, to_latitudes, to_longitudes) -> np.ndarray:
+    """Great-circle distances in meters from one or many origins to many points.
+
+    With scalar origin coordinates the result has one distance per point;
+    with arrays of origins it is a matrix with one row per origin.
+    """
+    lat1 = np.radians(np.asarray(latitudes, dtype=float))[..., np.newaxis]
+    lon1 = np.radians(np.asarray(longitudes, dtype=float))[..., np.newaxis]
+    lat2 = np.radians(np.asarray(to_latitudes, dtype=float))
+    lon2 = np.radians(np.asarray(to_longitudes, dtype=float))
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def smallest_k(distances: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k smallest distances along the last axis, smallest first"""
+    k = min(k, distances.shape[-1])
+    if k <= 0:
+        return np.empty(distances.shape[:-1] + (0,), dtype=int)
+    if k < distances.shape[-1]:
+        candidates = np.argpartition(distances, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(k), distances.shape[:-1] + (k,))
+    order = np.argsort(np.take_along_axis(distances, candidates, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=-1)
+
+
+class CoordinateTable:
+    """Items with a {latitude, longitude} location, held as coordinate arrays
+    for vectorized distance queries"""
+
+    def __init__(self, items: Iterable[Any], location: Callable[[Any], Dict[str, float]] = lambda item: item["location"]):
+        self.items: List[Any] = list(items)
+        locations = [location(item) for item in self.items]
+        self.latitudes = np.array([loc["latitude"] for loc in locations], dtype=float)
+        self.longitudes = np.array([loc["longitude"] for loc in locations], dtype=float)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def distances(self, latitude: float, longitude: float) -> np.ndarray:
+        """Distance in meters from a point to every item"""
+        return haversine_vector(latitude, longitude, self.latitudes, self.longitudes)
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1) -> List[Tuple[float, Any]]:
+        """The k items closest to a point, as (distance, item) pairs, nearest first"""
+        if not self.items:
+            return []
+        distances = self.distances(latitude, longitude)
+        return [(float(distances[i]), self.items[i]) for i in smallest_k(distances, k)]
+
+    def nearest_to_each(self, origins: Sequence[Tuple[float, float]]) -> Tuple[np.ndarray, np.ndarray]:
+        """For each (latitude, longitude) origin, the index of the closest item
+        and its distance, as two arrays"""
+        origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+        distances = haversine_vector(origins[:, 0], origins[:, 1], self.latitudes, self.longitudes)
+        indices = distances.argmin(axis=-1)
+        return indices, distances[np.arange(len(origins)), indices]
@@ -0,0 +1,92 @@
+"""
+In-process metrics for Sanjeevani 2.0
+
+A small registry of named counters, summaries and gauges, served as JSON
+by the /metrics endpoint. Values are per worker process.
+"""
+
+import threading
+from typing import Callable, Dict, Any
+
+
+class Counter:
+    """Monotonic count of events"""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self) -> int:
+        return self.value
+
+
+class Summary:
+    """Count, sum and maximum of observed values, e.g. durations in seconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "avg": self.sum / self.count if self.count else 0.0,
+            "max": self.max,
+        }
+
+
+class Gauge:
+    """Current value read from a callback when metrics are collected"""
+
+    def __init__(self, read: Callable[[], Any]):
+        self.read = read
+
+    def snapshot(self) -> Any:
+        return self.read()
+
+
+class MetricsRegistry:
+    """Named metrics; getting a metric that exists returns the same instance"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name, factory):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = factory()
+            return self._metrics[name]
+
+    def counter(self, name: str) -> Counter:
+        return self._get_or_create(name, Counter)
+
+    def summary(self, name: str) -> Summary:
+        return self._get_or_create(name, Summary)
+
+    def gauge(self, name: str, read: Callable[[], Any]) -> Gauge:
+        with self._lock:
+            self._metrics[name] = Gauge(read)
+            return self._metrics[name]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {name: metric.snapshot() for name, metric in sorted(metrics.items())}
+
+
+# Registry shared by the whole app
+metrics = MetricsRegistry()
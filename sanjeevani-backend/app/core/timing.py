@@ -0,0 +1,46 @@
+"""
+Latency breakdowns for Sanjeevani 2.0
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from core.metrics import metrics
+
+
+class LatencyBreakdown:
+    """Wall-clock time spent in the phases of one operation.
+
+    Each phase is observed in the <name>.<phase>_seconds summary of the
+    metrics registry, and the whole operation in <name>.total_seconds when
+    finish() is called. str() gives a line for the logs.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.phases: Dict[str, float] = {}
+        self._started = time.perf_counter()
+        self._total = None
+
+    @contextmanager
+    def phase(self, phase: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+            metrics.summary(f"{self.name}.{phase}_seconds").observe(elapsed)
+
+    def finish(self) -> float:
+        """Record the total time of the operation and return it in seconds"""
+        if self._total is None:
+            self._total = time.perf_counter() - self._started
+            metrics.summary(f"{self.name}.total_seconds").observe(self._total)
+        return self._total
+
+    def __str__(self) -> str:
+        total = self._total if self._total is not None else time.perf_counter() - self._started
+        phases = " ".join(f"{phase}={elapsed * 1000:.0f}ms" for phase, elapsed in self.phases.items())
+        return f"total={total * 1000:.0f}ms {phases}"
@@ -1,56 +1,197 @@
 ﻿import os
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import InvalidOperation
 from .mock_data_handler import mock_db
+from .mock_query import normalize_sort
 
 USE_MOCK_DATA = os.getenv("USE_MOCK_DATA", "false").lower() == "true"
 
+# Connection pool settings shared by every service
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "10"))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "60000"))
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
 class Database:
     client = None
     db = None
+    mock_collections = {}
     
     @classmethod
     async def connect(cls):
         if USE_MOCK_DATA:
             print("Using mock data instead of MongoDB")
+            mock_db.start()
             return
         
+        cls._create_client()
+    
+    @classmethod
+    def _create_client(cls):
         mongodb_url = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
         mongodb_db_name = os.getenv("MONGODB_DB_NAME", "sanjeevani")
         
-        cls.client = AsyncIOMotorClient(mongodb_url)
+        cls.client = AsyncIOMotorClient(
+            mongodb_url,
+            maxPoolSize=MONGODB_MAX_POOL_SIZE,
+            minPoolSize=MONGODB_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+            retryWrites=True,
+        )
         cls.db = cls.client[mongodb_db_name]
         print(f"Connected to MongoDB: {mongodb_url}/{mongodb_db_name}")
     
     @classmethod
     async def close(cls):
-        if not USE_MOCK_DATA and cls.client:
+        if USE_MOCK_DATA:
+            await mock_db.stop()
+        elif cls.client:
             cls.client.close()
+            cls.client = None
+            cls.db = None
             print("Closed MongoDB connection")
     
     @classmethod
-    async def get_collection(cls, collection_name):
+    def collection(cls, collection_name):
+        """Get a collection, creating the shared client on first use"""
         if USE_MOCK_DATA:
-            return MockCollection(collection_name)
+            if collection_name not in cls.mock_collections:
+                cls.mock_collections[collection_name] = MockCollection(collection_name)
+            return cls.mock_collections[collection_name]
         
+        if cls.db is None:
+            cls._create_client()
         return cls.db[collection_name]
+    
+    @classmethod
+    async def get_collection(cls, collection_name):
+        return cls.collection(collection_name)
 
 class MockCollection:
     def __init__(self, collection_name):
         self.collection_name = collection_name
     
-    async def find_one(self, query):
-        return await mock_db.find_one(self.collection_name, query)
+    async def find_one(self, query=None, projection=None):
+        return await mock_db.find_one(self.collection_name, query, projection)
     
-    async def find(self, query=None, limit=None):
-        return await mock_db.find(self.collection_name, query, limit)
+    def find(self, query=None, projection=None, skip=0, limit=0, sort=None):
+        return MockCursor(self.collection_name, query, skip, limit, sort, projection)
+    
+    def aggregate(self, pipeline):
+        return MockAggregationCursor(self.collection_name, pipeline)
+    
+    async def count_documents(self, query):
+        return await mock_db.count_documents(self.collection_name, query)
     
     async def insert_one(self, document):
         return await mock_db.insert_one(self.collection_name, document)
     
-    async def update_one(self, query, update):
-        return await mock_db.update_one(self.collection_name, query, update)
+    async def update_one(self, query, update, upsert=False):
+        return await mock_db.update_one(self.collection_name, query, update, upsert)
+    
+    async def update_many(self, query, update, upsert=False):
+        return await mock_db.update_many(self.collection_name, query, update, upsert)
+    
+    async def replace_one(self, query, replacement, upsert=False):
+        return await mock_db.replace_one(self.collection_name, query, replacement, upsert)
+    
+    async def find_one_and_update(self, query, update, projection=None, sort=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE):
+        return await mock_db.find_one_and_update(
+            self.collection_name, query, update, sort, upsert, return_document, projection
+        )
+    
+    async def find_one_and_delete(self, query, projection=None, sort=None):
+        return await mock_db.find_one_and_delete(self.collection_name, query, sort, projection)
     
     async def delete_one(self, query):
         return await mock_db.delete_one(self.collection_name, query)
+    
+    async def delete_many(self, query):
+        return await mock_db.delete_many(self.collection_name, query)
+
+class MockCursor:
+    """Lazy cursor over the mock data store with the Motor cursor interface"""
+
+    def __init__(self, collection_name, query=None, skip=0, limit=0, sort=None, projection=None):
+        self.collection_name = collection_name
+        self.query = query
+        self.projection = projection
+        self._skip = skip
+        self._limit = limit
+        self._sort = normalize_sort(sort) if sort else None
+        self._documents = None
+
+    def _check_not_started(self):
+        if self._documents is not None:
+            raise InvalidOperation("cannot set options after executing query")
+
+    def sort(self, key_or_list, direction=None):
+        self._check_not_started()
+        self._sort = normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, skip):
+        self._check_not_started()
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._check_not_started()
+        self._limit = limit
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._documents is None:
+            self._documents = mock_db.iter_find(
+                self.collection_name, self.query, self._sort, self._skip, self._limit, self.projection
+            )
+        try:
+            return next(self._documents)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        documents = []
+        async for document in self:
+            documents.append(document)
+            if length is not None and len(documents) >= length:
+                break
+        return documents
+
+class MockAggregationCursor:
+    """Result of MockCollection.aggregate with the Motor command cursor interface"""
+
+    def __init__(self, collection_name, pipeline):
+        self.collection_name = collection_name
+        self.pipeline = pipeline
+        self._documents = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._documents is None:
+            self._documents = iter(await mock_db.aggregate(self.collection_name, self.pipeline))
+        try:
+            return next(self._documents)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        documents = []
+        async for document in self:
+            documents.append(document)
+            if length is not None and len(documents) >= length:
+                break
+        return documents
+
 
 database = Database()
@@ -0,0 +1,185 @@
+"""
+Index manifest for the MongoDB collections.
+
+Indexes are declared per key of COLLECTIONS in config.py and applied
+idempotently on startup (unless MONGODB_ENSURE_INDEXES=false) or from the
+app directory with:
+
+    python -m db.indexes apply
+    python -m db.indexes verify
+
+verify runs explain() on the hot queries of the services and reports the
+plan and index each one uses, along with $indexStats usage counters.
+"""
+
+import asyncio
+import logging
+import sys
+from typing import Any, Dict, List
+
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, IndexModel
+from pymongo.errors import OperationFailure
+
+from config import COLLECTIONS
+from .database import Database, USE_MOCK_DATA, mock_db
+
+logger = logging.getLogger(__name__)
+
+# Indexes per COLLECTIONS key. TTL indexes take expireAfterSeconds; note that
+# MongoDB expires whole documents, so TTL indexes belong on collections
+# whose documents are disposable, never on users.
+INDEX_MANIFEST: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel(
+            [("email", ASCENDING)], name="email_unique", unique=True,
+            # Phone-only users created by the old OTP flow have no email
+            partialFilterExpression={"email": {"$type": "string"}},
+        ),
+        IndexModel([("phone", ASCENDING)], name="phone"),
+    ],
+    "otp_codes": [
+        # Entries are keyed by phone and removed once their code and send window are over
+        IndexModel([("purge_at", ASCENDING)], name="purge_at_ttl", expireAfterSeconds=0),
+    ],
+    "patients": [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ],
+    "doctors": [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ],
+    "hospitals": [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("emergency_services", ASCENDING)], name="emergency_services"),
+        # GeoJSON mirror of location, for $geoNear searches
+        IndexModel([("geo", GEOSPHERE)], name="geo_2dsphere"),
+    ],
+    "appointments": [
+        # Serve the (appointment_date, _id) keyset pagination of the listings
+        IndexModel([("patient_id", ASCENDING), ("appointment_date", ASCENDING), ("_id", ASCENDING)], name="patient_date_id"),
+        IndexModel([("doctor_id", ASCENDING), ("appointment_date", ASCENDING), ("_id", ASCENDING)], name="doctor_date_id"),
+        IndexModel([("hospital_id", ASCENDING), ("appointment_date", ASCENDING), ("_id", ASCENDING)], name="hospital_date_id"),
+        IndexModel([("appointment_date", ASCENDING), ("_id", ASCENDING)], name="date_id"),
+    ],
+    "emergency_requests": [
+        IndexModel([("patient_id", ASCENDING)], name="patient_id"),
+        IndexModel([("hospital_id", ASCENDING), ("status", ASCENDING)], name="hospital_status"),
+    ],
+    "refresh_tokens": [
+        # Expired refresh tokens are removed by MongoDB
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+        IndexModel([("family", ASCENDING)], name="family"),
+    ],
+    "notifications": [
+        # Serve the (created_at, _id) keyset pagination of the listings
+        IndexModel(
+            [("user_id", ASCENDING), ("read", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="user_read_created_id",
+        ),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_created_id"),
+    ],
+}
+
+# Hot queries of the services, as (collection key, filter, sort)
+HOT_QUERIES = [
+    ("users", {"email": "patient@example.com"}, None),
+    ("users", {"phone": "+910000000000"}, None),
+    ("patients", {"user_id": "000000000000000000000000"}, None),
+    ("doctors", {"user_id": "000000000000000000000000"}, None),
+    ("hospitals", {"emergency_services": True}, None),
+    ("appointments", {"patient_id": "000000000000000000000000"}, [("appointment_date", ASCENDING), ("_id", ASCENDING)]),
+    ("appointments", {"doctor_id": "000000000000000000000000"}, [("appointment_date", ASCENDING), ("_id", ASCENDING)]),
+    ("appointments", {"hospital_id": "000000000000000000000000"}, [("appointment_date", ASCENDING), ("_id", ASCENDING)]),
+    ("appointments", {}, [("appointment_date", ASCENDING), ("_id", ASCENDING)]),
+    ("notifications", {"user_id": "000000000000000000000000", "read": False}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("notifications", {"user_id": "000000000000000000000000"}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+]
+
+
+async def ensure_indexes() -> None:
+    """Create every index of the manifest; existing identical indexes are left alone"""
+    for key, indexes in INDEX_MANIFEST.items():
+        if USE_MOCK_DATA:
+            # The mock store only has single-field hash indexes; its $geoNear
+            # computes distances without an index
+            for index in indexes:
+                field, kind = next(iter(index.document["key"].items()))
+                if kind != GEOSPHERE:
+                    mock_db.create_index(COLLECTIONS[key], field)
+            continue
+
+        collection = Database.collection(COLLECTIONS[key])
+        try:
+            await collection.create_indexes(indexes)
+        except OperationFailure as e:
+            # Usually an index with the same name but different options already exists
+            logger.error(f"Failed to create indexes on {COLLECTIONS[key]}: {str(e)}")
+
+
+def _plan_summary(plan: Dict[str, Any]) -> List[str]:
+    """Get the stages of a query plan from the root down, e.g. FETCH <- IXSCAN(email_unique)"""
+    stages = []
+    while plan:
+        stage = plan.get("stage", "?")
+        if "indexName" in plan:
+            stage = f"{stage}({plan['indexName']})"
+        stages.append(stage)
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return stages
+
+
+async def verify_indexes() -> List[Dict[str, Any]]:
+    """Explain the hot queries and report the plan each one uses"""
+    report = []
+    for key, query, sort in HOT_QUERIES:
+        cursor = Database.collection(COLLECTIONS[key]).find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = await cursor.explain()
+        stages = _plan_summary(explanation["queryPlanner"]["winningPlan"])
+        report.append({
+            "collection": COLLECTIONS[key],
+            "query": query,
+            "plan": " <- ".join(stages),
+            "uses_index": not any(stage.startswith("COLLSCAN") for stage in stages),
+        })
+    return report
+
+
+async def index_usage() -> Dict[str, Dict[str, int]]:
+    """Get the $indexStats access counters of every manifest collection"""
+    usage = {}
+    for key in INDEX_MANIFEST:
+        collection = Database.collection(COLLECTIONS[key])
+        stats = await collection.aggregate([{"$indexStats": {}}]).to_list(length=None)
+        usage[COLLECTIONS[key]] = {stat["name"]: stat["accesses"]["ops"] for stat in stats}
+    return usage
+
+
+async def _main(command: str) -> int:
+    if USE_MOCK_DATA:
+        print("USE_MOCK_DATA is set; indexes only apply to MongoDB")
+        return 1
+
+    await Database.connect()
+    try:
+        if command == "apply":
+            await ensure_indexes()
+            print("Indexes applied")
+            return 0
+
+        report = await verify_indexes()
+        for entry in report:
+            marker = "ok  " if entry["uses_index"] else "SCAN"
+            print(f"[{marker}] {entry['collection']}: {entry['plan']}")
+        for collection, stats in (await index_usage()).items():
+            print(f"{collection}: " + ", ".join(f"{name}={ops}" for name, ops in stats.items()))
+        return 0 if all(entry["uses_index"] for entry in report) else 1
+    finally:
+        await Database.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in ("apply", "verify"):
+        print("Usage: python -m db.indexes apply|verify")
+        sys.exit(2)
+    sys.exit(asyncio.run(_main(sys.argv[1])))
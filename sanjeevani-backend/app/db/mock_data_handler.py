@@ -1,114 +1,614 @@
-﻿import json
+import asyncio
+import copy
+import heapq
+import itertools
+import logging
 import os
+from collections import defaultdict
 from pathlib import Path
 
+import numpy as np
+from bson import ObjectId, json_util
+from pymongo.results import DeleteResult, InsertOneResult, UpdateResult
+
+from core.geo import haversine_vector
+from .mock_query import (
+    compile_filter, compile_projection, compile_replacement, compile_update, equality_fields, evaluate_expression,
+    get_path, normalize_sort, sort_key
+)
+
+logger = logging.getLogger(__name__)
+
+# Fields that get a hash index as soon as a collection is loaded
+DEFAULT_INDEXES = {
+    "users": ["id", "email", "phone"],
+    "patients": ["id", "user_id"],
+    "doctors": ["id", "user_id"],
+    "hospitals": ["id", "user_id"],
+    "appointments": ["id", "user_id", "patient_id", "doctor_id"],
+    "emergency_requests": ["id", "patient_id"],
+}
+
+# Any other field is indexed once it has been queried this many times (0 disables)
+AUTO_INDEX_THRESHOLD = int(os.getenv("MOCK_AUTO_INDEX_THRESHOLD", "3"))
+
+# Journal settings: writes are appended to <collection>.journal and folded
+# into <collection>.json by a background compaction task
+JOURNAL_ENABLED = os.getenv("MOCK_DATA_JOURNAL", "true").lower() == "true"
+JOURNAL_FSYNC = os.getenv("MOCK_JOURNAL_FSYNC", "interval").lower()  # always, interval or never
+JOURNAL_COMPACT_INTERVAL = float(os.getenv("MOCK_JOURNAL_COMPACT_INTERVAL", "30"))
+JOURNAL_MAX_RECORDS = int(os.getenv("MOCK_JOURNAL_MAX_RECORDS", "1000"))
+
 class MockDataHandler:
-    def __init__(self):
-        self.base_path = Path(__file__).parent.parent / "mock_data"
+    """In-memory stand-in for MongoDB backed by the JSON files in mock_data.
+
+    Documents of a collection are kept in insertion order under an integer
+    slot, and every indexed field maps a value to the slots holding it, so
+    equality lookups on an indexed field only visit the matching documents.
+
+    In journal mode every write appends one record to the collection's
+    journal instead of rewriting its JSON file. Stored documents are never
+    modified in place (updates swap in a new dict), which lets compaction
+    serialize a snapshot off the event loop while writes continue.
+    """
+
+    def __init__(self, base_path=None, indexes=None, auto_index_threshold=AUTO_INDEX_THRESHOLD,
+                 journal=JOURNAL_ENABLED, fsync=JOURNAL_FSYNC):
+        if fsync not in ("always", "interval", "never"):
+            raise ValueError(f"Invalid journal fsync policy: {fsync}")
+
+        self.base_path = Path(base_path) if base_path else Path(__file__).parent.parent / "mock_data"
         self.data = {}
+        self.indexes = {}
+        self.declared_indexes = DEFAULT_INDEXES if indexes is None else indexes
+        self.auto_index_threshold = auto_index_threshold
+        self.journal = journal
+        self.fsync = fsync
+        self._query_counts = defaultdict(int)
+        self._next_slot = defaultdict(int)
+        self._journal_files = {}
+        self._journal_records = defaultdict(int)
+        self._compacting = set()
+        # Compactions started by writes, referenced until done so they aren't garbage collected
+        self._compaction_tasks = set()
+        self._background_task = None
         self._load_data()
-    
+
     def _load_data(self):
         for file_path in self.base_path.glob("*.json"):
             collection_name = file_path.stem
-            with open(file_path, "r") as f:
-                self.data[collection_name] = json.load(f)
-    
-    async def find_one(self, collection, query):
-        if collection not in self.data:
-            return None
-        
-        for item in self.data[collection]:
-            match = True
-            for key, value in query.items():
-                if key not in item or item[key] != value:
-                    match = False
+            with open(file_path, "r", encoding="utf-8-sig") as f:
+                documents = json_util.loads(f.read())
+
+            self._collection(collection_name)
+            for document in documents:
+                self._add(collection_name, document)
+
+        if self.journal:
+            self._replay_journals()
+
+    def _replay_journals(self):
+        """Apply journal records written after the last compacted snapshot"""
+        collections = {path.name.split(".")[0] for path in self.base_path.glob("*.journal*")}
+        for collection in sorted(collections):
+            self._collection(collection)
+            for file_path in (self._journal_path(collection, ".compacting"), self._journal_path(collection)):
+                if not file_path.exists():
+                    continue
+                self._replay_journal(collection, file_path)
+
+    def _replay_journal(self, collection, file_path):
+        """Apply the records of one journal file.
+
+        A crash can leave a torn final record. The file is cut back to the
+        last good record, so later appends don't land behind the torn one
+        and get dropped by the next replay.
+        """
+        good_bytes = 0
+        last_line = b""
+        with open(file_path, "rb+") as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    record = json_util.loads(line)
+                except ValueError:
+                    # Nothing after a torn write was acknowledged
+                    logger.warning(f"Truncating corrupt journal record {file_path}:{line_number}")
                     break
-            
-            if match:
-                return item
-        
+                self._apply_record(collection, record)
+                self._journal_records[collection] += 1
+                good_bytes += len(line)
+                last_line = line
+
+            f.truncate(good_bytes)
+            if last_line and not last_line.endswith(b"\n"):
+                # The last record was written whole but its newline wasn't
+                f.seek(good_bytes)
+                f.write(b"\n")
+
+    def _apply_record(self, collection, record):
+        if record["op"] == "put":
+            document = record["doc"]
+            slot = self._slot_for_key(collection, _primary_key(document))
+            if slot is None:
+                self._add(collection, document)
+            else:
+                self._replace(collection, slot, document)
+        elif record["op"] == "del":
+            slot = self._slot_for_key(collection, record["key"])
+            if slot is not None:
+                self._remove(collection, slot)
+
+    def _slot_for_key(self, collection, key):
+        for field in ("_id", "id"):
+            bucket = self.indexes[collection][field].get(key)
+            if bucket:
+                return next(iter(bucket))
         return None
-    
-    async def find(self, collection, query=None, limit=None):
+
+    def _collection(self, collection):
+        """Get the slot -> document map of a collection, creating it if needed"""
         if collection not in self.data:
-            return []
-        
-        if query is None:
-            results = self.data[collection]
-        else:
-            results = []
-            for item in self.data[collection]:
-                match = True
-                for key, value in query.items():
-                    if key not in item or item[key] != value:
-                        match = False
+            self.data[collection] = {}
+            self.indexes[collection] = {}
+            # Primary keys are always indexed so journal records can be replayed
+            for field in ["_id", "id"] + self.declared_indexes.get(collection, []):
+                self.create_index(collection, field)
+        return self.data[collection]
+
+    def create_index(self, collection, field):
+        """Build a hash index on a field of a collection"""
+        documents = self._collection(collection)
+        if field in self.indexes[collection]:
+            return
+
+        index = defaultdict(dict)
+        for slot, item in documents.items():
+            if field in item:
+                index[_index_key(item[field])][slot] = item
+        self.indexes[collection][field] = index
+
+    def _add(self, collection, document):
+        slot = self._next_slot[collection]
+        self._next_slot[collection] += 1
+        self._collection(collection)[slot] = document
+        self._index_add(collection, slot, document)
+        return slot
+
+    def _replace(self, collection, slot, document):
+        self._index_remove(collection, slot, self.data[collection][slot])
+        self.data[collection][slot] = document
+        self._index_add(collection, slot, document)
+
+    def _remove(self, collection, slot):
+        self._index_remove(collection, slot, self.data[collection].pop(slot))
+
+    def _index_add(self, collection, slot, item):
+        for field, index in self.indexes[collection].items():
+            if field in item:
+                index[_index_key(item[field])][slot] = item
+
+    def _index_remove(self, collection, slot, item):
+        for field, index in self.indexes[collection].items():
+            if field not in item:
+                continue
+            key = _index_key(item[field])
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(slot, None)
+                if not bucket:
+                    del index[key]
+
+    def _candidates(self, collection, query):
+        """Get the (slot, document) pairs that may match a query.
+
+        Uses the smallest index bucket among the indexed equality clauses of
+        the query, and falls back to a full scan when there is none.
+        """
+        equalities = {
+            key: value for key, value in equality_fields(query).items()
+            # None also matches documents without the field, which are not indexed
+            if value is not None and _hashable(value)
+        }
+        if not equalities:
+            return self._scan(collection)
+
+        indexes = self.indexes[collection]
+        best = None
+        for key, value in equalities.items():
+            if key in indexes:
+                bucket = indexes[key].get(value, {})
+                # Array values can match by element, so they are always candidates
+                unhashable = indexes[key].get(_UNHASHABLE)
+                if unhashable:
+                    bucket = {**bucket, **unhashable}
+                if best is None or len(bucket) < len(best):
+                    best = bucket
+                    if not best:
                         break
-                
-                if match:
-                    results.append(item)
-        
-        if limit is not None:
-            results = results[:limit]
-        
-        return results
-    
-    async def insert_one(self, collection, document):
-        if collection not in self.data:
-            self.data[collection] = []
-        
-        self.data[collection].append(document)
-        self._save_data(collection)
-        
-        return {"inserted_id": document["id"]}
-    
-    async def update_one(self, collection, query, update):
+
+        if best is not None:
+            # Buckets can fall out of insertion order after updates
+            return sorted(best.items()) if len(best) > 1 else list(best.items())
+
+        self._track_scan(collection, equalities)
+        return self._scan(collection)
+
+    def _scan(self, collection):
+        """Yield every (slot, document) pair of a collection.
+
+        Walks the slot numbers rather than the dict itself, so a paused
+        cursor survives inserts and deletes made while it is open.
+        """
+        documents = self.data[collection]
+        for slot in range(self._next_slot[collection]):
+            item = documents.get(slot)
+            if item is not None:
+                yield slot, item
+
+    def _track_scan(self, collection, equalities):
+        """Index fields that keep being queried without an index"""
+        if not self.auto_index_threshold:
+            return
+
+        for key in equalities:
+            self._query_counts[(collection, key)] += 1
+            if self._query_counts[(collection, key)] >= self.auto_index_threshold:
+                self.create_index(collection, key)
+
+    def _matching(self, collection, query):
+        """Yield the (slot, document) pairs matching a filter"""
         if collection not in self.data:
-            return {"modified_count": 0}
-        
-        modified_count = 0
-        for i, item in enumerate(self.data[collection]):
-            match = True
-            for key, value in query.items():
-                if key not in item or item[key] != value:
-                    match = False
-                    break
-            
-            if match:
-                # Handle  operator
-                if "" in update:
-                    for key, value in update[""].items():
-                        self.data[collection][i][key] = value
-                
-                modified_count += 1
-                self._save_data(collection)
+            return
+
+        predicate = compile_filter(query)
+        for slot, item in self._candidates(collection, query):
+            if predicate(item):
+                yield slot, item
+
+    async def find_one(self, collection, query=None, projection=None):
+        for slot, item in self._matching(collection, query):
+            return compile_projection(projection)(item)
+
+        return None
+
+    def iter_find(self, collection, query=None, sort=None, skip=0, limit=0, projection=None):
+        """Lazily yield copies of the documents matching a query.
+
+        Without a sort, documents stream in insertion order and iteration
+        stops after skip + limit matches. A sort with a limit keeps only the
+        top skip + limit documents in a heap instead of sorting every match.
+        A projection is applied to each document as it is yielded.
+        """
+        matches = (item for slot, item in self._matching(collection, query))
+        stop = skip + limit if limit else None
+
+        if sort:
+            key = sort_key(normalize_sort(sort))
+            if stop is None:
+                matches = sorted(matches, key=key)
+            else:
+                matches = heapq.nsmallest(stop, matches, key=key)
+
+        project = compile_projection(projection)
+        for item in itertools.islice(matches, skip, stop):
+            yield project(item)
+
+    async def find(self, collection, query=None, limit=None, sort=None, skip=0, projection=None):
+        return list(self.iter_find(collection, query, sort, skip, limit or 0, projection))
+
+    async def aggregate(self, collection, pipeline):
+        """Run an aggregation pipeline.
+
+        Only what the services use is supported: a leading $geoNear stage,
+        matched against GeoJSON points with the haversine distance instead
+        of a 2dsphere index, followed by $match, $group (with $sum), $limit
+        and $project stages.
+        """
+        stages = list(pipeline)
+        if stages and "$geoNear" in stages[0]:
+            documents = self._geo_near(collection, stages.pop(0)["$geoNear"])
+        else:
+            documents = (item for slot, item in self._matching(collection, None))
+
+        for stage in stages:
+            (name, spec), = stage.items()
+            if name == "$match":
+                predicate = compile_filter(spec)
+                documents = (item for item in documents if predicate(item))
+            elif name == "$group":
+                documents = self._group(documents, spec)
+            elif name == "$limit":
+                documents = itertools.islice(documents, spec)
+            elif name == "$project":
+                documents = map(compile_projection(spec), documents)
+            else:
+                raise NotImplementedError(f"Mock aggregation does not support {name}")
+
+        return [copy.deepcopy(item) for item in documents]
+
+    def _group(self, documents, spec):
+        accumulators = {}
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (operator, expression), = accumulator.items()
+            if operator != "$sum":
+                raise NotImplementedError(f"Mock aggregation does not support {operator}")
+            accumulators[field] = expression
+
+        groups = {}
+        for item in documents:
+            key = evaluate_expression(spec["_id"], item)
+            group = groups.setdefault(json_util.dumps(key), {"_id": key, **{field: 0 for field in accumulators}})
+            for field, expression in accumulators.items():
+                value = evaluate_expression(expression, item)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    group[field] += value
+        return iter(groups.values())
+
+    def _geo_near(self, collection, spec):
+        longitude, latitude = spec["near"]["coordinates"]
+        key = spec.get("key", "geo")
+        max_distance = spec.get("maxDistance")
+        min_distance = spec.get("minDistance", 0)
+
+        items = []
+        for slot, item in self._matching(collection, spec.get("query")):
+            point = get_path(item, key)
+            if isinstance(point, dict) and point.get("type") == "Point":
+                items.append((item, point["coordinates"]))
+        if not items:
+            return
+
+        coordinates = np.array([coordinates for item, coordinates in items], dtype=float)
+        distances = haversine_vector(latitude, longitude, coordinates[:, 1], coordinates[:, 0])
+        for i in np.argsort(distances, kind="stable"):
+            distance = float(distances[i])
+            if distance < min_distance:
+                continue
+            if max_distance is not None and distance > max_distance:
                 break
-        
-        return {"modified_count": modified_count}
-    
+            yield {**items[i][0], spec["distanceField"]: distance}
+
+    async def count_documents(self, collection, query=None):
+        return sum(1 for _ in self._matching(collection, query))
+
+    async def insert_one(self, collection, document):
+        # Like pymongo, give the caller's document an _id when it has no key
+        if "_id" not in document and "id" not in document:
+            document["_id"] = ObjectId()
+
+        stored = copy.deepcopy(document)
+        self._add(collection, stored)
+        self._write(collection, {"op": "put", "doc": stored})
+
+        return InsertOneResult(_primary_key(stored), True)
+
+    async def update_one(self, collection, query, update, upsert=False):
+        return self._update(collection, query, compile_update(update), upsert, multi=False)
+
+    async def update_many(self, collection, query, update, upsert=False):
+        return self._update(collection, query, compile_update(update), upsert, multi=True)
+
+    async def replace_one(self, collection, query, replacement, upsert=False):
+        return self._update(collection, query, compile_replacement(replacement), upsert, multi=False)
+
+    def _update(self, collection, query, apply, upsert, multi):
+        matches = self._matching(collection, query)
+        matches = list(matches) if multi else list(itertools.islice(matches, 1))
+
+        records = []
+        for slot, item in matches:
+            updated = apply(item)
+            if updated != item:
+                self._replace(collection, slot, updated)
+                records.append({"op": "put", "doc": updated})
+        if records:
+            self._write(collection, *records)
+        raw_result = {"n": len(matches), "nModified": len(records)}
+
+        if not matches and upsert:
+            document = self._upsert(collection, query, apply)
+            raw_result = {"n": 1, "nModified": 0, "upserted": _primary_key(document)}
+
+        return UpdateResult(raw_result, True)
+
+    def _upsert(self, collection, query, apply):
+        """Insert the document an upsert builds from the equality clauses of its filter"""
+        document = apply(copy.deepcopy(equality_fields(query)), is_insert=True)
+        if "_id" not in document and "id" not in document:
+            document["_id"] = ObjectId()
+        self._add(collection, document)
+        self._write(collection, {"op": "put", "doc": document})
+        return document
+
+    def _first(self, collection, query, sort):
+        matches = self._matching(collection, query)
+        if sort:
+            key = sort_key(normalize_sort(sort))
+            return min(matches, key=lambda match: key(match[1]), default=None)
+        return next(matches, None)
+
+    async def find_one_and_update(self, collection, query, update, sort=None, upsert=False,
+                                  return_document=False, projection=None):
+        """Update the first matching document and return it as it was before
+        the update, or after it when return_document is ReturnDocument.AFTER"""
+        apply = compile_update(update)
+        project = compile_projection(projection)
+        match = self._first(collection, query, sort)
+
+        if match is None:
+            if not upsert:
+                return None
+            document = self._upsert(collection, query, apply)
+            return project(document) if return_document else None
+
+        slot, item = match
+        updated = apply(item)
+        if updated != item:
+            self._replace(collection, slot, updated)
+            self._write(collection, {"op": "put", "doc": updated})
+        return project(updated if return_document else item)
+
+    async def find_one_and_delete(self, collection, query, sort=None, projection=None):
+        match = self._first(collection, query, sort)
+        if match is None:
+            return None
+
+        slot, item = match
+        self._remove(collection, slot)
+        self._write(collection, {"op": "del", "key": _primary_key(item)})
+        return compile_projection(projection)(item)
+
     async def delete_one(self, collection, query):
-        if collection not in self.data:
-            return {"deleted_count": 0}
-        
-        deleted_count = 0
-        for i, item in enumerate(self.data[collection]):
-            match = True
-            for key, value in query.items():
-                if key not in item or item[key] != value:
-                    match = False
-                    break
-            
-            if match:
-                del self.data[collection][i]
-                deleted_count += 1
-                self._save_data(collection)
-                break
-        
-        return {"deleted_count": deleted_count}
-    
-    def _save_data(self, collection):
+        return self._delete(collection, query, multi=False)
+
+    async def delete_many(self, collection, query):
+        return self._delete(collection, query, multi=True)
+
+    def _delete(self, collection, query, multi):
+        matches = self._matching(collection, query)
+        matches = list(matches) if multi else list(itertools.islice(matches, 1))
+
+        for slot, item in matches:
+            self._remove(collection, slot)
+        if matches:
+            self._write(collection, *({"op": "del", "key": _primary_key(item)} for slot, item in matches))
+
+        return DeleteResult({"n": len(matches)}, True)
+
+    def _write(self, collection, *records):
+        """Persist mutations, either as journal records or a full rewrite"""
+        if not self.journal:
+            self._save_data(collection)
+            return
+
+        journal_file = self._journal_files.get(collection)
+        if journal_file is None:
+            journal_file = open(self._journal_path(collection), "a", encoding="utf-8")
+            self._journal_files[collection] = journal_file
+
+        journal_file.write("".join(json_util.dumps(record) + "\n" for record in records))
+        journal_file.flush()
+        if self.fsync == "always":
+            os.fsync(journal_file.fileno())
+
+        self._journal_records[collection] += len(records)
+        if self._journal_records[collection] >= JOURNAL_MAX_RECORDS and collection not in self._compacting:
+            try:
+                task = asyncio.get_running_loop().create_task(self.compact(collection))
+            except RuntimeError:
+                # No event loop (scripts, tests); the next compaction pass picks it up
+                return
+            self._compaction_tasks.add(task)
+            task.add_done_callback(self._compaction_done)
+
+    def _compaction_done(self, task):
+        self._compaction_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Journal compaction failed", exc_info=task.exception())
+
+    def _journal_path(self, collection, suffix=""):
+        return self.base_path / f"{collection}.journal{suffix}"
+
+    async def compact(self, collection):
+        """Fold the journal of a collection into its JSON snapshot.
+
+        The journal is rotated and the documents captured synchronously, so
+        the snapshot and the fresh journal split the history at one point;
+        serializing and writing the snapshot happen in a worker thread.
+        """
+        if not self.journal or not self._journal_records[collection] or collection in self._compacting:
+            return
+
+        self._compacting.add(collection)
+        try:
+            journal_path = self._journal_path(collection)
+            compacting_path = self._journal_path(collection, ".compacting")
+
+            journal_file = self._journal_files.pop(collection, None)
+            if journal_file is not None:
+                journal_file.close()
+            if compacting_path.exists() and journal_path.exists():
+                # A previous compaction failed; keep its records until a snapshot lands
+                with open(compacting_path, "a", encoding="utf-8") as f, open(journal_path, "r", encoding="utf-8") as j:
+                    f.write(j.read())
+                journal_path.unlink()
+            elif journal_path.exists():
+                journal_path.rename(compacting_path)
+
+            documents = list(self.data[collection].values())
+            self._journal_records[collection] = 0
+
+            await asyncio.to_thread(self._write_snapshot, collection, documents)
+            compacting_path.unlink(missing_ok=True)
+        except Exception as e:
+            logger.error(f"Failed to compact mock collection {collection}: {str(e)}")
+            # Retry on the next compaction pass
+            self._journal_records[collection] += 1
+        finally:
+            self._compacting.discard(collection)
+
+    def _write_snapshot(self, collection, documents):
         file_path = self.base_path / f"{collection}.json"
-        with open(file_path, "w") as f:
-            json.dump(self.data[collection], f, indent=2)
+        tmp_path = file_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json_util.dumps(documents, indent=2))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+
+    def sync(self):
+        """Flush journal writes to disk"""
+        for journal_file in self._journal_files.values():
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+    async def _run_background(self):
+        while True:
+            await asyncio.sleep(JOURNAL_COMPACT_INTERVAL)
+            if self.fsync == "interval":
+                self.sync()
+            for collection in list(self.data):
+                await self.compact(collection)
+
+    def start(self):
+        """Start periodic journal fsync and compaction on the running loop"""
+        if self.journal and self._background_task is None:
+            self._background_task = asyncio.get_running_loop().create_task(self._run_background())
+
+    async def stop(self):
+        """Stop the background task and compact every journal"""
+        if self._background_task is not None:
+            self._background_task.cancel()
+            try:
+                await self._background_task
+            except asyncio.CancelledError:
+                pass
+            self._background_task = None
+
+        if self._compaction_tasks:
+            await asyncio.gather(*self._compaction_tasks, return_exceptions=True)
+        for collection in list(self.data):
+            await self.compact(collection)
+
+    def _save_data(self, collection):
+        self._write_snapshot(collection, list(self.data[collection].values()))
+
+# Index key shared by documents whose value cannot be hashed (lists, dicts)
+_UNHASHABLE = object()
+
+def _primary_key(document):
+    return document["_id"] if "_id" in document else document.get("id")
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+def _index_key(value):
+    return value if _hashable(value) else _UNHASHABLE
 
 mock_db = MockDataHandler()
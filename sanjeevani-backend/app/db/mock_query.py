@@ -0,0 +1,441 @@
+"""
+Query compiler for the mock data store.
+
+Turns MongoDB filter, update and sort documents into Python callables. A
+filter is compiled once per shape (its fields and operators, not its
+values) into a single generated expression, so matching a document costs
+one function call instead of walking the filter for every document.
+"""
+
+import copy
+import datetime
+import functools
+
+from bson import ObjectId
+
+# Marker for a field that is absent from a document
+MISSING = object()
+
+FIELD_OPERATORS = {"$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin", "$exists"}
+LOGICAL_OPERATORS = {"$and", "$or", "$nor"}
+UPDATE_OPERATORS = {"$set", "$unset", "$inc", "$setOnInsert", "$push"}
+
+
+def get_path(document, path):
+    """Get a possibly dotted field from a document"""
+    if "." not in path:
+        return document.get(path, MISSING)
+
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return MISSING
+    return value
+
+
+def _eq(actual, expected):
+    if actual is MISSING:
+        return expected is None
+    if actual == expected:
+        return True
+    # Array fields match when any element matches
+    return isinstance(actual, list) and not isinstance(expected, list) and expected in actual
+
+
+def _compare(actual, expected, op):
+    candidates = actual if isinstance(actual, list) else [actual]
+    for value in candidates:
+        if value is MISSING or value is None:
+            continue
+        try:
+            if op(value, expected):
+                return True
+        except TypeError:
+            # Mongo only compares values of the same type bracket
+            continue
+    return False
+
+
+def _gt(actual, expected):
+    return _compare(actual, expected, lambda a, b: a > b)
+
+
+def _gte(actual, expected):
+    return _compare(actual, expected, lambda a, b: a >= b)
+
+
+def _lt(actual, expected):
+    return _compare(actual, expected, lambda a, b: a < b)
+
+
+def _lte(actual, expected):
+    return _compare(actual, expected, lambda a, b: a <= b)
+
+
+def _in(actual, options):
+    return any(_eq(actual, option) for option in options)
+
+
+def _exists(actual, expected):
+    return (actual is not MISSING) == bool(expected)
+
+
+_HELPERS = {
+    "MISSING": MISSING,
+    "get_path": get_path,
+    "_eq": _eq,
+    "_gt": _gt,
+    "_gte": _gte,
+    "_lt": _lt,
+    "_lte": _lte,
+    "_in": _in,
+    "_exists": _exists,
+}
+
+_OPERATOR_SOURCES = {
+    "$eq": "_eq({field}, v[{i}])",
+    "$ne": "not _eq({field}, v[{i}])",
+    "$gt": "_gt({field}, v[{i}])",
+    "$gte": "_gte({field}, v[{i}])",
+    "$lt": "_lt({field}, v[{i}])",
+    "$lte": "_lte({field}, v[{i}])",
+    "$in": "_in({field}, v[{i}])",
+    "$nin": "not _in({field}, v[{i}])",
+    "$exists": "_exists({field}, v[{i}])",
+}
+
+
+def _is_operator_document(value):
+    return isinstance(value, dict) and bool(value) and all(key.startswith("$") for key in value)
+
+
+def _filter_shape(query, values):
+    """Get the hashable shape of a filter, collecting its values in order"""
+    clauses = []
+    for key, value in query.items():
+        if key in LOGICAL_OPERATORS:
+            clauses.append((key, tuple(_filter_shape(sub_query, values) for sub_query in value)))
+        elif key.startswith("$"):
+            raise ValueError(f"Unsupported query operator: {key}")
+        elif _is_operator_document(value):
+            operators = []
+            for operator, operand in value.items():
+                if operator not in FIELD_OPERATORS:
+                    raise ValueError(f"Unsupported query operator: {operator}")
+                operators.append(operator)
+                values.append(operand)
+            clauses.append((key, tuple(operators)))
+        else:
+            clauses.append((key, ("$eq",)))
+            values.append(value)
+    return tuple(clauses)
+
+
+def _filter_source(shape, counter):
+    expressions = []
+    for key, operators in shape:
+        if key in LOGICAL_OPERATORS:
+            parts = [_filter_source(sub_shape, counter) for sub_shape in operators]
+            if key == "$and":
+                expressions.append("(" + " and ".join(parts or ["True"]) + ")")
+            elif key == "$or":
+                expressions.append("(" + " or ".join(parts or ["False"]) + ")")
+            else:
+                expressions.append("not (" + " or ".join(parts or ["False"]) + ")")
+            continue
+
+        if "." in key:
+            field = f"get_path(doc, {key!r})"
+        else:
+            field = f"doc.get({key!r}, MISSING)"
+        for operator in operators:
+            expressions.append(_OPERATOR_SOURCES[operator].format(field=field, i=next(counter)))
+
+    return " and ".join(expressions) if expressions else "True"
+
+
+@functools.lru_cache(maxsize=512)
+def _compile_filter_shape(shape):
+    counter = iter(range(1 << 30))
+    source = f"lambda doc, v: {_filter_source(shape, counter)}"
+    return eval(source, dict(_HELPERS))
+
+
+def compile_filter(query):
+    """Compile a filter document into a predicate taking a document"""
+    if not query:
+        return lambda document: True
+
+    values = []
+    matcher = _compile_filter_shape(_filter_shape(query, values))
+    return lambda document: matcher(document, values)
+
+
+def equality_fields(query):
+    """Get the top level {field: value} equality clauses of a filter"""
+    fields = {}
+    for key, value in (query or {}).items():
+        if key == "$and":
+            for sub_query in value:
+                fields.update(equality_fields(sub_query))
+        elif key.startswith("$") or "." in key:
+            continue
+        elif _is_operator_document(value):
+            if "$eq" in value:
+                fields[key] = value["$eq"]
+        elif not isinstance(value, dict):
+            fields[key] = value
+    return fields
+
+
+def _set_path(document, path, value):
+    """Set a dotted field, copying the nested documents on the way"""
+    parts = path.split(".")
+    target = document
+    for part in parts[:-1]:
+        child = target.get(part)
+        child = dict(child) if isinstance(child, dict) else {}
+        target[part] = child
+        target = child
+    target[parts[-1]] = value
+
+
+def _unset_path(document, path):
+    parts = path.split(".")
+    target = document
+    for part in parts[:-1]:
+        child = target.get(part)
+        if not isinstance(child, dict):
+            return
+        child = dict(child)
+        target[part] = child
+        target = child
+    target.pop(parts[-1], None)
+
+
+def _apply_set(document, path, value, is_insert):
+    _set_path(document, path, copy.deepcopy(value))
+
+
+def _apply_set_on_insert(document, path, value, is_insert):
+    if is_insert:
+        _set_path(document, path, copy.deepcopy(value))
+
+
+def _apply_unset(document, path, value, is_insert):
+    _unset_path(document, path)
+
+
+def _apply_inc(document, path, value, is_insert):
+    current = get_path(document, path)
+    _set_path(document, path, value if current is MISSING else current + value)
+
+
+def _apply_push(document, path, value, is_insert):
+    current = get_path(document, path)
+    items = [] if current is MISSING else list(current)
+    if _is_operator_document(value) and "$each" in value:
+        items.extend(copy.deepcopy(value["$each"]))
+    else:
+        items.append(copy.deepcopy(value))
+    _set_path(document, path, items)
+
+
+_UPDATE_APPLIERS = {
+    "$set": _apply_set,
+    "$setOnInsert": _apply_set_on_insert,
+    "$unset": _apply_unset,
+    "$inc": _apply_inc,
+    "$push": _apply_push,
+}
+
+
+@functools.lru_cache(maxsize=512)
+def _compile_update_shape(shape):
+    steps = [(_UPDATE_APPLIERS[operator], path) for operator, paths in shape for path in paths]
+
+    def apply(document, values, is_insert):
+        for (applier, path), value in zip(steps, values):
+            applier(document, path, value, is_insert)
+
+    return apply
+
+
+def compile_update(update):
+    """Compile an update document into a function returning the updated copy of a document.
+
+    The returned function takes the current document and whether the update
+    is inserting it (for upserts), and never modifies its input. Like
+    pymongo, empty updates and replacement documents are rejected; see
+    compile_replacement for those.
+    """
+    if not update:
+        raise ValueError("update cannot be empty")
+    if not all(key.startswith("$") for key in update):
+        raise ValueError("update only works with $ operators")
+
+    shape = []
+    values = []
+    for operator, fields in update.items():
+        if operator not in UPDATE_OPERATORS:
+            raise ValueError(f"Unsupported update operator: {operator}")
+        shape.append((operator, tuple(fields)))
+        values.extend(fields.values())
+
+    applier = _compile_update_shape(tuple(shape))
+
+    def apply(document, is_insert=False):
+        updated = dict(document)
+        applier(updated, values, is_insert)
+        return updated
+
+    return apply
+
+
+def compile_replacement(replacement):
+    """Compile a replacement document into a function like those of compile_update,
+    returning the replacement with the _id of the document it replaces"""
+    if any(key.startswith("$") for key in replacement):
+        raise ValueError("replacement can not include $ operators")
+
+    def replace(document, is_insert=False):
+        replaced = copy.deepcopy(replacement)
+        if "_id" in document:
+            replaced["_id"] = document["_id"]
+        return replaced
+
+    return replace
+
+
+def compile_projection(projection):
+    """Compile a projection document into a function returning the projected copy of a document.
+
+    The copy is deep, so results never share sub-documents with the store.
+    """
+    if not projection:
+        return copy.deepcopy
+
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+
+    include_id = bool(projection.get("_id", True))
+    fields = [field for field in projection if field != "_id"]
+    flags = {bool(projection[field]) for field in fields}
+    if len(flags) > 1:
+        raise ValueError("Cannot mix inclusion and exclusion in a projection")
+
+    if flags == {False} or not fields:
+        # Exclusion projection
+        excluded = fields if include_id else fields + ["_id"]
+
+        def exclude(document):
+            projected = copy.deepcopy(document)
+            for field in excluded:
+                _unset_path(projected, field)
+            return projected
+
+        return exclude
+
+    def include(document):
+        projected = {}
+        if include_id:
+            # Mock documents may use id as their primary key instead of _id
+            for key in ("_id", "id"):
+                if key in document:
+                    projected[key] = document[key]
+                    break
+        for field in fields:
+            value = get_path(document, field)
+            if value is not MISSING:
+                _set_path(projected, field, copy.deepcopy(value))
+        return projected
+
+    return include
+
+
+# BSON comparison order of the types stored in the mock data
+_TYPE_ORDER = [
+    (type(None), 1),
+    (bool, 8),
+    (int, 2),
+    (float, 2),
+    (str, 3),
+    (dict, 4),
+    (list, 5),
+    (ObjectId, 7),
+    (datetime.datetime, 9),
+]
+
+
+def _type_rank(value):
+    if value is MISSING:
+        return 1
+    for value_type, rank in _TYPE_ORDER:
+        if isinstance(value, value_type):
+            return rank
+    return 10
+
+
+def _compare_values(a, b):
+    rank_a, rank_b = _type_rank(a), _type_rank(b)
+    if rank_a != rank_b:
+        return -1 if rank_a < rank_b else 1
+    if rank_a == 1:
+        return 0
+    try:
+        return (a > b) - (a < b)
+    except TypeError:
+        return 0
+
+
+def normalize_sort(key_or_list, direction=None):
+    """Normalize the arguments of a pymongo style sort into [(field, direction)]"""
+    if isinstance(key_or_list, str):
+        return [(key_or_list, 1 if direction is None else direction)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return list(key_or_list)
+
+
+def sort_key(spec):
+    """Get a key function ordering documents by a [(field, direction)] sort spec"""
+    spec = [(field, -1 if direction in (-1, "desc", "descending") else 1) for field, direction in spec]
+
+    def compare(a, b):
+        for field, direction in spec:
+            result = _compare_values(get_path(a, field), get_path(b, field))
+            if result:
+                return result * direction
+        return 0
+
+    return functools.cmp_to_key(compare)
+
+
+def evaluate_expression(expression, document):
+    """Evaluate an aggregation expression against a document.
+
+    Only what the services use is supported: "$field" paths, literals and
+    the $eq and $cond operators.
+    """
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = get_path(document, expression[1:])
+        return None if value is MISSING else value
+
+    if isinstance(expression, dict) and len(expression) == 1:
+        (name, args), = expression.items()
+        if name == "$eq":
+            left, right = (evaluate_expression(arg, document) for arg in args)
+            return left == right
+        if name == "$cond":
+            if isinstance(args, dict):
+                args = [args["if"], args["then"], args["else"]]
+            condition, then, otherwise = args
+            return evaluate_expression(then if evaluate_expression(condition, document) else otherwise, document)
+        if name.startswith("$"):
+            raise NotImplementedError(f"Mock aggregation does not support {name}")
+
+    return expression
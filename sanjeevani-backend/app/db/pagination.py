@@ -0,0 +1,81 @@
+"""
+Keyset (cursor) pagination helpers.
+
+A page is read with a sort that ends in a unique field (usually _id), and
+the next page starts after the sort values of the last document instead of
+skipping the documents before it. With an index matching the filter and
+sort, every page costs the same however deep it is.
+
+The values of the last document are handed to clients as an opaque cursor
+token, which is Extended JSON in URL-safe base64 so ObjectIds and dates
+round-trip with their types.
+"""
+
+import base64
+import binascii
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from bson import json_util
+from pymongo import ASCENDING
+
+Sort = Sequence[Tuple[str, int]]
+
+
+def encode_cursor(document: Dict[str, Any], sort: Sort) -> str:
+    """Encode the sort values of a document as a cursor token"""
+    values = [document.get(field) for field, _ in sort]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str, sort: Sort) -> List[Any]:
+    """Decode a cursor token into sort values, raising ValueError if it is not valid for the sort"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def after_filter(sort: Sort, values: Sequence[Any]) -> Dict[str, Any]:
+    """Build a filter matching the documents that come after the given sort values.
+
+    For a sort on (a, b) this is a > va OR (a == va AND b > vb), with the
+    comparison flipped for descending fields.
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {sort[j][0]: values[j] for j in range(i)}
+        clause[field] = {"$gt" if direction == ASCENDING else "$lt": values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+async def fetch_page(
+    collection,
+    query: Dict[str, Any],
+    sort: Sort,
+    limit: int,
+    cursor: Optional[str] = None,
+    projection: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Fetch one page of a query in sort order.
+
+    Returns the documents and the cursor of the next page, which is None on
+    the last page. A projection must keep the sort fields. Raises ValueError
+    for an invalid cursor.
+    """
+    if cursor:
+        query = {"$and": [query, after_filter(sort, decode_cursor(cursor, sort))]}
+
+    # Read one extra document to know whether there is a next page
+    documents = await collection.find(query, projection).sort(list(sort)).limit(limit + 1).to_list(length=None)
+
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor(documents[-1], sort)
+    return documents, next_cursor
@@ -0,0 +1,50 @@
+"""
+Shared data access layer for the services.
+
+Services get their collections from here instead of building their own
+client, so the whole app shares the single Motor connection pool owned by
+Database and every database call is awaited instead of blocking the loop.
+"""
+
+from typing import Any, Dict, Optional, Type
+
+from pydantic import BaseModel
+
+from .database import Database
+
+
+class CollectionRef:
+    """Collection handle that is resolved on every use.
+
+    Modules can create these at import time, before the app has connected,
+    and they follow the mock/Motor switch made by Database.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, attribute):
+        return getattr(Database.collection(self.name), attribute)
+
+
+def get_collection(name: str) -> CollectionRef:
+    """Get a shared handle to a collection"""
+    return CollectionRef(name)
+
+
+def serialize_document(document: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Replace the ObjectId _id of a document with a string id"""
+    if document is not None and "_id" in document:
+        document["id"] = str(document.pop("_id"))
+    return document
+
+
+def projection_for(model: Type[BaseModel], *extra_fields: str) -> Dict[str, int]:
+    """Build a Mongo projection fetching only the fields of a response model.
+
+    The model's id comes from _id, which Mongo returns by default (mock
+    documents may store it as id instead). extra_fields adds stored fields
+    the server needs but never returns.
+    """
+    fields = list(model.__fields__) + list(extra_fields)
+    return {field: 1 for field in fields}
@@ -6,6 +6,7 @@ import logging
 from typing import Optional, Dict, Any
 
 from config import settings
+from firebase.token_verifier import FirebaseTokenVerifier
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -38,17 +39,22 @@ except Exception as e:
     logger.error(f"Failed to initialize Firebase Admin SDK: {str(e)}")
     firebase_app = None
 
+# ID tokens are verified without the Admin SDK, which would block the event loop
+firebase_project_id = settings.FIREBASE_PROJECT_ID or (firebase_app.project_id if firebase_app else None)
+token_verifier = FirebaseTokenVerifier(firebase_project_id) if firebase_project_id else None
+
 async def verify_firebase_token(id_token: str) -> Optional[Dict[str, Any]]:
     """Verify Firebase ID token"""
-    if not firebase_app:
-        logger.error("Firebase Admin SDK not initialized")
+    if not token_verifier:
+        logger.error("Firebase project ID not configured")
         return None
 
     try:
         # Verify ID token
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = await token_verifier.verify(id_token)
         return decoded_token
     except Exception as e:
+        # InvalidFirebaseToken, or Google's signing keys could not be fetched
         logger.error(f"Failed to verify Firebase ID token: {str(e)}")
         return None
 
@@ -0,0 +1,150 @@
+"""
+Non-blocking Firebase ID token verification.
+
+Verifies Firebase Auth ID tokens the way firebase_admin.auth.verify_id_token
+does, without blocking the event loop:
+
+- Google's signing keys are fetched with httpx and cached for as long as the
+  Cache-Control max-age of the response allows; concurrent requests share
+  one fetch.
+- The RS256 signature check runs in a worker thread.
+- Verified claims are memoized per token until the token expires, so a
+  client repeating the same token costs a dictionary lookup.
+"""
+
+import asyncio
+import hashlib
+import logging
+import re
+import time
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+from jose import JWTError, jwt
+
+from core.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Google's public keys for Firebase ID tokens, as a JWK set
+GOOGLE_JWKS_URL = "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com"
+
+# Used when the key response has no usable Cache-Control header
+DEFAULT_KEYS_MAX_AGE = 3600
+
+# Tolerance for clock differences with Google, in seconds
+CLOCK_SKEW = 60
+
+# An unknown key id refreshes the keys early, at most this often (seconds)
+MIN_KEYS_REFRESH_INTERVAL = 60
+
+
+class InvalidFirebaseToken(ValueError):
+    """Raised for ID tokens that are malformed, expired or not signed by Firebase"""
+
+
+def _max_age(cache_control: Optional[str]) -> int:
+    match = re.search(r"max-age=(\d+)", cache_control or "")
+    return int(match.group(1)) if match else DEFAULT_KEYS_MAX_AGE
+
+
+class FirebaseTokenVerifier:
+    """Verifies the ID tokens of one Firebase project"""
+
+    def __init__(
+        self,
+        project_id: str,
+        keys_url: str = GOOGLE_JWKS_URL,
+        http_client: Optional[httpx.AsyncClient] = None,
+        memo_size: int = 10000,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.project_id = project_id
+        self.issuer = f"https://securetoken.google.com/{project_id}"
+        self.keys_url = keys_url
+        self.clock = clock
+        self._http_client = http_client
+        self._keys: Dict[str, Dict[str, Any]] = {}
+        self._keys_expire_at = 0.0
+        self._keys_fetched_at = float("-inf")
+        self._keys_lock = asyncio.Lock()
+        # ID tokens live at most an hour
+        self._memo = TTLCache("firebase.verified_tokens", maxsize=memo_size, ttl=3600)
+
+    async def _fetch_keys(self) -> None:
+        client = self._http_client or httpx.AsyncClient(timeout=10)
+        try:
+            response = await client.get(self.keys_url)
+            response.raise_for_status()
+        finally:
+            if client is not self._http_client:
+                await client.aclose()
+
+        self._keys = {key["kid"]: key for key in response.json()["keys"]}
+        self._keys_fetched_at = self.clock()
+        self._keys_expire_at = self._keys_fetched_at + _max_age(response.headers.get("Cache-Control"))
+        logger.info(f"Fetched {len(self._keys)} Firebase signing keys")
+
+    def _keys_stale(self, kid: str) -> bool:
+        now = self.clock()
+        if now >= self._keys_expire_at:
+            return True
+        # Keys may have been rotated early, but don't let made-up key ids
+        # turn every request into a fetch
+        return kid not in self._keys and now - self._keys_fetched_at >= MIN_KEYS_REFRESH_INTERVAL
+
+    async def _get_key(self, kid: str) -> Dict[str, Any]:
+        if self._keys_stale(kid):
+            async with self._keys_lock:
+                # Another request may have refreshed the keys while we waited
+                if self._keys_stale(kid):
+                    await self._fetch_keys()
+
+        key = self._keys.get(kid)
+        if key is None:
+            raise InvalidFirebaseToken("ID token signed with an unknown key")
+        return key
+
+    def _decode(self, id_token: str, key: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            claims = jwt.decode(
+                id_token,
+                key,
+                algorithms=["RS256"],
+                audience=self.project_id,
+                issuer=self.issuer,
+                options={"leeway": CLOCK_SKEW},
+            )
+        except JWTError as e:
+            raise InvalidFirebaseToken(str(e)) from e
+
+        if not claims.get("sub") or len(claims["sub"]) > 128:
+            raise InvalidFirebaseToken("ID token has an invalid subject")
+        if claims.get("auth_time", 0) > self.clock() + CLOCK_SKEW:
+            raise InvalidFirebaseToken("ID token has an auth_time in the future")
+
+        claims["uid"] = claims["sub"]
+        return claims
+
+    async def verify(self, id_token: str) -> Dict[str, Any]:
+        """Verify an ID token and return its claims.
+
+        Raises InvalidFirebaseToken if the token is not valid.
+        """
+        memo_key = hashlib.sha256(id_token.encode()).hexdigest()
+        claims = self._memo.get(memo_key)
+        if claims is not None:
+            return dict(claims)
+
+        try:
+            header = jwt.get_unverified_header(id_token)
+        except JWTError as e:
+            raise InvalidFirebaseToken(str(e)) from e
+        if header.get("alg") != "RS256" or not header.get("kid"):
+            raise InvalidFirebaseToken("ID token has an invalid header")
+
+        key = await self._get_key(header["kid"])
+        claims = await asyncio.to_thread(self._decode, id_token, key)
+
+        self._memo.set(memo_key, claims, ttl=claims["exp"] - self.clock())
+        return dict(claims)
@@ -0,0 +1,160 @@
+"""
+Persistent cache of geocoding results.
+
+Two tiers: an in-memory LRU (maps.geocode_cache.memory) in front of a
+SQLite file that survives restarts, so a cold start serves known
+addresses from disk instead of sending them all to Google again.
+
+Addresses are keyed by a normalized form, so differences in case,
+punctuation and whitespace don't matter. Coordinates are keyed by latitude
+and longitude rounded to REVERSE_GEOCODE_PRECISION decimals (4 is about
+11 m). Results live for
+GEOCODE_CACHE_TTL seconds. Lookups that resolved to nothing are cached too,
+for GEOCODE_NEGATIVE_TTL seconds, so unresolvable addresses don't hit the
+API on every request.
+
+GEOCODE_CACHE_PATH sets the SQLite file; an empty value keeps the cache in
+memory only. Disk errors are logged and the memory tier keeps working.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+from core.cache import TTLCache
+from core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+GEOCODE_CACHE_PATH = os.getenv(
+    "GEOCODE_CACHE_PATH", str(Path(__file__).resolve().parent.parent / "geocode_cache.sqlite3")
+)
+GEOCODE_CACHE_MEMORY_SIZE = int(os.getenv("GEOCODE_CACHE_MEMORY_SIZE", "10000"))
+GEOCODE_CACHE_TTL = int(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600)))
+GEOCODE_NEGATIVE_TTL = int(os.getenv("GEOCODE_NEGATIVE_TTL", str(24 * 3600)))
+REVERSE_GEOCODE_PRECISION = int(os.getenv("REVERSE_GEOCODE_PRECISION", "4"))
+
+# Cached value of a lookup that found nothing
+NOT_FOUND = object()
+
+
+def address_key(address: str) -> str:
+    """Key of an address: Unicode-normalized, case-folded, with runs of
+    punctuation and whitespace collapsed"""
+    normalized = unicodedata.normalize("NFKC", address).casefold()
+    normalized = re.sub(r"[\s,.;#]+", " ", normalized).strip()
+    return f"address:{normalized}"
+
+
+def latlng_key(latitude: float, longitude: float, precision: int = REVERSE_GEOCODE_PRECISION) -> str:
+    """Key of a coordinate pair, rounded to precision decimals"""
+    return f"latlng:{latitude:.{precision}f},{longitude:.{precision}f}"
+
+
+class GeocodeCache:
+    """In-memory LRU backed by a SQLite table of JSON values"""
+
+    def __init__(
+        self,
+        path: Optional[str] = GEOCODE_CACHE_PATH,
+        memory_size: int = GEOCODE_CACHE_MEMORY_SIZE,
+        ttl: int = GEOCODE_CACHE_TTL,
+        negative_ttl: int = GEOCODE_NEGATIVE_TTL,
+        name: str = "maps.geocode_cache",
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._memory = TTLCache(f"{name}.memory", maxsize=memory_size, ttl=max(ttl, negative_ttl))
+        self._disk_hits = metrics.counter(f"{name}.disk_hits")
+        self._misses = metrics.counter(f"{name}.misses")
+        self._db: Optional[sqlite3.Connection] = None
+        # One connection shared by the worker threads
+        self._db_lock = threading.Lock()
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self._db is None and self.path:
+            try:
+                db = sqlite3.connect(self.path, check_same_thread=False)
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS geocode_cache "
+                    "(key TEXT PRIMARY KEY, value TEXT, expires_at REAL NOT NULL)"
+                )
+                db.execute("DELETE FROM geocode_cache WHERE expires_at <= ?", (time.time(),))
+                db.commit()
+                self._db = db
+            except sqlite3.Error as e:
+                logger.error(f"Geocode cache at {self.path} unavailable, using memory only: {str(e)}")
+                self.path = None
+        return self._db
+
+    def _disk_get(self, key: str) -> Optional[Tuple[Optional[str], float]]:
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return None
+            row = db.execute(
+                "SELECT value, expires_at FROM geocode_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row
+
+    def _disk_set(self, key: str, value: Optional[str], expires_at: float) -> None:
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return
+            db.execute(
+                "INSERT OR REPLACE INTO geocode_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            db.commit()
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Get a cached result: the value, NOT_FOUND for a cached failed
+        lookup, or None when the key is not cached"""
+        value = self._memory.get(key)
+        if value is not None:
+            return value
+
+        try:
+            row = await asyncio.to_thread(self._disk_get, key)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to read the geocode cache: {str(e)}")
+            row = None
+        if row is None:
+            self._misses.inc()
+            return None
+
+        self._disk_hits.inc()
+        stored, expires_at = row
+        value = NOT_FOUND if stored is None else json.loads(stored)
+        self._memory.set(key, value, ttl=expires_at - time.time())
+        return value
+
+    async def set(self, key: str, value: Optional[Any]) -> None:
+        """Cache the result of a lookup; None caches a lookup that found nothing"""
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._memory.set(key, value if value is not None else NOT_FOUND, ttl=ttl)
+        try:
+            await asyncio.to_thread(
+                self._disk_set, key, json.dumps(value) if value is not None else None, time.time() + ttl
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Failed to write the geocode cache: {str(e)}")
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+geocode_cache = GeocodeCache()
@@ -1,39 +1,47 @@
-import googlemaps
 from typing import Dict, List, Any, Optional, Tuple
 import logging
 from datetime import datetime
 
 from config import settings
+from integrations.maps_client import maps_client
+from integrations.geocode_cache import geocode_cache, address_key, latlng_key, NOT_FOUND
+from integrations.route_cache import route_cache, destination_key
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Google Maps client
-try:
-    gmaps = googlemaps.Client(key=settings.GOOGLE_MAPS_API_KEY)
-except Exception as e:
-    logger.error(f"Failed to initialize Google Maps client: {str(e)}")
-    gmaps = None
+# Shared async Google Maps client, when an API key is configured
+gmaps = maps_client if settings.GOOGLE_MAPS_API_KEY else None
+if not gmaps:
+    logger.error("GOOGLE_MAPS_API_KEY is not set; Google Maps calls are disabled")
 
 async def geocode_address(address: str) -> Optional[Dict[str, float]]:
     """Convert address to coordinates"""
+    key = address_key(address)
+    cached = await geocode_cache.get(key)
+    if cached is not None:
+        return None if cached is NOT_FOUND else dict(cached)
+
     if not gmaps:
         logger.error("Google Maps client not initialized")
         return None
 
     try:
         # Geocode address
-        geocode_result = gmaps.geocode(address)
+        geocode_result = await gmaps.geocode(address)
 
         if geocode_result and len(geocode_result) > 0:
             location = geocode_result[0]['geometry']['location']
-            return {
+            coordinates = {
                 "latitude": location['lat'],
                 "longitude": location['lng']
             }
+            await geocode_cache.set(key, coordinates)
+            return coordinates
         else:
             logger.error(f"No geocode results for address: {address}")
+            await geocode_cache.set(key, None)
             return None
     except Exception as e:
         logger.error(f"Failed to geocode address: {str(e)}")
@@ -41,13 +49,18 @@ async def geocode_address(address: str) -> Optional[Dict[str, float]]:
 
 async def reverse_geocode(latitude: float, longitude: float) -> Optional[Dict[str, str]]:
     """Convert coordinates to address"""
+    key = latlng_key(latitude, longitude)
+    cached = await geocode_cache.get(key)
+    if cached is not None:
+        return None if cached is NOT_FOUND else dict(cached)
+
     if not gmaps:
         logger.error("Google Maps client not initialized")
         return None
 
     try:
         # Reverse geocode coordinates
-        reverse_geocode_result = gmaps.reverse_geocode((latitude, longitude))
+        reverse_geocode_result = await gmaps.reverse_geocode((latitude, longitude))
 
         if reverse_geocode_result and len(reverse_geocode_result) > 0:
             address_components = reverse_geocode_result[0]['address_components']
@@ -68,9 +81,11 @@ async def reverse_geocode(latitude: float, longitude: float) -> Optional[Dict[st
                 elif 'postal_code' in component['types']:
                     address["postal_code"] = component['long_name']
 
+            await geocode_cache.set(key, address)
             return address
         else:
             logger.error(f"No reverse geocode results for coordinates: {latitude}, {longitude}")
+            await geocode_cache.set(key, None)
             return None
     except Exception as e:
         logger.error(f"Failed to reverse geocode coordinates: {str(e)}")
@@ -82,17 +97,40 @@ async def calculate_distance_matrix(origins: List[Tuple[float, float]], destinat
         logger.error("Google Maps client not initialized")
         return None
 
-    try:
-        # Calculate distance matrix
-        distance_matrix = gmaps.distance_matrix(
-            origins=origins,
-            destinations=destinations,
-            mode="driving",
-            units="metric",
-            departure_time=datetime.now()
-        )
+    # Only ask for the origins and destinations of uncached pairs
+    elements = {}
+    for i, origin in enumerate(origins):
+        for j, destination in enumerate(destinations):
+            element = route_cache.get(origin, destination_key(destination))
+            if element is not None:
+                elements[i, j] = element
+    missing_origins = sorted({i for i in range(len(origins)) for j in range(len(destinations)) if (i, j) not in elements})
+    missing_destinations = sorted({j for i in missing_origins for j in range(len(destinations)) if (i, j) not in elements})
 
-        return distance_matrix
+    try:
+        if missing_origins:
+            # Calculate distance matrix
+            distance_matrix = await gmaps.distance_matrix(
+                origins=[origins[i] for i in missing_origins],
+                destinations=[destinations[j] for j in missing_destinations],
+                mode="driving",
+                units="metric",
+                departure_time=datetime.now()
+            )
+            for i, row in zip(missing_origins, distance_matrix["rows"]):
+                for j, element in zip(missing_destinations, row["elements"]):
+                    elements[i, j] = element
+                    if element["status"] == "OK":
+                        route_cache.set(origins[i], destination_key(destinations[j]), element)
+
+        # Cached responses have no addresses, only the rows
+        return {
+            "status": "OK",
+            "rows": [
+                {"elements": [elements[i, j] for j in range(len(destinations))]}
+                for i in range(len(origins))
+            ],
+        }
     except Exception as e:
         logger.error(f"Failed to calculate distance matrix: {str(e)}")
         return None
@@ -105,7 +143,7 @@ async def find_nearby_hospitals(latitude: float, longitude: float, radius: int =
 
     try:
         # Find nearby hospitals
-        places_result = gmaps.places_nearby(
+        places_result = await gmaps.places_nearby(
             location=(latitude, longitude),
             radius=radius,
             type='hospital'
@@ -145,9 +183,13 @@ async def get_directions(origin: Tuple[float, float], destination: Tuple[float,
         logger.error("Google Maps client not initialized")
         return None
 
+    route = route_cache.get(origin, destination_key(destination), mode, kind="directions")
+    if route is not None:
+        return route
+
     try:
         # Get directions
-        directions_result = gmaps.directions(
+        directions_result = await gmaps.directions(
             origin=origin,
             destination=destination,
             mode=mode,
@@ -155,6 +197,7 @@ async def get_directions(origin: Tuple[float, float], destination: Tuple[float,
         )
 
         if directions_result and len(directions_result) > 0:
+            route_cache.set(origin, destination_key(destination), directions_result[0], mode, kind="directions")
             return directions_result[0]
         else:
             logger.error(f"No directions found from {origin} to {destination}")
@@ -0,0 +1,220 @@
+"""
+Async Google Maps web service client.
+
+A small replacement for the parts of googlemaps.Client the app uses, built
+on one shared httpx.AsyncClient so calls don't block the event loop and
+reuse keep-alive connections. Methods take the same arguments and return
+the same values as their googlemaps counterparts.
+
+Tuned with MAPS_TIMEOUT (deadline in seconds per call, overridable per
+call), MAPS_MAX_CONNECTIONS (requests in flight at once; others wait for a
+connection) and MAPS_BASE_URL (e.g. a local stub server). Each API reports
+maps.<api>.seconds and maps.<api>.errors metrics, e.g. maps.directions.seconds.
+
+Each API has its own circuit breaker (maps.<api>.circuit metrics): after
+MAPS_BREAKER_FAILURES failed or timed out calls in a row, its calls fail at
+once with a CIRCUIT_OPEN MapsApiError for MAPS_BREAKER_RESET_TIMEOUT seconds,
+so callers use their fallbacks instead of waiting on a struggling API.
+Answers with a quota or server error status count as failed calls; other
+error statuses (e.g. INVALID_REQUEST) are about the request and don't. Time
+spent waiting for one of our own pooled connections (httpx.PoolTimeout)
+is not a failure of the API and doesn't count either.
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import httpx
+
+from config import settings
+from core.circuit_breaker import CircuitBreaker, CircuitOpen
+from core.metrics import metrics
+
+MAPS_BASE_URL = os.getenv("MAPS_BASE_URL", "https://maps.googleapis.com")
+MAPS_TIMEOUT = float(os.getenv("MAPS_TIMEOUT", "5"))
+MAPS_MAX_CONNECTIONS = int(os.getenv("MAPS_MAX_CONNECTIONS", "20"))
+MAPS_BREAKER_FAILURES = int(os.getenv("MAPS_BREAKER_FAILURES", "5"))
+MAPS_BREAKER_RESET_TIMEOUT = float(os.getenv("MAPS_BREAKER_RESET_TIMEOUT", "30"))
+
+Point = Union[Tuple[float, float], str]
+
+# Statuses of successful responses; anything else is an error
+OK_STATUSES = {"OK", "ZERO_RESULTS"}
+# Error statuses meaning the API can't serve anyone right now, which trip its breaker
+UNAVAILABLE_STATUSES = {"OVER_QUERY_LIMIT", "OVER_DAILY_LIMIT", "UNKNOWN_ERROR"}
+
+
+class MapsApiError(Exception):
+    """Raised when a Maps call fails or answers with an error status"""
+
+    def __init__(self, status: str, message: str = ""):
+        super().__init__(f"{status}: {message}" if message else status)
+        self.status = status
+
+
+def _location(point: Point) -> str:
+    if isinstance(point, str):
+        return point
+    return f"{point[0]},{point[1]}"
+
+
+def _locations(points: Sequence[Point]) -> str:
+    return "|".join(_location(point) for point in points)
+
+
+def _time(value: Union[datetime, int, str]) -> Union[int, str]:
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return value
+
+
+class AsyncMapsClient:
+    """Google Maps web service calls over a pooled httpx.AsyncClient"""
+
+    def __init__(
+        self,
+        key: str,
+        base_url: str = MAPS_BASE_URL,
+        timeout: float = MAPS_TIMEOUT,
+        max_connections: int = MAPS_MAX_CONNECTIONS,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        breaker_failures: int = MAPS_BREAKER_FAILURES,
+        breaker_reset_timeout: float = MAPS_BREAKER_RESET_TIMEOUT,
+    ):
+        self.key = key
+        self.timeout = timeout
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.transport = transport
+        self._http: Optional[httpx.AsyncClient] = None
+
+    def _client(self) -> httpx.AsyncClient:
+        # Opened on first use, and again after aclose, so the app can be
+        # restarted in-process
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections, max_keepalive_connections=self.max_connections
+                ),
+                transport=self.transport,
+            )
+        return self._http
+
+    def breaker(self, api: str) -> CircuitBreaker:
+        """Circuit breaker of one API, e.g. "directions" """
+        if api not in self.breakers:
+            self.breakers[api] = CircuitBreaker(
+                f"maps.{api.replace('/', '_')}.circuit", self.breaker_failures, self.breaker_reset_timeout,
+                excluded=(httpx.PoolTimeout,),
+            )
+        return self.breakers[api]
+
+    async def _get(self, api: str, params: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        params = {name: value for name, value in params.items() if value is not None}
+        params["key"] = self.key
+        metric = f"maps.{api.replace('/', '_')}"
+
+        timeout = self.timeout if timeout is None else timeout
+
+        async def request():
+            response = await self._client().get(f"/maps/api/{api}/json", params=params, timeout=timeout)
+            response.raise_for_status()
+            body = response.json()
+            if body.get("status") in UNAVAILABLE_STATUSES:
+                raise MapsApiError(body["status"], body.get("error_message", ""))
+            return body
+
+        started = time.perf_counter()
+        try:
+            # The timeout is a deadline for the whole call, including the
+            # wait for a pooled connection
+            body = await self.breaker(api).call(request, deadline=timeout)
+        except CircuitOpen as e:
+            raise MapsApiError("CIRCUIT_OPEN", str(e)) from e
+        except MapsApiError:
+            metrics.counter(f"{metric}.errors").inc()
+            raise
+        except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+            metrics.counter(f"{metric}.errors").inc()
+            raise MapsApiError("TIMEOUT", str(e)) from e
+        except (httpx.HTTPError, ValueError) as e:
+            metrics.counter(f"{metric}.errors").inc()
+            raise MapsApiError("HTTP_ERROR", str(e)) from e
+        finally:
+            metrics.summary(f"{metric}.seconds").observe(time.perf_counter() - started)
+
+        if body.get("status") not in OK_STATUSES:
+            metrics.counter(f"{metric}.errors").inc()
+            raise MapsApiError(body.get("status", "UNKNOWN_ERROR"), body.get("error_message", ""))
+        return body
+
+    async def geocode(self, address: str, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        body = await self._get("geocode", {"address": address}, timeout)
+        return body.get("results", [])
+
+    async def reverse_geocode(self, latlng: Point, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        body = await self._get("geocode", {"latlng": _location(latlng)}, timeout)
+        return body.get("results", [])
+
+    async def distance_matrix(
+        self,
+        origins: Sequence[Point],
+        destinations: Sequence[Point],
+        mode: Optional[str] = None,
+        units: Optional[str] = None,
+        departure_time: Optional[Union[datetime, int, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        return await self._get("distancematrix", {
+            "origins": _locations(origins),
+            "destinations": _locations(destinations),
+            "mode": mode,
+            "units": units,
+            "departure_time": _time(departure_time) if departure_time is not None else None,
+        }, timeout)
+
+    async def directions(
+        self,
+        origin: Point,
+        destination: Point,
+        mode: Optional[str] = None,
+        departure_time: Optional[Union[datetime, int, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        body = await self._get("directions", {
+            "origin": _location(origin),
+            "destination": _location(destination),
+            "mode": mode,
+            "departure_time": _time(departure_time) if departure_time is not None else None,
+        }, timeout)
+        return body.get("routes", [])
+
+    async def places_nearby(
+        self,
+        location: Point,
+        radius: Optional[int] = None,
+        type: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        return await self._get("place/nearbysearch", {
+            "location": _location(location),
+            "radius": radius,
+            "type": type,
+        }, timeout)
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+# Shared by the emergency service and the Google Maps integration
+maps_client = AsyncMapsClient(settings.GOOGLE_MAPS_API_KEY)
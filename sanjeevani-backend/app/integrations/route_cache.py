@@ -0,0 +1,102 @@
+"""
+Cache of Google Maps routing results.
+
+Distance Matrix elements and Directions results are cached per origin cell,
+destination and travel mode. Origins are snapped to a grid of
+ROUTE_CACHE_CELL_DEGREES cells (0.005 degrees is about 500 m), so requests
+from the same neighbourhood to the same hospital share one lookup.
+
+Travel times follow traffic, so entries made during the peak hours
+(ROUTE_CACHE_PEAK_HOURS, local time, e.g. "7-10,17-21") live for
+ROUTE_CACHE_PEAK_TTL seconds and others for ROUTE_CACHE_OFF_PEAK_TTL, but
+never past the start of the next peak.
+
+Hits, misses, hit rate and size are reported as maps.route_cache.* metrics.
+"""
+
+import math
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.cache import TTLCache
+
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "10000"))
+ROUTE_CACHE_CELL_DEGREES = float(os.getenv("ROUTE_CACHE_CELL_DEGREES", "0.005"))
+ROUTE_CACHE_PEAK_TTL = int(os.getenv("ROUTE_CACHE_PEAK_TTL", "300"))
+ROUTE_CACHE_OFF_PEAK_TTL = int(os.getenv("ROUTE_CACHE_OFF_PEAK_TTL", "1800"))
+ROUTE_CACHE_PEAK_HOURS = os.getenv("ROUTE_CACHE_PEAK_HOURS", "7-10,17-21")
+
+Point = Tuple[float, float]
+
+
+def parse_hours(spec: str) -> List[Tuple[int, int]]:
+    """Parse "7-10,17-21" into [(7, 10), (17, 21)]; end hours are exclusive"""
+    ranges = []
+    for part in spec.split(","):
+        if part.strip():
+            start, end = part.split("-")
+            ranges.append((int(start), int(end)))
+    return ranges
+
+
+def destination_key(destination: Point) -> str:
+    """Key for a destination without an id, its coordinates to about 1 m"""
+    return f"{destination[0]:.5f},{destination[1]:.5f}"
+
+
+class RouteCache:
+    """TTL cache of routing results keyed by (kind, origin cell, destination, mode)"""
+
+    def __init__(
+        self,
+        name: str = "maps.route_cache",
+        maxsize: int = ROUTE_CACHE_SIZE,
+        cell_degrees: float = ROUTE_CACHE_CELL_DEGREES,
+        peak_ttl: int = ROUTE_CACHE_PEAK_TTL,
+        off_peak_ttl: int = ROUTE_CACHE_OFF_PEAK_TTL,
+        peak_hours: str = ROUTE_CACHE_PEAK_HOURS,
+    ):
+        self.cell_degrees = cell_degrees
+        self.peak_ttl = peak_ttl
+        self.off_peak_ttl = off_peak_ttl
+        self.peak_hours = parse_hours(peak_hours)
+        self._cache = TTLCache(name, maxsize=maxsize, ttl=max(peak_ttl, off_peak_ttl))
+
+    def _key(self, kind: str, origin: Point, destination_id: str, mode: str) -> Tuple:
+        cell = (math.floor(origin[0] / self.cell_degrees), math.floor(origin[1] / self.cell_degrees))
+        return (kind, cell, destination_id, mode)
+
+    def ttl(self, now: Optional[datetime] = None) -> float:
+        """Lifetime of an entry made at a local time"""
+        now = now or datetime.now()
+        if any(start <= now.hour < end for start, end in self.peak_hours):
+            return self.peak_ttl
+
+        # Don't let an off-peak travel time be served during the next peak
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        peak_starts = [midnight + timedelta(days=day, hours=start) for day in (0, 1) for start, _ in self.peak_hours]
+        upcoming = [(start - now).total_seconds() for start in peak_starts if start > now]
+        until_peak = min(upcoming) if upcoming else self.off_peak_ttl
+        return min(self.off_peak_ttl, until_peak)
+
+    def get(self, origin: Point, destination_id: str, mode: str = "driving", kind: str = "element") -> Optional[Any]:
+        return self._cache.get(self._key(kind, origin, destination_id, mode))
+
+    def set(self, origin: Point, destination_id: str, value: Any, mode: str = "driving", kind: str = "element") -> None:
+        self._cache.set(self._key(kind, origin, destination_id, mode), value, ttl=self.ttl())
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+def route_element(leg: Dict[str, Any]) -> Dict[str, Any]:
+    """Distance Matrix element for the leg of a Directions route, so both APIs
+    fill the same cache entries"""
+    element = {"status": "OK", "distance": leg["distance"], "duration": leg["duration"]}
+    if "duration_in_traffic" in leg:
+        element["duration_in_traffic"] = leg["duration_in_traffic"]
+    return element
+
+
+route_cache = RouteCache()
@@ -2,6 +2,7 @@ from fastapi import FastAPI, Depends, HTTPException, status, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import uvicorn
+import asyncio
 import os
 import logging
 import time
@@ -44,6 +45,19 @@ if sentry_dsn:
 # Import API routers
 from api.users import router as users_router
 from api.appointments import router as appointments_router
+from api.hospitals import router as hospitals_router
+from api.endpoints.notifications import router as notifications_router
+from db.database import Database
+from db.indexes import ensure_indexes
+from core.metrics import metrics
+from models.user import UserRole
+from services.auth_service import check_user_role, password_executor
+from services.hospital_service import backfill_hospital_geo
+from services.notification_service import (
+    NOTIFICATION_RECONCILE_INTERVAL, NotificationService, reconcile_counters_periodically
+)
+from integrations.maps_client import maps_client
+from integrations.geocode_cache import geocode_cache
 
 # Create FastAPI app
 app = FastAPI(
@@ -52,6 +66,31 @@ app = FastAPI(
     version="1.0.0"
 )
 
+@app.on_event("startup")
+async def startup_event():
+    await Database.connect()
+    if os.getenv("MONGODB_ENSURE_INDEXES", "true").lower() == "true":
+        await ensure_indexes()
+    # Hospitals saved before the GeoJSON mirror existed can't be found by $geoNear
+    updated = await backfill_hospital_geo()
+    if updated:
+        logger.info(f"Added GeoJSON locations to {updated} hospitals")
+    # Repairs notification counters that drifted from the notifications
+    app.state.counter_reconciler = None
+    if NOTIFICATION_RECONCILE_INTERVAL > 0:
+        app.state.counter_reconciler = asyncio.create_task(
+            reconcile_counters_periodically(NotificationService(), NOTIFICATION_RECONCILE_INTERVAL)
+        )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if app.state.counter_reconciler is not None:
+        app.state.counter_reconciler.cancel()
+    await Database.close()
+    password_executor.shutdown()
+    await maps_client.aclose()
+    geocode_cache.close()
+
 # Add request ID middleware
 @app.middleware("http")
 async def add_request_id_middleware(request: Request, call_next):
@@ -101,9 +140,17 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+# Metrics of this worker process, for admins only: they describe users,
+# traffic and upstream failures
+@app.get("/metrics")
+async def get_metrics(current_user: dict = Depends(check_user_role([UserRole.ADMIN]))):
+    return metrics.snapshot()
+
 # Include routers
 app.include_router(users_router, prefix="/api/users", tags=["Users"])
 app.include_router(appointments_router, prefix="/api/appointments", tags=["Appointments"])
+app.include_router(hospitals_router, prefix="/api/hospitals", tags=["Hospitals"])
+app.include_router(notifications_router, prefix="/api/notifications", tags=["Notifications"])
 
 # Error handlers
 @app.exception_handler(HTTPException)
@@ -5,6 +5,7 @@ Common models and utilities for Sanjeevani 2.0
 from typing import Any, Optional
 from bson import ObjectId
 from pydantic import BaseModel, Field
+from pydantic_core import core_schema
 
 
 class PyObjectId(ObjectId):
@@ -20,8 +21,14 @@ class PyObjectId(ObjectId):
         return ObjectId(v)
 
     @classmethod
-    def __modify_schema__(cls, field_schema):
-        field_schema.update(type="string")
+    def __get_pydantic_core_schema__(cls, source_type, handler):
+        return core_schema.no_info_plain_validator_function(
+            cls.validate, serialization=core_schema.to_string_ser_schema()
+        )
+
+    @classmethod
+    def __get_pydantic_json_schema__(cls, schema, handler):
+        return {"type": "string"}
 
 
 class MongoBaseModel(BaseModel):
@@ -37,12 +44,17 @@ class MongoBaseModel(BaseModel):
 
 
 class PaginatedResponse(BaseModel):
-    """Base model for paginated responses"""
+    """Base model for paginated responses.
+
+    Page-number responses fill page and pages. Cursor responses leave them
+    empty; next_after is the token of the next page, or None on the last one.
+    """
     total: int
-    page: int
+    page: Optional[int] = None
     limit: int
-    pages: int
+    pages: Optional[int] = None
     items: list[Any]
+    next_after: Optional[str] = None
 
     class Config:
         schema_extra = {
@@ -51,6 +63,7 @@ class PaginatedResponse(BaseModel):
                 "page": 1,
                 "limit": 10,
                 "pages": 10,
-                "items": []
+                "items": [],
+                "next_after": "WyIyMDIzLTA2LTAxVDEwOjAwOjAwIl0"
             }
         }
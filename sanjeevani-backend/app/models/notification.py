@@ -8,7 +8,7 @@ from datetime import datetime
 from pydantic import BaseModel, Field
 from bson import ObjectId
 
-from app.models.common import PyObjectId
+from models.common import PyObjectId
 
 
 class NotificationType(str, Enum):
@@ -72,6 +72,7 @@ class HospitalProfile(BaseModel):
     departments: List[str] = []
     emergency_services: bool = False
     ambulance_services: bool = False
+    location: Optional[Dict[str, float]] = None  # latitude, longitude
 
     class Config:
         orm_mode = True
@@ -83,4 +84,5 @@ class TokenData(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
     user: UserResponse
\ No newline at end of file
@@ -1,25 +1,40 @@
+import asyncio
 from datetime import datetime
-from typing import List, Optional, Dict, Any
-from pymongo import MongoClient
+from typing import List, Optional, Dict, Any, Tuple
 from bson import ObjectId
 from fastapi import HTTPException, status
+from pymongo import ASCENDING, ReturnDocument
 
-from models.appointment import AppointmentCreate, AppointmentUpdate, AppointmentStatus
-from config import settings, COLLECTIONS
+from models.appointment import AppointmentCreate, AppointmentUpdate, AppointmentStatus, AppointmentResponse
+from config import COLLECTIONS
+from db.pagination import fetch_page
+from db.repository import get_collection, projection_for, serialize_document
 
-# MongoDB connection
-client = MongoClient(settings.MONGODB_URL)
-db = client[settings.MONGODB_DB_NAME]
-appointments_collection = db[COLLECTIONS["appointments"]]
-users_collection = db[COLLECTIONS["users"]]
-patients_collection = db[COLLECTIONS["patients"]]
-doctors_collection = db[COLLECTIONS["doctors"]]
-hospitals_collection = db[COLLECTIONS["hospitals"]]
+# MongoDB collections
+appointments_collection = get_collection(COLLECTIONS["appointments"])
+users_collection = get_collection(COLLECTIONS["users"])
+patients_collection = get_collection(COLLECTIONS["patients"])
+doctors_collection = get_collection(COLLECTIONS["doctors"])
+hospitals_collection = get_collection(COLLECTIONS["hospitals"])
+
+APPOINTMENT_PROJECTION = projection_for(AppointmentResponse)
+
+# Appointment listings page through this order, which the *_date_id indexes serve
+APPOINTMENT_SORT = [("appointment_date", ASCENDING), ("_id", ASCENDING)]
+DEFAULT_PAGE_SIZE = 50
 
 async def create_appointment(appointment: AppointmentCreate, user_id: str) -> Dict[str, Any]:
     """Create a new appointment"""
+    # Look up the patient, doctor and hospital concurrently
+    lookups = [
+        patients_collection.find_one({"user_id": appointment.patient_id}, {"_id": 1}),
+        doctors_collection.find_one({"user_id": appointment.doctor_id}, {"_id": 1}),
+    ]
+    if appointment.hospital_id:
+        lookups.append(hospitals_collection.find_one({"user_id": appointment.hospital_id}, {"_id": 1}))
+    patient, doctor, *hospital = await asyncio.gather(*lookups)
+
     # Check if patient exists
-    patient = patients_collection.find_one({"user_id": appointment.patient_id})
     if not patient:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -27,7 +42,6 @@ async def create_appointment(appointment: AppointmentCreate, user_id: str) -> Di
         )
 
     # Check if doctor exists
-    doctor = doctors_collection.find_one({"user_id": appointment.doctor_id})
     if not doctor:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -35,13 +49,11 @@ async def create_appointment(appointment: AppointmentCreate, user_id: str) -> Di
         )
 
     # Check if hospital exists if hospital_id is provided
-    if appointment.hospital_id:
-        hospital = hospitals_collection.find_one({"user_id": appointment.hospital_id})
-        if not hospital:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Hospital not found"
-            )
+    if appointment.hospital_id and not hospital[0]:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Hospital not found"
+        )
 
     # Create appointment
     appointment_dict = appointment.dict()
@@ -52,19 +64,14 @@ async def create_appointment(appointment: AppointmentCreate, user_id: str) -> Di
         "created_by": user_id
     })
 
-    result = appointments_collection.insert_one(appointment_dict)
+    await appointments_collection.insert_one(appointment_dict)
 
-    # Get the created appointment
-    created_appointment = appointments_collection.find_one({"_id": result.inserted_id})
-    created_appointment["id"] = str(created_appointment["_id"])
-    del created_appointment["_id"]
-
-    return created_appointment
+    return serialize_document(appointment_dict)
 
 async def get_appointment(appointment_id: str) -> Dict[str, Any]:
     """Get appointment by ID"""
     try:
-        appointment = appointments_collection.find_one({"_id": ObjectId(appointment_id)})
+        appointment = await appointments_collection.find_one({"_id": ObjectId(appointment_id)}, APPOINTMENT_PROJECTION)
     except:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -82,88 +89,93 @@ async def get_appointment(appointment_id: str) -> Dict[str, Any]:
 
     return appointment
 
-async def get_appointments_by_patient(patient_id: str) -> List[Dict[str, Any]]:
-    """Get all appointments for a patient"""
-    appointments = list(appointments_collection.find({"patient_id": patient_id}))
+async def list_appointments(
+    query: Dict[str, Any],
+    status: Optional[AppointmentStatus] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Get a page of the appointments matching a query, ordered by date.
+
+    Returns the appointments and the cursor of the next page (None on the
+    last page).
+    """
+    query = dict(query)
+    if status:
+        query["status"] = status.value
+    if from_date or to_date:
+        date_range = {}
+        if from_date:
+            date_range["$gte"] = from_date
+        if to_date:
+            date_range["$lte"] = to_date
+        query["appointment_date"] = date_range
 
-    # Convert ObjectId to string
-    for appointment in appointments:
-        appointment["id"] = str(appointment["_id"])
-        del appointment["_id"]
+    try:
+        appointments, next_cursor = await fetch_page(
+            appointments_collection, query, APPOINTMENT_SORT, limit, cursor, APPOINTMENT_PROJECTION
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid cursor"
+        )
 
-    return appointments
+    return [serialize_document(appointment) for appointment in appointments], next_cursor
 
-async def get_appointments_by_doctor(doctor_id: str) -> List[Dict[str, Any]]:
-    """Get all appointments for a doctor"""
-    appointments = list(appointments_collection.find({"doctor_id": doctor_id}))
+async def get_appointments_by_patient(patient_id: str, **filters) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Get a page of the appointments of a patient"""
+    return await list_appointments({"patient_id": patient_id}, **filters)
 
-    # Convert ObjectId to string
-    for appointment in appointments:
-        appointment["id"] = str(appointment["_id"])
-        del appointment["_id"]
+async def get_appointments_by_doctor(doctor_id: str, **filters) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Get a page of the appointments of a doctor"""
+    return await list_appointments({"doctor_id": doctor_id}, **filters)
 
-    return appointments
+async def get_appointments_by_hospital(hospital_id: str, **filters) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Get a page of the appointments at a hospital"""
+    return await list_appointments({"hospital_id": hospital_id}, **filters)
+
+async def get_all_appointments(**filters) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Get a page of all appointments"""
+    return await list_appointments({}, **filters)
 
 async def update_appointment(appointment_id: str, appointment_update: AppointmentUpdate) -> Dict[str, Any]:
     """Update an appointment"""
-    try:
-        appointment = appointments_collection.find_one({"_id": ObjectId(appointment_id)})
-    except:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid appointment ID"
-        )
-
-    if not appointment:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Appointment not found"
-        )
-
-    # Update appointment
     update_data = appointment_update.dict(exclude_unset=True)
     update_data["updated_at"] = datetime.now()
 
-    appointments_collection.update_one(
-        {"_id": ObjectId(appointment_id)},
-        {"$set": update_data}
-    )
-
-    # Get updated appointment
-    updated_appointment = appointments_collection.find_one({"_id": ObjectId(appointment_id)})
-    updated_appointment["id"] = str(updated_appointment["_id"])
-    del updated_appointment["_id"]
-
-    return updated_appointment
+    return await _update_appointment(appointment_id, update_data)
 
 async def cancel_appointment(appointment_id: str) -> Dict[str, Any]:
     """Cancel an appointment"""
+    return await _update_appointment(appointment_id, {
+        "status": AppointmentStatus.CANCELLED.value,
+        "updated_at": datetime.now()
+    })
+
+async def _update_appointment(appointment_id: str, update_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply a $set to an appointment and return the updated document in one round trip"""
     try:
-        appointment = appointments_collection.find_one({"_id": ObjectId(appointment_id)})
+        appointment_object_id = ObjectId(appointment_id)
     except:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid appointment ID"
         )
 
-    if not appointment:
+    updated_appointment = await appointments_collection.find_one_and_update(
+        {"_id": appointment_object_id},
+        {"$set": update_data},
+        projection=APPOINTMENT_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+
+    if not updated_appointment:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Appointment not found"
         )
 
-    # Cancel appointment
-    appointments_collection.update_one(
-        {"_id": ObjectId(appointment_id)},
-        {"$set": {
-            "status": AppointmentStatus.CANCELLED.value,
-            "updated_at": datetime.now()
-        }}
-    )
-
-    # Get updated appointment
-    updated_appointment = appointments_collection.find_one({"_id": ObjectId(appointment_id)})
-    updated_appointment["id"] = str(updated_appointment["_id"])
-    del updated_appointment["_id"]
-
-    return updated_appointment
\ No newline at end of file
+    return serialize_document(updated_appointment)
@@ -1,38 +1,72 @@
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
-from pymongo import MongoClient
 from bson import ObjectId
 
 from models.user import UserRole, TokenData, UserResponse
 from config import settings, COLLECTIONS
+from db.repository import get_collection, projection_for, serialize_document
+from core.cache import TTLCache
+from core.executor import BoundedExecutor, ExecutorSaturated
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/users/login")
 
-# MongoDB connection
-client = MongoClient(settings.MONGODB_URL)
-db = client[settings.MONGODB_DB_NAME]
-users_collection = db[COLLECTIONS["users"]]
+# MongoDB collections
+users_collection = get_collection(COLLECTIONS["users"])
 
-def verify_password(plain_password, hashed_password):
+# Fields read on the auth paths: the user as returned by the API, plus the
+# flags checked by the dependencies. The password hash is only fetched to log in.
+CURRENT_USER_PROJECTION = projection_for(UserResponse, "is_active")
+LOGIN_PROJECTION = projection_for(UserResponse, "is_active", "password")
+
+# Users loaded by get_current_user, keyed by the token subject (email). The
+# token itself is still verified on every request; the cache only saves the
+# user lookup. Writes to a user call invalidate_principal, and the TTL bounds
+# how long other worker processes can serve a stale user.
+principal_cache = TTLCache(
+    "auth.principal_cache",
+    maxsize=int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL", "60")),
+)
+
+# bcrypt takes hundreds of milliseconds of CPU per call, so it runs on its own
+# small pool instead of the event loop. Bursts beyond the queue limit get 429s.
+password_executor = BoundedExecutor(
+    "auth.password_hashing",
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    max_queue=int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32")),
+)
+
+async def _run_password_job(fn, *args):
+    try:
+        return await password_executor.run(fn, *args)
+    except ExecutorSaturated:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many password checks in progress, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+
+async def verify_password(plain_password, hashed_password):
     """Verify password against hashed password"""
-    return pwd_context.verify(plain_password, hashed_password)
+    return await _run_password_job(pwd_context.verify, plain_password, hashed_password)
 
-def get_password_hash(password):
+async def get_password_hash(password):
     """Hash a password for storing"""
-    return pwd_context.hash(password)
+    return await _run_password_job(pwd_context.hash, password)
 
 async def authenticate_user(email: str, password: str):
     """Authenticate a user by email and password"""
-    user = users_collection.find_one({"email": email})
+    user = await users_collection.find_one({"email": email}, LOGIN_PROJECTION)
     if not user:
         return False
-    if not verify_password(password, user["password"]):
+    if not await verify_password(password, user["password"]):
         return False
     return user
 
@@ -47,8 +81,20 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.JWT_SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    """Get current user from JWT token"""
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme)):
+    """Get current user from JWT token.
+
+    The user is resolved once per request and kept on request.state, so all
+    the auth dependencies of a route share one token decode and one lookup.
+    """
+    principal = getattr(request.state, "principal", None)
+    if principal is None:
+        principal = await _load_principal(token)
+        request.state.principal = principal
+    return principal
+
+async def _load_principal(token: str):
+    """Decode a JWT and load its user"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -57,22 +103,46 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
         email: str = payload.get("sub")
-        if email is None:
+        # Refresh tokens are signed with the same key but are not access tokens
+        if email is None or payload.get("type") == "refresh":
             raise credentials_exception
         token_data = TokenData(email=email, role=payload.get("role"))
     except JWTError:
         raise credentials_exception
 
-    user = users_collection.find_one({"email": token_data.email})
+    user = await get_user_by_email(token_data.email)
     if user is None:
         raise credentials_exception
+    return user
 
-    # Convert ObjectId to string
-    user["id"] = str(user["_id"])
-    del user["_id"]
-    del user["password"]  # Don't return password
+async def get_user_by_email(email: str) -> Optional[dict]:
+    """Get a user as returned by the API, through the principal cache"""
+    user = principal_cache.get(email)
+    if user is None:
+        user = await users_collection.find_one({"email": email}, CURRENT_USER_PROJECTION)
+        if user is None:
+            return None
+        user = serialize_document(user)
+        principal_cache.set(email, user)
 
-    return user
+    # Callers may modify the user they get
+    return dict(user)
+
+def invalidate_principal(email: str):
+    """Drop a user from the principal cache after it changed"""
+    principal_cache.pop(email)
+
+async def deactivate_user(user_id: str) -> bool:
+    """Deactivate a user, effective on its next request"""
+    user = await users_collection.find_one_and_update(
+        {"_id": ObjectId(user_id)},
+        {"$set": {"is_active": False, "updated_at": datetime.now()}},
+        projection={"email": 1}
+    )
+    if user is None:
+        return False
+    invalidate_principal(user["email"])
+    return True
 
 async def get_current_active_user(current_user: dict = Depends(get_current_user)):
     """Get current active user"""
@@ -82,7 +152,7 @@ async def get_current_active_user(current_user: dict = Depends(get_current_user)
 
 def check_user_role(allowed_roles: list[UserRole]):
     """Check if user has required role"""
-    async def _check_user_role(current_user: dict = Depends(get_current_user)):
+    async def _check_user_role(current_user: dict = Depends(get_current_active_user)):
         if current_user.get("role") not in [role.value for role in allowed_roles]:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
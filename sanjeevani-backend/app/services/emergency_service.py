@@ -1,37 +1,79 @@
+import asyncio
+import logging
+import os
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
-from pymongo import MongoClient
 from bson import ObjectId
 from fastapi import HTTPException, status
-import googlemaps
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
 
-from models.appointment import EmergencyRequestCreate, EmergencyRequestStatus
-from config import settings, COLLECTIONS
+from models.appointment import EmergencyRequestCreate, EmergencyRequestStatus, EmergencyRequestResponse
+from config import COLLECTIONS
 from integrations.twilio_integration import send_emergency_sms
+from integrations.maps_client import MapsApiError, maps_client
+from integrations.route_cache import route_cache, route_element
+from db.repository import get_collection, projection_for, serialize_document
+from core.geo import estimate_travel, haversine_m
+from core.metrics import metrics
+from core.timing import LatencyBreakdown
+from services.hospital_index import hospital_index
+from services.hospital_service import find_nearby_hospitals
 
-# MongoDB connection
-client = MongoClient(settings.MONGODB_URL)
-db = client[settings.MONGODB_DB_NAME]
-emergency_requests_collection = db[COLLECTIONS["emergency_requests"]]
-users_collection = db[COLLECTIONS["users"]]
-patients_collection = db[COLLECTIONS["patients"]]
-hospitals_collection = db[COLLECTIONS["hospitals"]]
+logger = logging.getLogger(__name__)
+
+# MongoDB collections
+emergency_requests_collection = get_collection(COLLECTIONS["emergency_requests"])
+users_collection = get_collection(COLLECTIONS["users"])
+patients_collection = get_collection(COLLECTIONS["patients"])
+hospitals_collection = get_collection(COLLECTIONS["hospitals"])
+
+EMERGENCY_REQUEST_PROJECTION = projection_for(EmergencyRequestResponse)
+
+# Hospitals sent to the Distance Matrix API per emergency, nearest first
+NEAREST_HOSPITAL_CANDIDATES = int(os.getenv("NEAREST_HOSPITAL_CANDIDATES", "10"))
+
+# Deadline of the Distance Matrix call made while an emergency is being
+# created; past it the ETA comes from the local estimate instead
+EMERGENCY_MAPS_DEADLINE = float(os.getenv("EMERGENCY_MAPS_DEADLINE", "1.5"))
+
+# Local travel model: road distance per straight-line meter and average speed
+ROAD_DISTANCE_FACTOR = float(os.getenv("ROAD_DISTANCE_FACTOR", "1.4"))
+AVERAGE_SPEED_KMH = float(os.getenv("AVERAGE_SPEED_KMH", "30"))
+
+# Seconds to wait before each background attempt to replace an estimated ETA
+ROUTE_REFINE_DELAYS = [float(delay) for delay in os.getenv("ROUTE_REFINE_DELAYS", "5,30,120").split(",")]
+
+# Background route refinements in flight, kept so they aren't garbage collected
+_refinements = set()
 
 # Google Maps client
-gmaps = googlemaps.Client(key=settings.GOOGLE_MAPS_API_KEY)
+gmaps = maps_client
 
 async def create_emergency_request(emergency_request: EmergencyRequestCreate, user_id: str) -> Dict[str, Any]:
     """Create a new emergency request"""
+    latency = LatencyBreakdown("emergency.create")
+
     # Check if patient exists
-    patient = patients_collection.find_one({"user_id": emergency_request.patient_id})
+    with latency.phase("patient_check"):
+        patient = await patients_collection.find_one({"user_id": emergency_request.patient_id}, {"_id": 1})
     if not patient:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Patient not found"
         )
 
-    # Find nearest hospitals with emergency services
-    nearest_hospital = await find_nearest_hospital(emergency_request.location)
+    # Find nearest hospital with emergency services and the route to it
+    with latency.phase("routing"):
+        route = await route_to_nearest_hospital(emergency_request.location)
+    nearest_hospital = route.hospital if route else None
+
+    # The phone lookups don't depend on each other
+    with latency.phase("lookups"):
+        patient_phone, hospital_phone = await asyncio.gather(
+            _get_phone(emergency_request.patient_id),
+            _get_phone(nearest_hospital["user_id"] if nearest_hospital else None),
+        )
 
     # Create emergency request
     emergency_dict = emergency_request.dict()
@@ -41,39 +83,44 @@ async def create_emergency_request(emergency_request: EmergencyRequestCreate, us
         "updated_at": datetime.now(),
         "created_by": user_id,
         "hospital_id": nearest_hospital["user_id"] if nearest_hospital else None,
-        "estimated_arrival_time": calculate_eta(emergency_request.location, nearest_hospital["location"]) if nearest_hospital else None
+        "estimated_arrival_time": route.eta() if route else None
     })
 
-    result = emergency_requests_collection.insert_one(emergency_dict)
-
-    # Get the created emergency request
-    created_request = emergency_requests_collection.find_one({"_id": result.inserted_id})
-    created_request["id"] = str(created_request["_id"])
-    del created_request["_id"]
-
-    # Send SMS notification to patient
-    patient_user = users_collection.find_one({"_id": ObjectId(emergency_request.patient_id)})
-    if patient_user and patient_user.get("phone"):
-        await send_emergency_sms(
-            patient_user["phone"],
-            f"Your emergency request has been received. An ambulance will arrive in approximately {calculate_eta_minutes(emergency_request.location, nearest_hospital['location']) if nearest_hospital else 'unknown'} minutes."
-        )
-
-    # Send SMS notification to hospital
-    if nearest_hospital:
-        hospital_user = users_collection.find_one({"_id": ObjectId(nearest_hospital["user_id"])})
-        if hospital_user and hospital_user.get("phone"):
-            await send_emergency_sms(
-                hospital_user["phone"],
-                f"Emergency request received. Patient location: {emergency_request.address if emergency_request.address else 'Unknown'}. Please dispatch ambulance immediately."
-            )
+    with latency.phase("insert"):
+        await emergency_requests_collection.insert_one(emergency_dict)
+    created_request = serialize_document(emergency_dict)
+
+    # An estimated ETA is replaced by a driving time once Google Maps answers
+    if route and route.source == "estimate":
+        _refine_route_later(ObjectId(created_request["id"]), created_request["created_at"], route, emergency_request.location)
+
+    # Send SMS notifications to patient and hospital
+    messages = []
+    if patient_phone:
+        messages.append(send_emergency_sms(
+            patient_phone,
+            f"Your emergency request has been received. An ambulance will arrive in approximately {route.eta_minutes() if route else 'unknown'} minutes."
+        ))
+    if hospital_phone:
+        messages.append(send_emergency_sms(
+            hospital_phone,
+            f"Emergency request received. Patient location: {emergency_request.address if emergency_request.address else 'Unknown'}. Please dispatch ambulance immediately."
+        ))
+    with latency.phase("sms"):
+        await asyncio.gather(*messages)
+
+    latency.finish()
+    logger.info(
+        f"Emergency request {created_request['id']} created: {latency} "
+        f"route_source={route.source if route else 'none'}"
+    )
 
     return created_request
 
 async def get_emergency_request(request_id: str) -> Dict[str, Any]:
     """Get emergency request by ID"""
     try:
-        request = emergency_requests_collection.find_one({"_id": ObjectId(request_id)})
+        request = await emergency_requests_collection.find_one({"_id": ObjectId(request_id)}, EMERGENCY_REQUEST_PROJECTION)
     except:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -93,20 +140,17 @@ async def get_emergency_request(request_id: str) -> Dict[str, Any]:
 
 async def update_emergency_status(request_id: str, status: EmergencyRequestStatus, ambulance_id: Optional[str] = None) -> Dict[str, Any]:
     """Update emergency request status"""
+    # The status parameter shadows fastapi's status module
+    from fastapi import status as http_status
+
     try:
-        request = emergency_requests_collection.find_one({"_id": ObjectId(request_id)})
+        object_id = ObjectId(request_id)
     except:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
+            status_code=http_status.HTTP_400_BAD_REQUEST,
             detail="Invalid emergency request ID"
         )
 
-    if not request:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Emergency request not found"
-        )
-
     # Update status
     update_data = {
         "status": status.value,
@@ -116,18 +160,23 @@ async def update_emergency_status(request_id: str, status: EmergencyRequestStatu
     if ambulance_id:
         update_data["ambulance_id"] = ambulance_id
 
-    emergency_requests_collection.update_one(
-        {"_id": ObjectId(request_id)},
-        {"$set": update_data}
+    updated_request = await emergency_requests_collection.find_one_and_update(
+        {"_id": object_id},
+        {"$set": update_data},
+        projection=EMERGENCY_REQUEST_PROJECTION,
+        return_document=ReturnDocument.AFTER
     )
 
-    # Get updated request
-    updated_request = emergency_requests_collection.find_one({"_id": ObjectId(request_id)})
-    updated_request["id"] = str(updated_request["_id"])
-    del updated_request["_id"]
+    if not updated_request:
+        raise HTTPException(
+            status_code=http_status.HTTP_404_NOT_FOUND,
+            detail="Emergency request not found"
+        )
+
+    updated_request = serialize_document(updated_request)
 
     # Send SMS notification to patient
-    patient_user = users_collection.find_one({"_id": ObjectId(request["patient_id"])})
+    patient_user = await users_collection.find_one({"_id": ObjectId(updated_request["patient_id"])}, {"phone": 1})
     if patient_user and patient_user.get("phone"):
         status_message = {
             EmergencyRequestStatus.ACCEPTED.value: "Your emergency request has been accepted by the hospital.",
@@ -143,115 +192,178 @@ async def update_emergency_status(request_id: str, status: EmergencyRequestStatu
 
     return updated_request
 
-async def find_nearest_hospital(location: Dict[str, float]) -> Optional[Dict[str, Any]]:
-    """Find the nearest hospital with emergency services"""
-    hospitals = list(hospitals_collection.find({"emergency_services": True}))
-
-    if not hospitals:
-        return None
-
-    # Get hospital locations
-    hospital_locations = []
-    for hospital in hospitals:
-        if "address" in hospital and "location" in hospital:
-            hospital_locations.append({
-                "user_id": hospital["user_id"],
-                "location": hospital["location"],
-                "name": hospital.get("name", "Unknown Hospital")
-            })
-
-    if not hospital_locations:
-        return None
-
-    # Calculate distances using Google Maps Distance Matrix API
-    origins = [(location["latitude"], location["longitude"])]
-    destinations = [(h["location"]["latitude"], h["location"]["longitude"]) for h in hospital_locations]
+class EmergencyRoute:
+    """Route from an emergency to the hospital chosen for it.
+
+    Holds the driving distance and time from whichever source produced them
+    (the route cache, the Distance Matrix API, or the local
+    travel model when Google Maps is unavailable), so the ETA of a request
+    is computed once.
+    """
+
+    def __init__(self, hospital: Dict[str, Any], distance_meters: int, duration_seconds: int, source: str):
+        self.hospital = hospital
+        self.distance_meters = distance_meters
+        self.duration_seconds = duration_seconds
+        self.source = source
+
+    def eta(self) -> datetime:
+        """Estimated time of arrival"""
+        return datetime.now() + timedelta(seconds=self.duration_seconds)
+
+    def eta_minutes(self) -> int:
+        """Estimated time of arrival in minutes"""
+        return int(self.duration_seconds / 60)
+
+def _estimated_route(hospital: Dict[str, Any], origin: Dict[str, float]) -> EmergencyRoute:
+    """Route to a hospital from the local travel model, without Google Maps"""
+    destination = hospital["location"]
+    distance, duration = estimate_travel(
+        haversine_m(origin["latitude"], origin["longitude"], destination["latitude"], destination["longitude"]),
+        ROAD_DISTANCE_FACTOR, AVERAGE_SPEED_KMH
+    )
+    return EmergencyRoute(hospital, int(distance), int(duration), source="estimate")
 
+async def _candidate_hospitals(location: Dict[str, float]) -> List[Dict[str, Any]]:
+    """Hospitals with emergency services closest to a location in a straight line, nearest first"""
     try:
-        distance_matrix = gmaps.distance_matrix(
-            origins=origins,
-            destinations=destinations,
-            mode="driving",
-            units="metric"
+        candidates = await find_nearby_hospitals(
+            location["latitude"], location["longitude"],
+            limit=NEAREST_HOSPITAL_CANDIDATES, emergency_only=True
         )
+        candidates = [
+            {"user_id": h["user_id"], "location": h["location"], "name": h.get("name", "Unknown Hospital")}
+            for h in candidates if "user_id" in h
+        ]
+    except OperationFailure as e:
+        # No usable 2dsphere index (e.g. still being built)
+        logger.warning(f"$geoNear failed, using the hospital index: {str(e)}")
+        candidates = []
+    if candidates:
+        return candidates
+
+    # Nothing within the search radius: an emergency still goes to the
+    # nearest hospital however far, which the in-memory index finds
+    await hospital_index.ensure_fresh()
+    nearest = hospital_index.nearest(location["latitude"], location["longitude"], NEAREST_HOSPITAL_CANDIDATES)
+    return [hospital for _, hospital in nearest]
+
+async def route_to_nearest_hospital(location: Dict[str, float]) -> Optional[EmergencyRoute]:
+    """Find the nearest hospital with emergency services by driving distance"""
+    # Only the closest hospitals in a straight line are worth routing to
+    hospital_locations = await _candidate_hospitals(location)
+    if not hospital_locations:
+        return None
 
-        # Find the nearest hospital
-        min_distance = float('inf')
-        nearest_hospital = None
-
-        for i, row in enumerate(distance_matrix["rows"]):
-            for j, element in enumerate(row["elements"]):
-                if element["status"] == "OK":
-                    distance = element["distance"]["value"]  # in meters
-                    if distance < min_distance:
-                        min_distance = distance
-                        nearest_hospital = hospital_locations[j]
-
-        return nearest_hospital
-    except Exception as e:
-        # Fallback to simple distance calculation if Google Maps API fails
-        min_distance = float('inf')
-        nearest_hospital = None
-
-        for hospital in hospital_locations:
-            distance = calculate_distance(
-                location["latitude"], location["longitude"],
-                hospital["location"]["latitude"], hospital["location"]["longitude"]
+    # Driving distances from this neighbourhood may already be cached
+    origin = (location["latitude"], location["longitude"])
+    elements = {}
+    uncached = []
+    for hospital in hospital_locations:
+        element = route_cache.get(origin, hospital["user_id"])
+        if element is None:
+            uncached.append(hospital)
+        else:
+            elements[hospital["user_id"]] = element
+
+    fetched = set()
+    maps_failed = False
+    if uncached:
+        try:
+            # Calculate distances using Google Maps Distance Matrix API
+            distance_matrix = await gmaps.distance_matrix(
+                origins=[origin],
+                destinations=[(h["location"]["latitude"], h["location"]["longitude"]) for h in uncached],
+                mode="driving",
+                units="metric",
+                timeout=EMERGENCY_MAPS_DEADLINE
             )
-            if distance < min_distance:
-                min_distance = distance
-                nearest_hospital = hospital
+            for hospital, element in zip(uncached, distance_matrix["rows"][0]["elements"]):
+                if element["status"] == "OK":
+                    route_cache.set(origin, hospital["user_id"], element)
+                    elements[hospital["user_id"]] = element
+                    fetched.add(hospital["user_id"])
+        except Exception as e:
+            logger.warning(f"Distance Matrix request failed, estimating the route: {str(e)}")
+            maps_failed = True
+
+    # Find the nearest hospital by driving distance (in meters)
+    routes = []
+    reachable = [h for h in hospital_locations if h["user_id"] in elements]
+    if reachable:
+        nearest = min(reachable, key=lambda h: elements[h["user_id"]]["distance"]["value"])
+        element = elements[nearest["user_id"]]
+        routes.append(EmergencyRoute(
+            nearest,
+            distance_meters=element["distance"]["value"],
+            duration_seconds=element["duration"]["value"],
+            source="distance_matrix" if nearest["user_id"] in fetched else "cache",
+        ))
+    elif not maps_failed:
+        logger.warning("Distance Matrix found no route to any candidate hospital, estimating the route")
+
+    if maps_failed or not routes:
+        # Don't leave an emergency without a hospital because of Google Maps:
+        # estimate the route to the straight-line nearest hospital from the
+        # local travel model, unless a cached route is shorter
+        routes.append(_estimated_route(hospital_locations[0], location))
+    return min(routes, key=lambda route: route.distance_meters)
+
+async def find_nearest_hospital(location: Dict[str, float]) -> Optional[Dict[str, Any]]:
+    """Find the nearest hospital with emergency services"""
+    route = await route_to_nearest_hospital(location)
+    return route.hospital if route else None
+
+def _refine_route_later(request_id: ObjectId, created_at: datetime, route: EmergencyRoute, origin: Dict[str, float]) -> None:
+    task = asyncio.create_task(_refine_route(request_id, created_at, route, origin))
+    _refinements.add(task)
+    task.add_done_callback(_refinements.discard)
+
+async def _refine_route(request_id: ObjectId, created_at: datetime, route: EmergencyRoute, origin: Dict[str, float]) -> None:
+    """Retry Directions for a route estimated locally and update the
+    request's ETA with the driving time once it answers"""
+    for delay in ROUTE_REFINE_DELAYS:
+        await asyncio.sleep(delay)
+        try:
+            if await _refine_route_once(request_id, created_at, route, origin):
+                return
+        except MapsApiError as e:
+            logger.info(f"Directions retry for emergency request {request_id} failed: {str(e)}")
+        except Exception:
+            # Nothing awaits this task, so its errors are only seen here
+            logger.exception(f"Refining the route of emergency request {request_id} failed")
+
+async def _refine_route_once(request_id: ObjectId, created_at: datetime, route: EmergencyRoute, origin: Dict[str, float]) -> bool:
+    """Replace the estimated ETA of a request with the Directions driving
+    time. Returns whether there is nothing left to retry."""
+    origin_point = (origin["latitude"], origin["longitude"])
+    destination = route.hospital["location"]
+    directions = await gmaps.directions(
+        origin=origin_point,
+        destination=(destination["latitude"], destination["longitude"]),
+        mode="driving"
+    )
+    if not directions:
+        return True
+
+    element = route_element(directions[0]["legs"][0])
+    route_cache.set(origin_point, route.hospital["user_id"], element)
+    await emergency_requests_collection.update_one(
+        {"_id": request_id},
+        {"$set": {
+            "estimated_arrival_time": created_at + timedelta(seconds=element["duration"]["value"]),
+            "updated_at": datetime.now(),
+        }}
+    )
+    metrics.counter("emergency.routes_refined").inc()
+    return True
 
-        return nearest_hospital
+async def _get_phone(user_id: Optional[str]) -> Optional[str]:
+    if not user_id:
+        return None
+    user = await users_collection.find_one({"_id": ObjectId(user_id)}, {"phone": 1})
+    return user.get("phone") if user else None
 
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Calculate distance between two points using Haversine formula"""
-    from math import radians, cos, sin, asin, sqrt
-
-    # Convert decimal degrees to radians
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-
-    # Haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    r = 6371  # Radius of earth in kilometers
-
-    return c * r * 1000  # Convert to meters
-
-def calculate_eta(origin: Dict[str, float], destination: Dict[str, float]) -> datetime:
-    """Calculate estimated time of arrival"""
-    try:
-        directions = gmaps.directions(
-            origin=(origin["latitude"], origin["longitude"]),
-            destination=(destination["latitude"], destination["longitude"]),
-            mode="driving"
-        )
-
-        if directions and len(directions) > 0:
-            duration_seconds = directions[0]["legs"][0]["duration"]["value"]
-            return datetime.now() + timedelta(seconds=duration_seconds)
-    except:
-        pass
-
-    # Fallback: assume 30 minutes if Google Maps API fails
-    return datetime.now() + timedelta(minutes=30)
-
-def calculate_eta_minutes(origin: Dict[str, float], destination: Dict[str, float]) -> int:
-    """Calculate estimated time of arrival in minutes"""
-    try:
-        directions = gmaps.directions(
-            origin=(origin["latitude"], origin["longitude"]),
-            destination=(destination["latitude"], destination["longitude"]),
-            mode="driving"
-        )
-
-        if directions and len(directions) > 0:
-            duration_seconds = directions[0]["legs"][0]["duration"]["value"]
-            return int(duration_seconds / 60)
-    except:
-        pass
-
-    # Fallback: assume 30 minutes if Google Maps API fails
-    return 30
\ No newline at end of file
+    return haversine_m(lat1, lon1, lat2, lon2)
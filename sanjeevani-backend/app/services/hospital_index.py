@@ -0,0 +1,157 @@
+"""
+In-memory spatial index of hospitals with emergency services.
+
+Hospitals are bucketed into a grid of HOSPITAL_INDEX_CELL_DEGREES cells, so
+finding the k nearest ones by straight-line distance only looks at the
+cells around the origin instead of every hospital. find_nearest_hospital
+uses it to send a bounded number of candidates to the routing API.
+
+The index is loaded from the hospitals collection on first use and
+reloaded when it is older than HOSPITAL_INDEX_TTL seconds or after
+invalidate() is called, which hospital profile updates do. The TTL picks
+up changes made through other workers.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import COLLECTIONS
+from core.geo import METERS_PER_DEGREE, CoordinateTable, haversine_vector, smallest_k
+from db.repository import get_collection
+
+logger = logging.getLogger(__name__)
+
+HOSPITAL_INDEX_CELL_DEGREES = float(os.getenv("HOSPITAL_INDEX_CELL_DEGREES", "0.05"))
+HOSPITAL_INDEX_TTL = float(os.getenv("HOSPITAL_INDEX_TTL", "300"))
+
+# MongoDB collections
+hospitals_collection = get_collection(COLLECTIONS["hospitals"])
+
+Cell = Tuple[int, int]
+
+
+class HospitalIndex:
+    """Grid index over hospital coordinates"""
+
+    def __init__(self, cell_degrees: float = HOSPITAL_INDEX_CELL_DEGREES, ttl: float = HOSPITAL_INDEX_TTL):
+        self.cell_degrees = cell_degrees
+        self.ttl = ttl
+        self._table = CoordinateTable([])
+        self._cells: Dict[Cell, np.ndarray] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def _cell(self, latitude: float, longitude: float) -> Cell:
+        return (math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees))
+
+    def build(self, hospitals: List[Dict[str, Any]]) -> None:
+        """Replace the indexed hospitals.
+
+        Each hospital needs a user_id and a location with latitude and
+        longitude; others are skipped.
+        """
+        entries = []
+        for hospital in hospitals:
+            location = hospital.get("location") or {}
+            if "user_id" not in hospital or "latitude" not in location or "longitude" not in location:
+                continue
+            entries.append({
+                "user_id": hospital["user_id"],
+                "location": {"latitude": location["latitude"], "longitude": location["longitude"]},
+                "name": hospital.get("name", "Unknown Hospital"),
+            })
+
+        # Cells hold positions in the coordinate table
+        cells = defaultdict(list)
+        for position, entry in enumerate(entries):
+            cells[self._cell(entry["location"]["latitude"], entry["location"]["longitude"])].append(position)
+
+        self._table = CoordinateTable(entries)
+        self._cells = {cell: np.array(positions) for cell, positions in cells.items()}
+        self._loaded_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        """Reload the index from the database on its next use"""
+        self._loaded_at = None
+
+    def _stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl
+
+    async def refresh(self) -> None:
+        """Load the hospitals with emergency services from the database"""
+        hospitals = await hospitals_collection.find(
+            {"emergency_services": True, "address": {"$exists": True}},
+            {"user_id": 1, "location": 1, "name": 1}
+        ).to_list(length=None)
+        self.build(hospitals)
+        logger.info(f"Indexed {len(self._table)} emergency hospitals")
+
+    async def ensure_fresh(self) -> None:
+        if self._stale():
+            async with self._lock:
+                # Another request may have reloaded the index while we waited
+                if self._stale():
+                    await self.refresh()
+
+    def _ring(self, center: Cell, radius: int) -> List[Cell]:
+        """Cells at exactly radius steps (Chebyshev distance) from center"""
+        row, col = center
+        if radius == 0:
+            return [center]
+        cells = []
+        for dc in range(-radius, radius + 1):
+            cells.append((row - radius, col + dc))
+            cells.append((row + radius, col + dc))
+        for dr in range(-radius + 1, radius):
+            cells.append((row + dr, col - radius))
+            cells.append((row + dr, col + radius))
+        return cells
+
+    def nearest(self, latitude: float, longitude: float, k: int) -> List[Tuple[float, Dict[str, Any]]]:
+        """The k hospitals closest to a point, as (distance in meters, hospital)
+        pairs, nearest first"""
+        table = self._table
+        if k <= 0 or not len(table):
+            return []
+
+        center = self._cell(latitude, longitude)
+        # Any point outside the first r rings is at least r cell widths away.
+        # Cells are narrowest east-west, so use that width, measured at the
+        # latitude farthest from the equator that the search can reach.
+        positions = np.empty(0, dtype=int)
+        distances = np.empty(0)
+        radius = 0
+        while len(positions) < len(table):
+            if (2 * radius + 1) ** 2 > len(self._cells):
+                # The search window has more cells than the index has
+                # buckets (sparse hospitals far away); check them all at once
+                return table.nearest(latitude, longitude, k)
+
+            ring = [self._cells[cell] for cell in self._ring(center, radius) if cell in self._cells]
+            if ring:
+                found = np.concatenate(ring)
+                positions = np.concatenate([positions, found])
+                distances = np.concatenate([distances, haversine_vector(
+                    latitude, longitude, table.latitudes[found], table.longitudes[found]
+                )])
+
+            if len(positions) >= k:
+                edge_latitude = min(abs(latitude) + (radius + 1) * self.cell_degrees, 89.0)
+                cell_width = self.cell_degrees * METERS_PER_DEGREE * math.cos(math.radians(edge_latitude))
+                if np.partition(distances, k - 1)[k - 1] <= radius * cell_width:
+                    break
+            radius += 1
+
+        return [(float(distances[i]), table.items[positions[i]]) for i in smallest_k(distances, k)]
+
+hospital_index = HospitalIndex()
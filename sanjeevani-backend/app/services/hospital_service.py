@@ -0,0 +1,67 @@
+import os
+from typing import List, Dict, Any
+
+from config import COLLECTIONS
+from core.geo import geo_point
+from db.repository import get_collection, serialize_document
+
+# MongoDB collections
+hospitals_collection = get_collection(COLLECTIONS["hospitals"])
+
+# Default radius of nearby hospital searches, in meters
+HOSPITAL_SEARCH_RADIUS = float(os.getenv("HOSPITAL_SEARCH_RADIUS", "50000"))
+
+# Fields returned by nearby hospital searches
+NEARBY_HOSPITAL_PROJECTION = {
+    "user_id": 1, "name": 1, "address": 1, "location": 1, "contact_details": 1,
+    "emergency_services": 1, "ambulance_services": 1, "distance": 1,
+}
+
+async def find_nearby_hospitals(
+    latitude: float,
+    longitude: float,
+    max_distance: float = HOSPITAL_SEARCH_RADIUS,
+    limit: int = 10,
+    emergency_only: bool = False,
+) -> List[Dict[str, Any]]:
+    """Find the hospitals closest to a point, nearest first.
+
+    Uses the 2dsphere index on the GeoJSON mirror (geo) of the hospital
+    locations. Each hospital gets its distance from the point in meters.
+    """
+    query = {"emergency_services": True} if emergency_only else {}
+    hospitals = await hospitals_collection.aggregate([
+        {"$geoNear": {
+            "near": geo_point({"latitude": latitude, "longitude": longitude}),
+            "key": "geo",
+            "distanceField": "distance",
+            "maxDistance": max_distance,
+            "query": query,
+            "spherical": True,
+        }},
+        {"$limit": limit},
+        {"$project": NEARBY_HOSPITAL_PROJECTION},
+    ]).to_list(length=limit)
+
+    return [serialize_document(hospital) for hospital in hospitals]
+
+async def backfill_hospital_geo() -> int:
+    """Add the GeoJSON mirror to hospitals that only have a location.
+
+    Returns the number of hospitals updated.
+    """
+    hospitals = await hospitals_collection.find(
+        {"location": {"$exists": True}, "geo": {"$exists": False}},
+        {"location": 1}
+    ).to_list(length=None)
+
+    updated = 0
+    for hospital in hospitals:
+        location = hospital["location"]
+        if not isinstance(location, dict) or "latitude" not in location or "longitude" not in location:
+            continue
+        # Mock documents may be keyed by id instead of _id
+        key = {"_id": hospital["_id"]} if "_id" in hospital else {"id": hospital["id"]}
+        await hospitals_collection.update_one(key, {"$set": {"geo": geo_point(location)}})
+        updated += 1
+    return updated
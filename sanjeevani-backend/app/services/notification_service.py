@@ -2,87 +2,215 @@
 Notification service for Sanjeevani 2.0
 """
 
+import asyncio
 import logging
-from typing import List, Optional, Dict, Any
+import os
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime
 
-from fastapi import Depends
-from motor.motor_asyncio import AsyncIOMotorDatabase
+from bson import ObjectId
+from pymongo import DESCENDING
 
-from app.db.mongodb import get_database
-from app.models.notification import (
+from config import COLLECTIONS
+from db.pagination import encode_cursor, fetch_page
+from db.repository import get_collection
+from models.notification import (
     Notification,
     NotificationCreate,
     NotificationUpdate,
     NotificationInDB,
     NotificationType
 )
-from app.models.common import PaginatedResponse
+from models.common import PaginatedResponse
 
 logger = logging.getLogger(__name__)
 
+# Seconds between passes of the counter reconciliation job (0 disables it)
+NOTIFICATION_RECONCILE_INTERVAL = float(os.getenv("NOTIFICATION_RECONCILE_INTERVAL", "3600"))
+
+# MongoDB collections
+notifications_collection = get_collection(COLLECTIONS["notifications"])
+notification_counters_collection = get_collection(COLLECTIONS["notification_counters"])
+
+# Newest first; _id breaks ties between notifications created in the same instant
+NOTIFICATION_SORT = [("created_at", DESCENDING), ("_id", DESCENDING)]
+
+
+def _notification_key(notification_id: str) -> Dict[str, Any]:
+    """Filter for a notification by the string form of its ObjectId"""
+    return {"_id": ObjectId(notification_id) if ObjectId.is_valid(notification_id) else notification_id}
+
 
 class NotificationService:
     """Service for handling notifications"""
 
-    def __init__(self, db: AsyncIOMotorDatabase = Depends(get_database)):
-        self.db = db
-        self.collection = db.notifications
+    def __init__(self):
+        self.collection = notifications_collection
+        # One {_id: user_id, total, unread} document per user, kept in step
+        # with the notifications so listings and badges don't have to count
+        self.counters = notification_counters_collection
+
+    async def _increment_counters(self, user_id: Optional[str], total: int = 0, unread: int = 0) -> None:
+        if user_id is None or not (total or unread):
+            return
+        increment = {"$inc": {"total": total, "unread": unread}}
+        result = await self.counters.update_one({"_id": user_id}, increment)
+        if result.matched_count:
+            return
+
+        # No counter yet (notifications created before counters existed): seed
+        # it from the notifications, which already include this change. If a
+        # concurrent write seeded it first, apply the change to that counter
+        _, seeded = await self._seed_counter(user_id)
+        if not seeded:
+            await self.counters.update_one({"_id": user_id}, increment)
+
+    async def _get_counter(self, user_id: str, field: str) -> int:
+        """Get the total or unread count of a user from its counter"""
+        counter = await self.counters.find_one({"_id": user_id}, {field: 1})
+        if counter is not None:
+            return counter.get(field, 0)
+
+        counts, _ = await self._seed_counter(user_id)
+        return counts[field]
+
+    async def _seed_counter(self, user_id: str) -> Tuple[Dict[str, int], bool]:
+        """Count the notifications of a user and create its counter from the
+        counts, unless a concurrent write created it first. Returns the counts
+        and whether the counter was created."""
+        counts = await self._count(user_id)
+        result = await self.counters.update_one({"_id": user_id}, {"$setOnInsert": counts}, upsert=True)
+        return counts, result.upserted_id is not None
+
+    async def _count(self, user_id: str) -> Dict[str, int]:
+        return {
+            "total": await self.collection.count_documents({"user_id": user_id}),
+            "unread": await self.collection.count_documents({"user_id": user_id, "read": False}),
+        }
+
+    async def reconcile_counters(self, user_id: Optional[str] = None) -> int:
+        """Recount the notifications of one user, or of every user, and repair
+        the counters that drifted (e.g. after a crash between a write and its
+        counter update). Returns the number of counters corrected.
+
+        A write landing while its user is being recounted can be overwritten,
+        so run the full pass when traffic is low.
+        """
+        match = {"user_id": user_id} if user_id else {"user_id": {"$ne": None}}
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": "$user_id",
+                "total": {"$sum": 1},
+                "unread": {"$sum": {"$cond": [{"$eq": ["$read", False]}, 1, 0]}},
+            }},
+        ]
+        counts = {
+            doc["_id"]: {"total": doc["total"], "unread": doc["unread"]}
+            async for doc in self.collection.aggregate(pipeline)
+        }
+
+        # Users whose notifications were all deleted no longer show up in the
+        # recount, so compare against every existing counter as well
+        counter_query = {"_id": user_id} if user_id else {}
+        stored = {
+            doc["_id"]: {"total": doc.get("total", 0), "unread": doc.get("unread", 0)}
+            async for doc in self.counters.find(counter_query)
+        }
+
+        # Drift is rare, so the repairs are written one by one
+        repaired = 0
+        for counter_id in counts.keys() | stored.keys():
+            expected = counts.get(counter_id, {"total": 0, "unread": 0})
+            if stored.get(counter_id) != expected:
+                await self.counters.update_one({"_id": counter_id}, {"$set": expected}, upsert=True)
+                repaired += 1
+
+        if repaired:
+            logger.warning(f"Repaired {repaired} drifted notification counters")
+        return repaired
 
     async def create_notification(self, notification: Notification) -> NotificationInDB:
         """Create a new notification"""
         notification_dict = notification.dict(by_alias=True)
         result = await self.collection.insert_one(notification_dict)
         notification_dict["_id"] = result.inserted_id
+        await self._increment_counters(notification.user_id, total=1, unread=0 if notification.read else 1)
         return NotificationInDB(**notification_dict)
 
     async def get_notification(self, notification_id: str) -> Optional[NotificationInDB]:
         """Get a notification by ID"""
-        notification = await self.collection.find_one({"_id": notification_id})
+        notification = await self.collection.find_one(_notification_key(notification_id))
         if notification:
             return NotificationInDB(**notification)
         return None
 
     async def get_user_notifications(
-        self, user_id: str, page: int = 1, limit: int = 20, unread_only: bool = False
+        self, user_id: str, page: int = 1, limit: int = 20, unread_only: bool = False,
+        after: Optional[str] = None
     ) -> PaginatedResponse:
-        """Get notifications for a user with pagination"""
-        skip = (page - 1) * limit
+        """Get notifications for a user, newest first.
+
+        With an after token (the next_after of the previous response) the page
+        is read with keyset pagination and costs the same at any depth; page
+        numbers are kept for older clients and skip over the earlier pages.
+        Raises ValueError for an invalid after token.
+        """
         query = {"user_id": user_id}
         
         if unread_only:
             query["read"] = False
-            
-        # Get total count
-        total = await self.collection.count_documents(query)
+            total = await self._get_counter(user_id, "unread")
+        else:
+            total = await self._get_counter(user_id, "total")
+
+        if after:
+            documents, next_after = await fetch_page(self.collection, query, NOTIFICATION_SORT, limit, after)
+            return PaginatedResponse(
+                total=total,
+                limit=limit,
+                items=[NotificationInDB(**doc) for doc in documents],
+                next_after=next_after
+            )
+
+        skip = (page - 1) * limit
         
         # Get notifications with pagination
         cursor = self.collection.find(query)
-        cursor.sort("created_at", -1)  # Sort by created_at descending
+        cursor.sort(NOTIFICATION_SORT)
         cursor.skip(skip).limit(limit)
         
-        notifications = []
-        async for doc in cursor:
-            notifications.append(NotificationInDB(**doc))
+        documents = await cursor.to_list(length=None)
             
         # Calculate total pages
         pages = (total + limit - 1) // limit
+
+        # Let the client continue with cursors from here
+        next_after = None
+        if len(documents) == limit and skip + limit < total:
+            next_after = encode_cursor(documents[-1], NOTIFICATION_SORT)
         
         return PaginatedResponse(
             total=total,
             page=page,
             limit=limit,
             pages=pages,
-            items=notifications
+            items=[NotificationInDB(**doc) for doc in documents],
+            next_after=next_after
         )
 
     async def mark_as_read(self, notification_id: str) -> bool:
         """Mark a notification as read"""
-        result = await self.collection.update_one(
-            {"_id": notification_id},
-            {"$set": {"read": True}}
+        # Only an unread notification changes, so the counter is decremented once
+        notification = await self.collection.find_one_and_update(
+            {**_notification_key(notification_id), "read": False},
+            {"$set": {"read": True}},
+            projection={"user_id": 1}
         )
-        return result.modified_count > 0
+        if notification is None:
+            return False
+        await self._increment_counters(notification.get("user_id"), unread=-1)
+        return True
 
     async def mark_all_as_read(self, user_id: str) -> int:
         """Mark all notifications for a user as read"""
@@ -90,12 +218,20 @@ class NotificationService:
             {"user_id": user_id, "read": False},
             {"$set": {"read": True}}
         )
+        # Decrement by what changed rather than zeroing, so notifications
+        # created meanwhile stay counted
+        await self._increment_counters(user_id, unread=-result.modified_count)
         return result.modified_count
 
     async def delete_notification(self, notification_id: str) -> bool:
         """Delete a notification"""
-        result = await self.collection.delete_one({"_id": notification_id})
-        return result.deleted_count > 0
+        deleted = await self.collection.find_one_and_delete(_notification_key(notification_id), {"user_id": 1, "read": 1})
+        if deleted is None:
+            return False
+        await self._increment_counters(
+            deleted.get("user_id"), total=-1, unread=0 if deleted.get("read") else -1
+        )
+        return True
 
     async def create_appointment_notification(
         self, user_id: str, title: str, message: str, appointment_data: Dict[str, Any]
@@ -164,4 +300,16 @@ class NotificationService:
 
     async def get_unread_count(self, user_id: str) -> int:
         """Get count of unread notifications for a user"""
-        return await self.collection.count_documents({"user_id": user_id, "read": False})
+        return await self._get_counter(user_id, "unread")
+
+
+async def reconcile_counters_periodically(
+    service: NotificationService, interval: float = NOTIFICATION_RECONCILE_INTERVAL
+) -> None:
+    """Repair drifted notification counters every interval seconds until cancelled"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await service.reconcile_counters()
+        except Exception as e:
+            logger.error(f"Notification counter reconciliation failed: {str(e)}")
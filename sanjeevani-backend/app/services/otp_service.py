@@ -0,0 +1,181 @@
+"""
+One-time password store for phone verification.
+
+OTPs live in their own store, one entry per phone number, instead of on
+user documents:
+
+    {_id: phone, code_hash, expires_at, attempts, last_sent_at,
+     window_start, sends, purge_at}
+
+The code is stored hashed. Each code accepts OTP_MAX_ATTEMPTS guesses, and
+each phone can be sent OTP_MAX_SENDS codes per OTP_SEND_WINDOW seconds, at
+least OTP_RESEND_INTERVAL seconds apart.
+
+OTP_STORE selects the backend: "mongo" (default) keeps entries in the
+otp_codes collection, where a TTL index on purge_at deletes them once both
+the code and the rate limit window are over; "memory" keeps them in this
+process, for single-worker deployments and development.
+"""
+
+import hashlib
+import hmac
+import os
+import secrets
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from pymongo import ReturnDocument
+
+from config import settings, COLLECTIONS
+from db.repository import get_collection
+
+OTP_LENGTH = 6
+OTP_TTL = int(os.getenv("OTP_TTL", "600"))
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
+OTP_RESEND_INTERVAL = int(os.getenv("OTP_RESEND_INTERVAL", "30"))
+OTP_MAX_SENDS = int(os.getenv("OTP_MAX_SENDS", "5"))
+OTP_SEND_WINDOW = int(os.getenv("OTP_SEND_WINDOW", "3600"))
+OTP_STORE = os.getenv("OTP_STORE", "mongo").lower()
+
+
+class OTPRateLimited(Exception):
+    """Raised when a phone number asks for OTPs too often"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+def _hash_code(phone: str, code: str) -> str:
+    return hmac.new(settings.JWT_SECRET_KEY.encode(), f"{phone}:{code}".encode(), hashlib.sha256).hexdigest()
+
+
+class MongoOTPStore:
+    """OTP entries in the otp_codes collection"""
+
+    def __init__(self):
+        self.collection = get_collection(COLLECTIONS["otp_codes"])
+
+    async def get(self, phone: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"_id": phone})
+
+    async def claim_send(self, phone: str, last_sent_at: Optional[datetime], entry: Dict[str, Any]) -> bool:
+        """Save the entry of a new code, unless another send changed the entry
+        since it was read with last_sent_at (None when there was no entry).
+        Returns whether the entry was saved."""
+        if last_sent_at is None:
+            result = await self.collection.update_one({"_id": phone}, {"$setOnInsert": entry}, upsert=True)
+            return result.upserted_id is not None
+        result = await self.collection.update_one({"_id": phone, "last_sent_at": last_sent_at}, {"$set": entry})
+        return result.matched_count == 1
+
+    async def use_attempt(self, phone: str, now: datetime) -> Optional[Dict[str, Any]]:
+        """Count a guess against the live code of a phone and return its entry,
+        or None when there is no code left to guess"""
+        return await self.collection.find_one_and_update(
+            {"_id": phone, "expires_at": {"$gt": now}, "attempts": {"$lt": OTP_MAX_ATTEMPTS}},
+            {"$inc": {"attempts": 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def consume(self, phone: str, code_hash: str) -> bool:
+        """Remove a code so it can't be used again; False if it was already used.
+        The entry stays for the send rate limit."""
+        result = await self.collection.update_one(
+            {"_id": phone, "code_hash": code_hash}, {"$unset": {"code_hash": ""}}
+        )
+        return result.modified_count == 1
+
+
+class MemoryOTPStore:
+    """OTP entries in a dict of this process"""
+
+    def __init__(self):
+        self.entries: Dict[str, Dict[str, Any]] = {}
+
+    def _purge(self, now: datetime) -> None:
+        expired = [phone for phone, entry in self.entries.items() if entry["purge_at"] <= now]
+        for phone in expired:
+            del self.entries[phone]
+
+    async def get(self, phone: str) -> Optional[Dict[str, Any]]:
+        self._purge(datetime.utcnow())
+        entry = self.entries.get(phone)
+        return dict(entry) if entry else None
+
+    async def claim_send(self, phone: str, last_sent_at: Optional[datetime], entry: Dict[str, Any]) -> bool:
+        current = self.entries.get(phone)
+        if (current["last_sent_at"] if current else None) != last_sent_at:
+            return False
+        self.entries[phone] = {**(current or {}), **entry}
+        return True
+
+    async def use_attempt(self, phone: str, now: datetime) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(phone)
+        if not entry or entry["expires_at"] <= now or entry["attempts"] >= OTP_MAX_ATTEMPTS:
+            return None
+        entry["attempts"] += 1
+        return dict(entry)
+
+    async def consume(self, phone: str, code_hash: str) -> bool:
+        entry = self.entries.get(phone)
+        if not entry or entry.get("code_hash") != code_hash:
+            return False
+        del entry["code_hash"]
+        return True
+
+
+otp_store = MemoryOTPStore() if OTP_STORE == "memory" else MongoOTPStore()
+
+
+async def issue_otp(phone: str) -> str:
+    """Create a new OTP for a phone number, replacing any previous one.
+
+    Raises OTPRateLimited when the phone asked for a code too recently or too
+    often.
+    """
+    now = datetime.utcnow()
+    entry = await otp_store.get(phone)
+
+    sends = 0
+    window_start = now
+    if entry and entry["window_start"] + timedelta(seconds=OTP_SEND_WINDOW) > now:
+        sends = entry["sends"]
+        window_start = entry["window_start"]
+
+        resend_at = entry["last_sent_at"] + timedelta(seconds=OTP_RESEND_INTERVAL)
+        if resend_at > now:
+            raise OTPRateLimited(int((resend_at - now).total_seconds()) + 1)
+        if sends >= OTP_MAX_SENDS:
+            window_end = window_start + timedelta(seconds=OTP_SEND_WINDOW)
+            raise OTPRateLimited(int((window_end - now).total_seconds()) + 1)
+
+    code = "".join(secrets.choice("0123456789") for _ in range(OTP_LENGTH))
+    expires_at = now + timedelta(seconds=OTP_TTL)
+    # Saved only if no other send got in since the entry was read, so
+    # concurrent requests can't both pass the limits
+    saved = await otp_store.claim_send(phone, entry["last_sent_at"] if entry else None, {
+        "code_hash": _hash_code(phone, code),
+        "expires_at": expires_at,
+        "attempts": 0,
+        "last_sent_at": now,
+        "window_start": window_start,
+        "sends": sends + 1,
+        "purge_at": max(expires_at, window_start + timedelta(seconds=OTP_SEND_WINDOW)),
+    })
+    if not saved:
+        raise OTPRateLimited(OTP_RESEND_INTERVAL)
+    return code
+
+
+async def verify_otp(phone: str, code: str) -> bool:
+    """Check a code against the OTP of a phone number; a code works only once"""
+    entry = await otp_store.use_attempt(phone, datetime.utcnow())
+    if not entry or not entry.get("code_hash"):
+        return False
+
+    if not hmac.compare_digest(entry["code_hash"], _hash_code(phone, code)):
+        return False
+
+    # Only one of two concurrent correct guesses gets to use the code
+    return await otp_store.consume(phone, entry["code_hash"])
@@ -0,0 +1,106 @@
+"""
+Rotating refresh tokens.
+
+A refresh token is a JWT signed like the access tokens, carrying its own
+id (jti) and the id of its family, the chain of tokens issued from one
+login. The refresh_tokens collection keeps one small document per token:
+
+    {_id: jti, family, sub, expires_at, revoked}
+
+so refreshing costs an HMAC check and one indexed update, without the
+bcrypt verify of a password login. Every refresh revokes the presented
+token and issues the next one in its family. Presenting a revoked token
+means it was stolen or replayed, and revokes the whole family. Expired
+documents are removed by the TTL index on expires_at.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Tuple
+
+from fastapi import HTTPException, status
+from jose import JWTError, jwt
+
+from config import settings, COLLECTIONS
+from db.repository import get_collection
+
+# MongoDB collections
+refresh_tokens_collection = get_collection(COLLECTIONS["refresh_tokens"])
+
+
+def _invalid_token_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+async def _issue(sub: str, family: str) -> str:
+    jti = uuid.uuid4().hex
+    expires_at = datetime.utcnow() + timedelta(days=settings.JWT_REFRESH_TOKEN_EXPIRE_DAYS)
+    await refresh_tokens_collection.insert_one({
+        "_id": jti,
+        "family": family,
+        "sub": sub,
+        "expires_at": expires_at,
+        "revoked": False,
+    })
+    return jwt.encode(
+        {"sub": sub, "jti": jti, "family": family, "type": "refresh", "exp": expires_at},
+        settings.JWT_SECRET_KEY,
+        algorithm=settings.JWT_ALGORITHM,
+    )
+
+
+def _decode(token: str) -> Dict[str, Any]:
+    try:
+        payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
+    except JWTError:
+        raise _invalid_token_exception()
+
+    if payload.get("type") != "refresh" or not payload.get("jti") or not payload.get("family"):
+        raise _invalid_token_exception()
+    return payload
+
+
+async def create_refresh_token(sub: str) -> str:
+    """Start a new token family for a login"""
+    return await _issue(sub, uuid.uuid4().hex)
+
+
+async def rotate_refresh_token(token: str) -> Tuple[str, str]:
+    """Exchange a refresh token for the next one in its family.
+
+    Returns the token subject (the user's email) and the new refresh token.
+    Raises a 401 HTTPException for invalid, expired or revoked tokens.
+    """
+    payload = _decode(token)
+
+    # Revoke the presented token atomically, so two concurrent refreshes
+    # with the same token can't both succeed
+    current = await refresh_tokens_collection.find_one_and_update(
+        {"_id": payload["jti"], "revoked": False},
+        {"$set": {"revoked": True}},
+        projection={"_id": 1},
+    )
+    if current is None:
+        # Reuse of a rotated token: treat the family as compromised
+        await revoke_family(payload["family"])
+        raise _invalid_token_exception()
+
+    return payload["sub"], await _issue(payload["sub"], payload["family"])
+
+
+async def revoke_family(family: str) -> None:
+    await refresh_tokens_collection.update_many(
+        {"family": family, "revoked": False},
+        {"$set": {"revoked": True}},
+    )
+
+
+async def revoke_refresh_token(token: str) -> str:
+    """Revoke the family of a refresh token (logout). Returns the token subject."""
+    payload = _decode(token)
+    await revoke_family(payload["family"])
+    return payload["sub"]
@@ -0,0 +1,44 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from bson import json_util
+
+# The application modules import each other relative to the app directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pydantic-settings parses list settings as JSON, so keep the comma separated
+# value from .env from breaking the import of config
+os.environ.setdefault("CORS_ORIGINS", '["http://localhost:3000"]')
+
+
+@pytest.fixture
+def maps_stub():
+    """Offline Google Maps web services, see tests/maps_stub.py"""
+    from tests.maps_stub import MapsStubServer
+
+    with MapsStubServer() as server:
+        yield server
+
+
+@pytest.fixture
+def mock_db(tmp_path, monkeypatch):
+    """Make a mock data store in tmp_path from {collection: documents}.
+
+    The store made last backs the collections of the services.
+    """
+    from db import database
+    from db.mock_data_handler import MockDataHandler
+
+    def make(collections=None, **kwargs):
+        for name, documents in (collections or {}).items():
+            (tmp_path / f"{name}.json").write_text(json_util.dumps(documents))
+        kwargs.setdefault("journal", False)
+        handler = MockDataHandler(base_path=tmp_path, **kwargs)
+        monkeypatch.setattr(database, "mock_db", handler)
+        monkeypatch.setattr(database, "USE_MOCK_DATA", True)
+        monkeypatch.setattr(database.Database, "mock_collections", {})
+        return handler
+
+    return make
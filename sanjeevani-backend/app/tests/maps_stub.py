@@ -0,0 +1,114 @@
+"""
+Offline stand-in for the Google Maps web services.
+
+Serves canned geocode, reverse geocode, distance matrix, directions and
+nearby search responses from a local HTTP server, optionally after a
+fixed delay to mimic network latency. Point AsyncMapsClient or
+googlemaps.Client at its base_url.
+"""
+
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def _leg(distance, duration):
+    return {
+        "distance": {"text": f"{distance / 1000:.1f} km", "value": distance},
+        "duration": {"text": f"{duration // 60} mins", "value": duration},
+    }
+
+
+def _response(api, params, element_status="OK"):
+    if api == "geocode" and "address" in params:
+        return {"status": "OK", "results": [{
+            "formatted_address": params["address"],
+            "geometry": {"location": {"lat": 12.9716, "lng": 77.5946}},
+            "address_components": [],
+        }]}
+    if api == "geocode":
+        return {"status": "OK", "results": [{
+            "formatted_address": "MG Road, Bengaluru, Karnataka 560001, India",
+            "address_components": [
+                {"long_name": "Bengaluru", "types": ["locality"]},
+                {"long_name": "Karnataka", "types": ["administrative_area_level_1"]},
+                {"long_name": "India", "types": ["country"]},
+                {"long_name": "560001", "types": ["postal_code"]},
+            ],
+        }]}
+    if api == "distancematrix":
+        origins = params["origins"].split("|")
+        destinations = params["destinations"].split("|")
+        return {"status": "OK", "rows": [
+            {"elements": [
+                {"status": "OK", **_leg(1000 * (j + 1), 300 * (j + 1))} if element_status == "OK" else {"status": element_status}
+                for j in range(len(destinations))
+            ]}
+            for _ in origins
+        ]}
+    if api == "directions":
+        return {"status": "OK", "routes": [{"summary": "Stub Road", "legs": [_leg(2500, 600)]}]}
+    if api == "place/nearbysearch":
+        return {"status": "OK", "results": [{
+            "name": "Stub Hospital", "place_id": "stub-1", "vicinity": "MG Road",
+            "geometry": {"location": {"lat": 12.9720, "lng": 77.5950}},
+        }]}
+    return None
+
+
+class MapsStubServer:
+    """Local Maps stub on a free port; use as a context manager"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        # Status of every Distance Matrix element, e.g. "ZERO_RESULTS"
+        self.element_status = "OK"
+        # Status answered by every API instead of a result, e.g. "OVER_QUERY_LIMIT"
+        self.status = None
+        self.requests = 0
+        # Requests per API, e.g. calls["distancematrix"]
+        self.calls = Counter()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately; don't let them wait on ACKs
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                api = url.path[len("/maps/api/"):-len("/json")]
+                params = {name: values[0] for name, values in parse_qs(url.query).items()}
+                stub.requests += 1
+                stub.calls[api] += 1
+                if stub.delay:
+                    time.sleep(stub.delay)
+
+                body = _response(api, params, stub.element_status)
+                if body is not None and stub.status is not None:
+                    body = {"status": stub.status, "error_message": f"Stub {stub.status}"}
+                payload = json.dumps(body).encode()
+                self.send_response(200 if body is not None else 404)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
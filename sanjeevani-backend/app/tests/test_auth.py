@@ -0,0 +1,333 @@
+import asyncio
+import base64
+import threading
+import time
+
+import httpx
+import pytest
+import rsa
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from core.cache import TTLCache
+from firebase.token_verifier import FirebaseTokenVerifier, InvalidFirebaseToken
+from models.user import UserRole
+from services import auth_service
+from services.auth_service import check_user_role, create_access_token, get_current_active_user
+
+
+class CountingUsers:
+    def __init__(self):
+        self.lookups = 0
+
+    async def find_one(self, query, projection=None):
+        self.lookups += 1
+        return {"_id": "64b000000000000000000001", "email": query["email"], "role": "doctor", "is_active": True}
+
+
+def test_user_is_loaded_once_per_request(monkeypatch):
+    users = CountingUsers()
+    monkeypatch.setattr(auth_service, "users_collection", users)
+    monkeypatch.setattr(auth_service, "principal_cache", TTLCache("test.principal_cache", maxsize=0, ttl=0))
+
+    app = FastAPI()
+
+    @app.get("/")
+    async def route(
+        active_user: dict = Depends(get_current_active_user),
+        doctor: dict = Depends(check_user_role([UserRole.DOCTOR])),
+        staff: dict = Depends(check_user_role([UserRole.DOCTOR, UserRole.ADMIN])),
+    ):
+        return {"same": active_user is doctor is staff}
+
+    token = create_access_token({"sub": "doctor@example.com", "role": "doctor"})
+    client = TestClient(app)
+    for expected_lookups in (1, 2):
+        response = client.get("/", headers={"Authorization": f"Bearer {token}"})
+        assert response.json() == {"same": True}
+        assert users.lookups == expected_lookups
+
+
+def _b64(number):
+    data = number.to_bytes((number.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def test_firebase_tokens_are_verified_against_cached_keys():
+    public_key, private_key = rsa.newkeys(1024)
+    jwks = {"keys": [{"kid": "key-1", "kty": "RSA", "alg": "RS256", "n": _b64(public_key.n), "e": _b64(public_key.e)}]}
+    key_requests = []
+
+    def keys_endpoint(request):
+        key_requests.append(request)
+        return httpx.Response(200, json=jwks, headers={"Cache-Control": "public, max-age=600"})
+
+    def make_token(**overrides):
+        now = int(time.time())
+        claims = {
+            "iss": "https://securetoken.google.com/demo-project", "aud": "demo-project",
+            "sub": "firebase-uid", "email": "user@example.com", "iat": now, "auth_time": now, "exp": now + 600,
+        }
+        claims.update(overrides)
+        return jwt.encode(claims, private_key.save_pkcs1().decode(), algorithm="RS256", headers={"kid": "key-1"})
+
+    verifier = FirebaseTokenVerifier(
+        "demo-project", keys_url="https://keys.test/jwks",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(keys_endpoint)),
+    )
+
+    async def scenario():
+        token = make_token()
+        claims = await verifier.verify(token)
+        assert claims["uid"] == "firebase-uid" and claims["email"] == "user@example.com"
+        assert (await verifier.verify(token))["uid"] == "firebase-uid"
+        assert (await verifier.verify(make_token(email="other@example.com")))["email"] == "other@example.com"
+
+        for bad_token in (make_token(aud="other-project"), make_token(exp=int(time.time()) - 3600), "not-a-token"):
+            with pytest.raises(InvalidFirebaseToken):
+                await verifier.verify(bad_token)
+
+    asyncio.run(scenario())
+    # The keys were fetched once and then served from the cache
+    assert len(key_requests) == 1
+
+
+def test_password_hashing_survives_an_app_restart(mock_db, monkeypatch):
+    import main
+    from api import users
+
+    async def valid_phone(phone):
+        return True
+
+    mock_db()
+    monkeypatch.setattr(users, "verify_phone_number", valid_phone)
+    user = {"email": "patient@example.com", "phone": "+911234567890", "name": "Patient", "password": "secret", "role": "patient"}
+    with TestClient(main.app) as client:
+        response = client.post("/api/users/register", json=user)
+        assert response.status_code == 201, response.text
+    # The pool was shut down with the first app
+    with TestClient(main.app) as client:
+        response = client.post("/api/users/login", data={"username": user["email"], "password": user["password"]})
+        assert response.status_code == 200
+
+
+def test_metrics_are_for_admins_only(mock_db):
+    import main
+
+    mock_db({"users": [
+        {"email": "admin@example.com", "role": "admin", "is_active": True},
+        {"email": "patient@example.com", "role": "patient", "is_active": True},
+    ]})
+    client = TestClient(main.app)
+
+    def get_metrics(email=None, role=None):
+        headers = {}
+        if email:
+            headers["Authorization"] = f"Bearer {create_access_token({'sub': email, 'role': role})}"
+        return client.get("/metrics", headers=headers)
+
+    assert get_metrics().status_code == 401
+    assert get_metrics("patient@example.com", "patient").status_code == 403
+    response = get_metrics("admin@example.com", "admin")
+    assert response.status_code == 200
+    assert "auth.principal_cache.hits" in response.json()
+
+
+@pytest.mark.asyncio
+async def test_password_jobs_beyond_the_queue_get_429(monkeypatch):
+    from fastapi import HTTPException
+
+    from core.executor import BoundedExecutor
+
+    executor = BoundedExecutor("test.password_hashing", max_workers=1, max_queue=1)
+    monkeypatch.setattr(auth_service, "password_executor", executor)
+    release = threading.Event()
+
+    running = [asyncio.ensure_future(auth_service._run_password_job(release.wait)) for _ in range(2)]
+    await asyncio.sleep(0.05)
+    with pytest.raises(HTTPException) as error:
+        await auth_service.get_password_hash("secret")
+    assert error.value.status_code == 429
+    assert error.value.headers == {"Retry-After": "1"}
+
+    release.set()
+    assert await asyncio.gather(*running) == [True, True]
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiters_keep_their_running_jobs_counted():
+    from core.executor import BoundedExecutor, ExecutorSaturated
+
+    executor = BoundedExecutor("test.cancelled_jobs", max_workers=1, max_queue=1)
+    release = threading.Event()
+    try:
+        waiters = [asyncio.ensure_future(executor.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        # Like clients disconnecting mid-login: the running job goes on,
+        # the queued one is dropped
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        assert executor.in_flight == 1
+
+        queued = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0)
+        with pytest.raises(ExecutorSaturated):
+            await executor.run(release.wait)
+
+        release.set()
+        assert await queued is True
+        assert executor.in_flight == 0
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_refresh_tokens_rotate_and_reuse_revokes_the_family(mock_db):
+    from fastapi import HTTPException
+
+    from services.refresh_token_service import create_refresh_token, rotate_refresh_token
+
+    mock_db()
+    first = await create_refresh_token("patient@example.com")
+    sub, second = await rotate_refresh_token(first)
+    assert sub == "patient@example.com"
+
+    # Replaying the rotated token revokes every token of its login
+    for token in (first, second):
+        with pytest.raises(HTTPException) as error:
+            await rotate_refresh_token(token)
+        assert error.value.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_access_and_refresh_tokens_are_not_interchangeable(mock_db, monkeypatch):
+    from fastapi import HTTPException
+
+    from services.refresh_token_service import create_refresh_token, rotate_refresh_token
+
+    mock_db({"users": [{"email": "patient@example.com", "role": "patient", "is_active": True}]})
+    monkeypatch.setattr(auth_service, "principal_cache", TTLCache("test.principal_cache", maxsize=0, ttl=0))
+    access_token = create_access_token({"sub": "patient@example.com", "role": "patient"})
+    refresh_token = await create_refresh_token("patient@example.com")
+
+    with pytest.raises(HTTPException):
+        await rotate_refresh_token(access_token)
+    with pytest.raises(HTTPException):
+        await auth_service._load_principal(refresh_token)
+    assert (await auth_service._load_principal(access_token))["email"] == "patient@example.com"
+
+
+@pytest.mark.asyncio
+async def test_refreshing_for_a_deactivated_user_revokes_the_family(mock_db, monkeypatch):
+    from fastapi import HTTPException
+
+    from api.users import refresh_access_token
+    from services.refresh_token_service import create_refresh_token
+
+    store = mock_db({"users": [{"email": "patient@example.com", "role": "patient", "is_active": False}]})
+    monkeypatch.setattr(auth_service, "principal_cache", TTLCache("test.principal_cache", maxsize=0, ttl=0))
+    token = await create_refresh_token("patient@example.com")
+
+    with pytest.raises(HTTPException) as error:
+        await refresh_access_token(token)
+    assert error.value.status_code == 401
+    assert await store.count_documents("refresh_tokens", {"revoked": False}) == 0
+
+
+@pytest.mark.asyncio
+async def test_principals_are_cached_until_their_user_changes(mock_db, monkeypatch):
+    from bson import ObjectId
+    from fastapi import HTTPException
+
+    from api.users import update_patient_profile
+    from models.user import PatientProfile
+
+    user_id = ObjectId()
+    store = mock_db({"users": [{"_id": user_id, "email": "patient@example.com", "role": "patient", "is_active": True}]})
+    monkeypatch.setattr(auth_service, "principal_cache", TTLCache("test.principal_cache", maxsize=10, ttl=60))
+    lookups = []
+    find_one = store.find_one
+
+    async def counting_find_one(collection, query=None, projection=None):
+        lookups.append(collection)
+        return await find_one(collection, query, projection)
+
+    monkeypatch.setattr(store, "find_one", counting_find_one)
+    token = create_access_token({"sub": "patient@example.com", "role": "patient"})
+
+    user = await auth_service._load_principal(token)
+    await auth_service._load_principal(token)
+    assert lookups.count("users") == 1
+
+    # Profiles live outside the user document, so they keep the cached user
+    await update_patient_profile(PatientProfile(user_id=str(user_id), age=30), current_user=user)
+    await auth_service._load_principal(token)
+    assert lookups.count("users") == 1
+
+    assert await auth_service.deactivate_user(str(user_id))
+    with pytest.raises(HTTPException) as error:
+        await get_current_active_user(await auth_service._load_principal(token))
+    assert error.value.status_code == 400
+    assert lookups.count("users") == 2
+
+
+@pytest.fixture(params=["memory", "mongo"])
+def otp_store(request, mock_db, monkeypatch):
+    from services import otp_service
+
+    mock_db()
+    store = otp_service.MemoryOTPStore() if request.param == "memory" else otp_service.MongoOTPStore()
+    monkeypatch.setattr(otp_service, "otp_store", store)
+    return store
+
+
+@pytest.mark.asyncio
+async def test_otp_codes_work_once_and_for_a_limited_number_of_guesses(otp_store):
+    from services.otp_service import OTP_MAX_ATTEMPTS, issue_otp, verify_otp
+
+    code = await issue_otp("+911234567890")
+    wrong = "000000" if code != "000000" else "111111"
+    assert not await verify_otp("+911234567890", wrong)
+    assert await verify_otp("+911234567890", code)
+    # Replaying a used code fails
+    assert not await verify_otp("+911234567890", code)
+
+    code = await issue_otp("+919876543210")
+    for _ in range(OTP_MAX_ATTEMPTS):
+        assert not await verify_otp("+919876543210", wrong)
+    assert not await verify_otp("+919876543210", code)
+
+
+@pytest.mark.asyncio
+async def test_expired_otp_codes_are_rejected(otp_store, monkeypatch):
+    from services import otp_service
+
+    monkeypatch.setattr(otp_service, "OTP_TTL", -1)
+    code = await otp_service.issue_otp("+911234567890")
+    assert not await otp_service.verify_otp("+911234567890", code)
+
+
+@pytest.mark.asyncio
+async def test_otp_sends_are_rate_limited_even_when_concurrent(otp_store, monkeypatch):
+    from services.otp_service import OTP_RESEND_INTERVAL, OTPRateLimited, issue_otp
+
+    get = otp_store.get
+
+    async def slow_get(phone):
+        entry = await get(phone)
+        # Let the other sends read the same entry, as they would over the network
+        await asyncio.sleep(0)
+        return entry
+
+    monkeypatch.setattr(otp_store, "get", slow_get)
+    results = await asyncio.gather(*[issue_otp("+911234567890") for _ in range(5)], return_exceptions=True)
+    assert sum(isinstance(result, str) for result in results) == 1
+    assert all(isinstance(result, (str, OTPRateLimited)) for result in results)
+
+    with pytest.raises(OTPRateLimited) as error:
+        await issue_otp("+911234567890")
+    assert 0 < error.value.retry_after <= OTP_RESEND_INTERVAL + 1
@@ -0,0 +1,374 @@
+import asyncio
+import random
+from datetime import datetime
+
+import pytest
+
+from core.geo import CoordinateTable, haversine_m
+from integrations.route_cache import RouteCache
+from services.hospital_index import HospitalIndex
+
+
+def test_hospital_index_finds_the_k_nearest():
+    rng = random.Random(7)
+    hospitals = [
+        {"user_id": str(i), "location": {"latitude": rng.uniform(12.5, 13.5), "longitude": rng.uniform(77, 78)}}
+        for i in range(500)
+    ]
+    # A far away hospital and one without a location
+    hospitals.append({"user_id": "far", "location": {"latitude": 28.6, "longitude": 77.2}})
+    hospitals.append({"user_id": "nowhere"})
+
+    index = HospitalIndex(cell_degrees=0.05)
+    index.build(hospitals)
+    assert len(index) == 501
+
+    for latitude, longitude in [(12.97, 77.59), (13.6, 77.1), (28.0, 77.0)]:
+        expected = sorted(
+            hospitals[:501],
+            key=lambda h: haversine_m(latitude, longitude, h["location"]["latitude"], h["location"]["longitude"])
+        )[:5]
+        found = index.nearest(latitude, longitude, 5)
+        assert [h["user_id"] for _, h in found] == [h["user_id"] for h in expected]
+
+
+def test_vectorized_haversine_matches_the_scalar_one():
+    rng = random.Random(3)
+    points = [{"location": {"latitude": rng.uniform(-60, 60), "longitude": rng.uniform(-180, 180)}} for _ in range(200)]
+    origins = [(rng.uniform(-60, 60), rng.uniform(-180, 180)) for _ in range(5)]
+    table = CoordinateTable(points)
+
+    indices, distances = table.nearest_to_each(origins)
+    for (latitude, longitude), index, distance in zip(origins, indices, distances):
+        scalar = [haversine_m(latitude, longitude, p["location"]["latitude"], p["location"]["longitude"]) for p in points]
+        assert index == scalar.index(min(scalar))
+        assert abs(distance - min(scalar)) < 1e-6
+
+        top = table.nearest(latitude, longitude, 3)
+        assert [d for d, _ in top] == pytest.approx(sorted(scalar)[:3])
+
+
+def test_route_cache_shares_entries_within_an_origin_cell():
+    cache = RouteCache(name="test.route_cache", maxsize=10, cell_degrees=0.01, peak_ttl=300,
+                       off_peak_ttl=1800, peak_hours="8-10,17-20")
+    element = {"status": "OK", "distance": {"value": 1200}, "duration": {"value": 240}}
+    cache.set((12.9712, 77.5941), "hospital-1", element)
+
+    assert cache.get((12.9788, 77.5999), "hospital-1") == element
+    assert cache.get((12.9812, 77.5941), "hospital-1") is None
+    assert cache.get((12.9712, 77.5941), "hospital-2") is None
+    assert cache.get((12.9712, 77.5941), "hospital-1", mode="walking") is None
+
+    assert cache.ttl(datetime(2024, 1, 1, 9, 30)) == 300
+    assert cache.ttl(datetime(2024, 1, 1, 13, 0)) == 1800
+    # Off-peak entries expire when the evening peak starts
+    assert cache.ttl(datetime(2024, 1, 1, 16, 50)) == 600
+    # ... even when that is sooner than the peak TTL
+    assert cache.ttl(datetime(2024, 1, 1, 16, 58)) == 120
+    assert cache.ttl(datetime(2024, 1, 1, 16, 59, 30)) == 30
+    assert cache.ttl(datetime(2024, 1, 1, 23, 0)) == 1800
+
+
+def test_async_maps_client_against_the_stub_server(maps_stub):
+    from integrations.maps_client import AsyncMapsClient, MapsApiError
+
+    async def scenario():
+        client = AsyncMapsClient("test-key", base_url=maps_stub.base_url, timeout=2)
+        try:
+            results = await client.geocode("MG Road, Bengaluru")
+            matrix = await client.distance_matrix([(12.97, 77.59)], [(12.98, 77.6), (13.0, 77.61)], mode="driving")
+            routes = await asyncio.gather(*[client.directions((12.97, 77.59), (12.98, 77.6)) for _ in range(5)])
+
+            maps_stub.delay = 0.5
+            with pytest.raises(MapsApiError) as error:
+                await client.directions((12.97, 77.59), (12.98, 77.6), timeout=0.1)
+        finally:
+            await client.aclose()
+        return results, matrix, routes, error.value
+
+    results, matrix, routes, error = asyncio.run(scenario())
+    assert results[0]["geometry"]["location"] == {"lat": 12.9716, "lng": 77.5946}
+    assert [e["distance"]["value"] for e in matrix["rows"][0]["elements"]] == [1000, 2000]
+    assert all(r[0]["legs"][0]["duration"]["value"] == 600 for r in routes)
+    assert error.status == "TIMEOUT"
+
+
+def test_maps_client_reopens_after_aclose(maps_stub):
+    from integrations.maps_client import AsyncMapsClient
+
+    client = AsyncMapsClient("test-key", base_url=maps_stub.base_url, timeout=2)
+
+    async def lifespan():
+        try:
+            return await client.geocode("MG Road, Bengaluru")
+        finally:
+            await client.aclose()
+
+    # Each run is one app lifespan on its own event loop, like shutdown and restart
+    assert asyncio.run(lifespan()) == asyncio.run(lifespan())
+
+
+@pytest.mark.asyncio
+async def test_maps_quota_errors_open_the_breaker(maps_stub):
+    from core.circuit_breaker import CLOSED, OPEN
+    from integrations.maps_client import AsyncMapsClient, MapsApiError
+
+    client = AsyncMapsClient("test-key", base_url=maps_stub.base_url, timeout=2, breaker_failures=2)
+    try:
+        # Errors about the request itself don't count
+        maps_stub.status = "INVALID_REQUEST"
+        for _ in range(3):
+            with pytest.raises(MapsApiError):
+                await client.geocode("MG Road, Bengaluru")
+        assert client.breaker("geocode").state == CLOSED
+
+        maps_stub.status = "OVER_QUERY_LIMIT"
+        for _ in range(2):
+            with pytest.raises(MapsApiError) as error:
+                await client.geocode("MG Road, Bengaluru")
+            assert error.value.status == "OVER_QUERY_LIMIT"
+        assert client.breaker("geocode").state == OPEN
+
+        with pytest.raises(MapsApiError) as error:
+            await client.geocode("MG Road, Bengaluru")
+        assert error.value.status == "CIRCUIT_OPEN"
+        assert maps_stub.calls["geocode"] == 5
+    finally:
+        await client.aclose()
+
+
+def test_geocode_cache_survives_a_restart(tmp_path):
+    from integrations.geocode_cache import GeocodeCache, NOT_FOUND, address_key, latlng_key
+
+    path = str(tmp_path / "geocode.sqlite3")
+    location = {"latitude": 12.9716, "longitude": 77.5946}
+
+    async def fill():
+        cache = GeocodeCache(path, name="test.geocode_cache")
+        await cache.set(address_key("12, MG Road,  Bengaluru"), location)
+        await cache.set(address_key("nowhere at all"), None)
+        cache.close()
+
+    async def read():
+        cache = GeocodeCache(path, name="test.geocode_cache")
+        try:
+            return (
+                await cache.get(address_key("12 mg road bengaluru")),
+                await cache.get(address_key("Nowhere at all")),
+                await cache.get(address_key("somewhere else")),
+            )
+        finally:
+            cache.close()
+
+    asyncio.run(fill())
+    assert asyncio.run(read()) == (location, NOT_FOUND, None)
+    assert latlng_key(12.97161, 77.59459) == latlng_key(12.97159, 77.59461)
+
+
+def test_circuit_breaker_opens_and_lets_one_trial_through():
+    from core.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+    now = [0.0]
+    breaker = CircuitBreaker("test.circuit", failure_threshold=2, reset_timeout=30, clock=lambda: now[0],
+                             excluded=(LookupError,))
+
+    async def fail():
+        raise ConnectionError("down")
+
+    async def hang():
+        await asyncio.sleep(1)
+
+    async def answer():
+        return "ok"
+
+    async def busy():
+        raise LookupError("no connection free")
+
+    async def scenario():
+        # Excluded errors don't count towards opening the breaker
+        for _ in range(3):
+            with pytest.raises(LookupError):
+                await breaker.call(busy, deadline=1)
+        assert breaker.state == CLOSED
+
+        with pytest.raises(ConnectionError):
+            await breaker.call(fail, deadline=1)
+        with pytest.raises(asyncio.TimeoutError):
+            await breaker.call(hang, deadline=0.01)
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpen):
+            await breaker.call(answer, deadline=1)
+
+        # A failed trial opens the breaker again, a successful one closes it
+        now[0] = 30
+        assert breaker.state == HALF_OPEN
+        with pytest.raises(ConnectionError):
+            await breaker.call(fail, deadline=1)
+        assert breaker.state == OPEN
+        now[0] = 60
+        assert await breaker.call(answer, deadline=1) == "ok"
+        assert breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.asyncio
+async def test_emergencies_far_from_every_hospital_still_get_candidates(mock_db):
+    from services.emergency_service import _candidate_hospitals
+    from services.hospital_index import hospital_index
+
+    location = {"latitude": 12.9716, "longitude": 77.5946}
+    mock_db({"hospitals": [{
+        "user_id": "h1", "name": "City Hospital", "address": "MG Road", "emergency_services": True,
+        "location": location, "geo": {"type": "Point", "coordinates": [77.5946, 12.9716]},
+    }]})
+    hospital_index.invalidate()
+
+    # About 110 km away, beyond the default 50 km search radius
+    candidates = await _candidate_hospitals({"latitude": 13.9716, "longitude": 77.5946})
+    assert [h["user_id"] for h in candidates] == ["h1"]
+    hospital_index.invalidate()
+
+
+@pytest.mark.asyncio
+async def test_emergency_routes_fall_back_to_an_estimate_and_refine_later(mock_db, maps_stub, monkeypatch, caplog):
+    from bson import ObjectId
+
+    from core.circuit_breaker import OPEN
+    from integrations.maps_client import AsyncMapsClient
+    from integrations.route_cache import route_cache
+    from services import emergency_service
+
+    store = mock_db({"hospitals": [{
+        "user_id": "h1", "name": "City Hospital", "address": "MG Road", "emergency_services": True,
+        "location": {"latitude": 12.98, "longitude": 77.6}, "geo": {"type": "Point", "coordinates": [77.6, 12.98]},
+    }]})
+    client = AsyncMapsClient("test-key", base_url=maps_stub.base_url, timeout=2, breaker_failures=1)
+    monkeypatch.setattr(emergency_service, "gmaps", client)
+    monkeypatch.setattr(emergency_service, "EMERGENCY_MAPS_DEADLINE", 0.05)
+    monkeypatch.setattr(emergency_service, "ROUTE_REFINE_DELAYS", [0])
+    route_cache.clear()
+    origin = {"latitude": 12.97, "longitude": 77.59}
+
+    try:
+        # A slow Distance Matrix misses the deadline and opens its breaker,
+        # after which emergencies are answered without calling it
+        maps_stub.delay = 0.5
+        for _ in range(2):
+            route = await emergency_service.route_to_nearest_hospital(origin)
+            assert (route.hospital["user_id"], route.source) == ("h1", "estimate")
+        assert client.breaker("distancematrix").state == OPEN
+        expected = 1.4 * haversine_m(12.97, 77.59, 12.98, 77.6)
+        assert route.distance_meters == pytest.approx(expected, abs=1)
+        assert route.duration_seconds == pytest.approx(expected / (30 / 3.6), abs=1)
+
+        # Directions has its own breaker and refines the stored ETA once it answers
+        maps_stub.delay = 0
+        created_at = datetime(2024, 1, 1, 9, 0)
+        result = await store.insert_one("emergency_requests", {"_id": ObjectId(), "created_at": created_at})
+        await emergency_service._refine_route(result.inserted_id, created_at, route, origin)
+        stored = await store.find_one("emergency_requests", {"_id": result.inserted_id})
+        assert stored["estimated_arrival_time"] == datetime(2024, 1, 1, 9, 10)
+
+        # Unexpected errors are logged instead of killing the task silently
+        async def broken_directions(**kwargs):
+            return [{"legs": []}]
+
+        monkeypatch.setattr(client, "directions", broken_directions)
+        await emergency_service._refine_route(result.inserted_id, created_at, route, origin)
+        assert "Refining the route of emergency request" in caplog.text
+    finally:
+        await client.aclose()
+        route_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_emergencies_get_a_hospital_when_maps_has_no_route(mock_db, maps_stub, monkeypatch):
+    from integrations.maps_client import AsyncMapsClient
+    from integrations.route_cache import route_cache
+    from services import emergency_service
+
+    def hospital(user_id, latitude, longitude):
+        return {
+            "user_id": user_id, "name": user_id, "address": "MG Road", "emergency_services": True,
+            "location": {"latitude": latitude, "longitude": longitude},
+            "geo": {"type": "Point", "coordinates": [longitude, latitude]},
+        }
+
+    mock_db({"hospitals": [hospital("near", 12.98, 77.6), hospital("far", 13.0, 77.62)]})
+    client = AsyncMapsClient("test-key", base_url=maps_stub.base_url, timeout=2)
+    monkeypatch.setattr(emergency_service, "gmaps", client)
+    monkeypatch.setattr(emergency_service, "EMERGENCY_MAPS_DEADLINE", 0.05)
+    route_cache.clear()
+    origin = {"latitude": 12.97, "longitude": 77.59}
+
+    try:
+        # Maps answers, but with no route to any candidate
+        maps_stub.element_status = "ZERO_RESULTS"
+        route = await emergency_service.route_to_nearest_hospital(origin)
+        assert (route.hospital["user_id"], route.source) == ("near", "estimate")
+
+        # Maps fails: a cached route shorter than the estimate still wins
+        maps_stub.element_status, maps_stub.delay = "OK", 0.5
+        route_cache.set((12.97, 77.59), "far", {"distance": {"value": 100}, "duration": {"value": 60}})
+        route = await emergency_service.route_to_nearest_hospital(origin)
+        assert (route.hospital["user_id"], route.source, route.distance_meters) == ("far", "cache", 100)
+
+        # ... and one longer than the estimate loses to it
+        route_cache.set((12.97, 77.59), "far", {"distance": {"value": 50000}, "duration": {"value": 3600}})
+        route = await emergency_service.route_to_nearest_hospital(origin)
+        assert (route.hospital["user_id"], route.source) == ("near", "estimate")
+    finally:
+        await client.aclose()
+        route_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_emergency_requests_route_once_and_time_each_phase(mock_db, maps_stub, monkeypatch):
+    from bson import ObjectId
+
+    from core.metrics import metrics
+    from integrations.maps_client import AsyncMapsClient
+    from integrations.route_cache import route_cache
+    from models.appointment import EmergencyRequestCreate
+    from services import emergency_service
+
+    patient_id, hospital_id = ObjectId(), ObjectId()
+    mock_db({
+        "patients": [{"user_id": str(patient_id)}],
+        "users": [{"_id": patient_id, "phone": "+911111111111"}, {"_id": hospital_id, "phone": "+912222222222"}],
+        "hospitals": [{
+            "user_id": str(hospital_id), "name": "City Hospital", "address": "MG Road", "emergency_services": True,
+            "location": {"latitude": 12.98, "longitude": 77.6}, "geo": {"type": "Point", "coordinates": [77.6, 12.98]},
+        }],
+    })
+    client = AsyncMapsClient("test-key", base_url=maps_stub.base_url, timeout=2)
+    monkeypatch.setattr(emergency_service, "gmaps", client)
+    messages = []
+
+    async def send_sms(phone, message):
+        messages.append((phone, message))
+        return True
+
+    monkeypatch.setattr(emergency_service, "send_emergency_sms", send_sms)
+    route_cache.clear()
+
+    phases = ["patient_check", "routing", "lookups", "insert", "sms", "total"]
+    counts = {phase: metrics.summary(f"emergency.create.{phase}_seconds").count for phase in phases}
+    request = EmergencyRequestCreate(patient_id=str(patient_id), location={"latitude": 12.97, "longitude": 77.59})
+    try:
+        created = await emergency_service.create_emergency_request(request, str(patient_id))
+    finally:
+        await client.aclose()
+        route_cache.clear()
+
+    # One Distance Matrix call gives the hospital, the stored ETA and the SMS ETA
+    assert maps_stub.calls == {"distancematrix": 1}
+    assert created["hospital_id"] == str(hospital_id)
+    eta = (created["estimated_arrival_time"] - created["created_at"]).total_seconds()
+    assert eta == pytest.approx(300, abs=5)
+    assert "approximately 5 minutes" in messages[0][1]
+    assert [phone for phone, _ in messages] == ["+911111111111", "+912222222222"]
+
+    for phase in phases:
+        assert metrics.summary(f"emergency.create.{phase}_seconds").count == counts[phase] + 1
@@ -0,0 +1,244 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from db import mock_data_handler
+from db.mock_data_handler import MockDataHandler
+
+
+@pytest.mark.asyncio
+async def test_indexes_follow_updates_and_deletes(mock_db):
+    handler = mock_db({"users": [
+        {"id": "1", "email": "a@example.com", "phone": "1"},
+        {"id": "2", "email": "b@example.com", "phone": "2"},
+    ]})
+
+    await handler.update_one("users", {"id": "1"}, {"$set": {"email": "c@example.com"}})
+    assert await handler.find_one("users", {"email": "a@example.com"}) is None
+    assert (await handler.find_one("users", {"email": "c@example.com"}))["id"] == "1"
+
+    await handler.delete_one("users", {"email": "b@example.com"})
+    assert await handler.find_one("users", {"id": "2"}) is None
+    assert "b@example.com" not in handler.indexes["users"]["email"]
+
+
+@pytest.mark.asyncio
+async def test_frequently_queried_fields_get_indexed(mock_db):
+    handler = mock_db({"users": [{"id": "1", "name": "x"}]}, auto_index_threshold=2)
+
+    for _ in range(2):
+        assert await handler.find_one("users", {"name": "x"}) is not None
+    assert "name" in handler.indexes["users"]
+
+
+@pytest.mark.asyncio
+async def test_journal_is_replayed_and_compacted(mock_db, tmp_path):
+    handler = mock_db({"users": [{"id": "1", "email": "a@example.com"}]}, journal=True)
+
+    await handler.insert_one("users", {"email": "b@example.com"})
+    await handler.update_one("users", {"id": "1"}, {"$set": {"email": "c@example.com"}})
+    assert (tmp_path / "users.journal").exists()
+
+    restarted = MockDataHandler(base_path=tmp_path, journal=True)
+    emails = [doc["email"] for doc in restarted.data["users"].values()]
+    assert emails == ["c@example.com", "b@example.com"]
+
+    await restarted.compact("users")
+    assert not (tmp_path / "users.journal").exists()
+    compacted = MockDataHandler(base_path=tmp_path, journal=True)
+    assert [doc["email"] for doc in compacted.data["users"].values()] == emails
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("tail, survivors", [
+    ('{"op": "put", "doc": {"id": "3", "em', ["1", "2", "4"]),
+    # Crashed after the record but before its newline
+    ('{"op": "put", "doc": {"id": "3"}}', ["1", "2", "3", "4"]),
+])
+async def test_writes_after_a_torn_journal_tail_survive_restarts(mock_db, tmp_path, tail, survivors):
+    handler = mock_db({"users": [{"id": "1", "email": "a@example.com"}]}, journal=True)
+    await handler.insert_one("users", {"id": "2", "email": "b@example.com"})
+    handler.sync()
+    # A crash in the middle of the next write
+    with open(tmp_path / "users.journal", "a", encoding="utf-8") as f:
+        f.write(tail)
+
+    restarted = MockDataHandler(base_path=tmp_path, journal=True)
+    await restarted.insert_one("users", {"id": "4", "email": "d@example.com"})
+    restarted.sync()
+
+    reopened = MockDataHandler(base_path=tmp_path, journal=True)
+    ids = [doc["id"] for doc in reopened.data["users"].values()]
+    assert ids == survivors
+
+
+@pytest.mark.asyncio
+async def test_compactions_started_by_writes_are_kept_and_logged(mock_db, tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(mock_data_handler, "JOURNAL_MAX_RECORDS", 1)
+    handler = mock_db(journal=True)
+
+    await handler.insert_one("users", {"email": "a@example.com"})
+    tasks = set(handler._compaction_tasks)
+    assert len(tasks) == 1
+    await asyncio.gather(*tasks)
+    assert not handler._compaction_tasks
+    assert not (tmp_path / "users.journal").exists()
+
+    async def broken_compact(collection):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(handler, "compact", broken_compact)
+    await handler.insert_one("users", {"email": "b@example.com"})
+    await asyncio.gather(*handler._compaction_tasks, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert not handler._compaction_tasks
+    assert "Journal compaction failed" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_operators_used_by_the_services(mock_db):
+    handler = mock_db()
+    now = datetime.now()
+
+    result = await handler.update_one(
+        "users", {"phone": "1"},
+        {"$set": {"otp": "123", "otp_expiry": now + timedelta(minutes=10)}},
+        upsert=True,
+    )
+    assert result.upserted_id is not None
+
+    user = await handler.find_one("users", {"phone": "1", "otp": "123", "otp_expiry": {"$gt": now}})
+    assert user is not None
+    await handler.update_one("users", {"_id": user["_id"]}, {"$unset": {"otp": "", "otp_expiry": ""}})
+    assert "otp" not in await handler.find_one("users", {"phone": "1"})
+
+    for i in range(4):
+        await handler.insert_one("notifications", {"user_id": "u", "read": i < 2, "created_at": now + timedelta(seconds=i)})
+    assert await handler.count_documents("notifications", {"user_id": "u", "read": False}) == 2
+    page = await handler.find("notifications", {"user_id": "u"}, sort=[("created_at", -1)], skip=1, limit=2)
+    assert [doc["created_at"] for doc in page] == [now + timedelta(seconds=2), now + timedelta(seconds=1)]
+
+
+@pytest.mark.asyncio
+async def test_cursor_paginates_like_motor(mock_db):
+    from db import database
+
+    handler = mock_db({"users": [{"id": str(i), "rank": i % 7} for i in range(50)]})
+    collection = database.MockCollection("users")
+
+    cursor = collection.find({"rank": {"$gte": 1}})
+    cursor.sort([("rank", -1), ("id", 1)]).skip(2).limit(3)
+    page = [doc async for doc in cursor]
+
+    expected = sorted(
+        (doc for doc in handler.data["users"].values() if doc["rank"] >= 1),
+        key=lambda doc: (-doc["rank"], doc["id"]),
+    )[2:5]
+    assert page == expected
+
+
+@pytest.mark.asyncio
+async def test_find_one_and_update_returns_the_updated_document(mock_db):
+    handler = mock_db({"users": [{"id": "1", "email": "a@example.com", "visits": 1}]})
+
+    before = await handler.find_one_and_update("users", {"id": "1"}, {"$inc": {"visits": 1}})
+    assert before["visits"] == 1
+    after = await handler.find_one_and_update(
+        "users", {"id": "1"}, {"$inc": {"visits": 1}}, return_document=True
+    )
+    assert after["visits"] == 3
+    assert await handler.find_one_and_update("users", {"id": "2"}, {"$set": {"visits": 1}}) is None
+
+
+@pytest.mark.asyncio
+async def test_updates_need_operators_and_replacements_need_replace_one(mock_db):
+    handler = mock_db({"users": [{"id": "1", "email": "a@example.com", "visits": 1}]})
+
+    for update in ({}, {"email": "b@example.com"}, {"$set": {"visits": 2}, "email": "b@example.com"}):
+        with pytest.raises(ValueError):
+            await handler.update_one("users", {"id": "1"}, update)
+        with pytest.raises(ValueError):
+            await handler.find_one_and_update("users", {"id": "1"}, update)
+    with pytest.raises(ValueError):
+        await handler.replace_one("users", {"id": "1"}, {"$set": {"visits": 2}})
+    assert (await handler.find_one("users", {"id": "1"}))["visits"] == 1
+
+    result = await handler.replace_one("users", {"id": "1"}, {"id": "1", "email": "b@example.com"})
+    assert result.modified_count == 1
+    assert await handler.find_one("users", {"id": "1"}, {"_id": 0}) == {"id": "1", "email": "b@example.com"}
+
+
+@pytest.mark.asyncio
+async def test_projections_only_return_the_requested_fields(mock_db):
+    handler = mock_db({"users": [{"id": "1", "email": "a@example.com", "password": "hash"}]})
+
+    assert await handler.find_one("users", {"id": "1"}, {"email": 1}) == {"id": "1", "email": "a@example.com"}
+    assert await handler.find_one("users", {"id": "1"}, {"password": 0}) == {"id": "1", "email": "a@example.com"}
+    assert await handler.find("users", projection={"email": 1, "_id": 0}) == [{"email": "a@example.com"}]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("projection", [None, {"profile": 1}, {"email": 0}])
+async def test_results_do_not_share_sub_documents_with_the_store(mock_db, projection):
+    handler = mock_db({"users": [{"id": "1", "email": "a@example.com", "profile": {"tags": ["a"]}}]})
+
+    found = await handler.find_one("users", {"id": "1"}, projection)
+    found["profile"]["tags"].append("b")
+    (listed,) = await handler.find("users", projection=projection)
+    listed["profile"]["city"] = "Pune"
+
+    assert (await handler.find_one("users", {"id": "1"}))["profile"] == {"tags": ["a"]}
+
+
+@pytest.mark.asyncio
+async def test_keyset_pages_cover_every_document_once(mock_db):
+    from db.pagination import after_filter, decode_cursor, encode_cursor
+
+    day = datetime(2024, 1, 1)
+    handler = mock_db()
+    sort = [("appointment_date", 1), ("_id", 1)]
+
+    for i in range(7):
+        await handler.insert_one("users", {"appointment_date": day + timedelta(days=i % 3)})
+
+    seen, query = [], {}
+    while True:
+        page = await handler.find("users", query, limit=3, sort=sort)
+        seen.extend(page)
+        if len(page) < 3:
+            break
+        values = decode_cursor(encode_cursor(page[-1], sort), sort)
+        query = after_filter(sort, values)
+
+    assert len({doc["_id"] for doc in seen}) == 7
+    assert [doc["appointment_date"] for doc in seen] == sorted(doc["appointment_date"] for doc in seen)
+
+
+@pytest.mark.asyncio
+async def test_geo_near_sorts_by_distance_within_max_distance(mock_db):
+    def hospital(id, latitude, longitude, emergency=True):
+        return {
+            "id": id, "emergency_services": emergency,
+            "geo": {"type": "Point", "coordinates": [longitude, latitude]},
+        }
+
+    handler = mock_db({"hospitals": [
+        hospital("far", 13.0716, 77.5946),        # ~11 km north
+        hospital("near", 12.9800, 77.5946),       # ~1 km north
+        hospital("no-er", 12.9720, 77.5946, emergency=False),
+        {"id": "unplaced", "emergency_services": True},
+    ]})
+
+    results = await handler.aggregate("hospitals", [
+        {"$geoNear": {
+            "near": {"type": "Point", "coordinates": [77.5946, 12.9716]},
+            "key": "geo", "distanceField": "distance", "maxDistance": 20000,
+            "query": {"emergency_services": True}, "spherical": True,
+        }},
+        {"$limit": 5},
+        {"$project": {"distance": 1}},
+    ])
+
+    assert [doc["id"] for doc in results] == ["near", "far"]
+    assert 900 < results[0]["distance"] < 1000
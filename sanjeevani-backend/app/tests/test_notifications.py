@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from models.notification import Notification, NotificationType
+from services.notification_service import NotificationService
+
+
+def notification(user_id, minutes, read=False):
+    return Notification(
+        title="Reminder", message="Take your medicine", type=NotificationType.REMINDER,
+        user_id=user_id, read=read, created_at=datetime(2024, 1, 1) + timedelta(minutes=minutes)
+    )
+
+
+@pytest.mark.asyncio
+async def test_listing_pages_with_cursors_and_counters(mock_db):
+    mock_db()
+    service = NotificationService()
+    created = [await service.create_notification(notification("u1", i, read=i < 2)) for i in range(5)]
+    await service.create_notification(notification("u2", 0))
+
+    first = await service.get_user_notifications("u1", limit=2)
+    assert (first.total, first.pages) == (5, 3)
+    assert [n.id for n in first.items] == [created[4].id, created[3].id]
+
+    second = await service.get_user_notifications("u1", limit=2, after=first.next_after)
+    assert [n.id for n in second.items] == [created[2].id, created[1].id]
+
+    unread = await service.get_user_notifications("u1", unread_only=True)
+    assert unread.total == 3
+    with pytest.raises(ValueError):
+        await service.get_user_notifications("u1", after="not-a-cursor")
+
+    assert await service.mark_as_read(str(created[4].id))
+    assert not await service.mark_as_read(str(created[4].id))
+    assert await service.delete_notification(str(created[3].id))
+    assert await service.get_unread_count("u1") == 1
+    assert (await service.get_user_notifications("u1")).total == 4
+
+
+@pytest.mark.asyncio
+async def test_counters_of_existing_users_are_seeded_and_reconciled(mock_db):
+    # u1 has notifications from before counters existed
+    store = mock_db({"notifications": [
+        {"_id": ObjectId(), "user_id": "u1", "title": "t", "message": "m", "type": "system", "read": i == 0,
+         "created_at": datetime(2024, 1, 1)}
+        for i in range(3)
+    ]})
+    service = NotificationService()
+
+    await service.create_notification(notification("u1", 0))
+    assert await service.get_unread_count("u1") == 3
+    assert (await service.get_user_notifications("u1")).total == 4
+
+    # Drift, e.g. a crash between a write and its counter update
+    await store.update_one("notification_counters", {"_id": "u1"}, {"$inc": {"unread": 5}})
+    await store.update_one("notification_counters", {"_id": "gone"}, {"$set": {"total": 2, "unread": 1}}, upsert=True)
+    assert await service.reconcile_counters() == 2
+    assert await service.get_unread_count("u1") == 3
+    assert await service.get_unread_count("gone") == 0
+    assert await service.reconcile_counters() == 0
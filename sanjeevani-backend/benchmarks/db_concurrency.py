@@ -0,0 +1,124 @@
+"""
+Concurrency benchmark for the data layer.
+
+Runs N concurrent clients that each make the database round trips of an
+authenticated appointment listing (user lookup by email, then the patient's
+appointments) and reports requests per second and latency for:
+
+    blocking  synchronous pymongo calls inside async handlers (the old services)
+    motor     awaited calls through the shared pool in db.repository
+
+Needs a MongoDB server. The benchmark seeds the database named by --db and
+drops it afterwards.
+
+    MONGODB_URL=mongodb://localhost:27017 python benchmarks/db_concurrency.py
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from pymongo import ASCENDING, MongoClient  # noqa: E402
+
+
+def seed(db, users, appointments_per_user):
+    db.users.drop()
+    db.appointments.drop()
+    db.users.insert_many(
+        {"email": f"user{i}@example.com", "name": f"User {i}", "role": "patient"}
+        for i in range(users)
+    )
+    db.appointments.insert_many(
+        {"patient_id": f"user{i}", "doctor_id": f"doctor{j}", "reason": "Checkup", "status": "pending"}
+        for i in range(users)
+        for j in range(appointments_per_user)
+    )
+    db.users.create_index([("email", ASCENDING)])
+    db.appointments.create_index([("patient_id", ASCENDING)])
+
+
+def blocking_handler(db):
+    async def handle(i):
+        user = db.users.find_one({"email": f"user{i}@example.com"})
+        list(db.appointments.find({"patient_id": f"user{i}"}))
+        return user
+
+    return handle
+
+
+def motor_handler():
+    from db.repository import get_collection
+
+    users = get_collection("users")
+    appointments = get_collection("appointments")
+
+    async def handle(i):
+        user = await users.find_one({"email": f"user{i}@example.com"})
+        await appointments.find({"patient_id": f"user{i}"}).to_list(length=None)
+        return user
+
+    return handle
+
+
+async def run(handle, concurrency, requests, users):
+    latencies = []
+    counter = iter(range(requests))
+
+    async def client():
+        for i in counter:
+            start = time.perf_counter()
+            await handle(i % users)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Data layer concurrency benchmark")
+    parser.add_argument("--db", default="sanjeevani_benchmark")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--appointments", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200])
+    args = parser.parse_args()
+
+    os.environ["USE_MOCK_DATA"] = "false"
+    os.environ["MONGODB_DB_NAME"] = args.db
+    mongodb_url = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+
+    sync_client = MongoClient(mongodb_url)
+    sync_db = sync_client[args.db]
+    seed(sync_db, args.users, args.appointments)
+
+    handlers = {"blocking": blocking_handler(sync_db), "motor": motor_handler()}
+    try:
+        print(f"{'mode':<10}{'clients':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for concurrency in args.concurrency:
+            for mode, handle in handlers.items():
+                result = await run(handle, concurrency, args.requests, args.users)
+                print(
+                    f"{mode:<10}{concurrency:>8}{result['rps']:>10.0f}"
+                    f"{result['p50']:>10.1f}{result['p99']:>10.1f}"
+                )
+    finally:
+        sync_client.drop_database(args.db)
+        sync_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
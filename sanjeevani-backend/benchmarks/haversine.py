@@ -0,0 +1,70 @@
+"""
+Haversine benchmark for nearest hospital searches.
+
+Builds a table of N random hospitals around Bangalore and times finding
+the nearest one, and the 10 nearest, from random origins with the scalar
+calculate_distance loop the emergency service used to run and with the
+vectorized CoordinateTable. Also times one batch call for all origins.
+
+    python benchmarks/haversine.py --hospitals 10000
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from core.geo import CoordinateTable, haversine_m  # noqa: E402
+
+
+def random_point(rng):
+    return {"latitude": rng.uniform(12.7, 13.2), "longitude": rng.uniform(77.3, 77.9)}
+
+
+def scalar_nearest(hospitals, origin, k):
+    distances = [
+        (haversine_m(origin["latitude"], origin["longitude"], h["location"]["latitude"], h["location"]["longitude"]), i)
+        for i, h in enumerate(hospitals)
+    ]
+    distances.sort()
+    return [i for _, i in distances[:k]]
+
+
+def timed(fn, origins):
+    start = time.perf_counter()
+    results = [fn(origin) for origin in origins]
+    return (time.perf_counter() - start) / len(origins), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--hospitals", type=int, default=10_000)
+    parser.add_argument("--origins", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    hospitals = [{"id": i, "location": random_point(rng)} for i in range(args.hospitals)]
+    origins = [random_point(rng) for _ in range(args.origins)]
+    table = CoordinateTable(hospitals)
+
+    print(f"{args.hospitals} hospitals, {args.origins} origins")
+    nearest = None
+    for k in (1, 10):
+        scalar, expected = timed(lambda o: scalar_nearest(hospitals, o, k), origins)
+        nearest = nearest or [e[0] for e in expected]
+        vector, found = timed(lambda o: [h["id"] for _, h in table.nearest(o["latitude"], o["longitude"], k)], origins)
+        assert found == expected
+        print(f"k={k:<3} scalar loop {scalar * 1e3:8.3f} ms   vectorized {vector * 1e3:8.3f} ms   ({scalar / vector:.0f}x)")
+
+    start = time.perf_counter()
+    indices, _ = table.nearest_to_each([(o["latitude"], o["longitude"]) for o in origins])
+    batch = (time.perf_counter() - start) / len(origins)
+    assert [int(i) for i in indices] == nearest
+    print(f"argmin for all origins in one call: {batch * 1e3:8.3f} ms per origin")
+
+
+if __name__ == "__main__":
+    main()
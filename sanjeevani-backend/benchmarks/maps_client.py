@@ -0,0 +1,73 @@
+"""
+Google Maps client benchmark against the offline stub server.
+
+Starts tests/maps_stub.py with a fixed response delay and issues N
+directions calls from C concurrent tasks, first with the synchronous
+googlemaps.Client called from async code (what the integration used to do,
+blocking the event loop for every call) and then with AsyncMapsClient.
+
+    python benchmarks/maps_client.py --calls 200 --concurrency 20 --delay 0.05
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from integrations.maps_client import AsyncMapsClient  # noqa: E402
+from tests.maps_stub import MapsStubServer  # noqa: E402
+
+ORIGIN = (12.9716, 77.5946)
+DESTINATION = (12.9766, 77.5993)
+
+
+async def run_tasks(call, calls, concurrency):
+    queue = asyncio.Queue()
+    for _ in range(calls):
+        queue.put_nowait(None)
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            await call()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.05, help="stub response delay in seconds")
+    args = parser.parse_args()
+
+    with MapsStubServer(delay=args.delay) as stub:
+        import googlemaps
+
+        sync_client = googlemaps.Client(
+            key="AIza" + "0" * 35, base_url=stub.base_url, queries_per_second=100_000, queries_per_minute=None
+        )
+
+        async def sync_call():
+            sync_client.directions(ORIGIN, DESTINATION, mode="driving")
+
+        async_client = AsyncMapsClient("benchmark", base_url=stub.base_url, max_connections=args.concurrency)
+
+        async def async_call():
+            await async_client.directions(ORIGIN, DESTINATION, mode="driving")
+
+        print(f"{args.calls} directions calls, {args.concurrency} concurrent tasks, {args.delay * 1000:.0f} ms stub delay")
+        for name, call in (("googlemaps.Client (blocking)", sync_call), ("AsyncMapsClient", async_call)):
+            elapsed = await run_tasks(call, args.calls, args.concurrency)
+            print(f"{name:<30} {elapsed:7.2f} s   {args.calls / elapsed:8.1f} calls/s")
+
+        await async_client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
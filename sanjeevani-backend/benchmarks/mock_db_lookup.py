@@ -0,0 +1,76 @@
+"""
+Point-lookup benchmark for the mock data store.
+
+Loads a users collection of N documents into MockDataHandler twice, once
+without secondary indexes (the old linear scan) and once with the default
+hash indexes, and times find_one on email and phone. Primary keys (id,
+_id) are always indexed, so they are not compared.
+
+    python benchmarks/mock_db_lookup.py --documents 100000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from db.mock_data_handler import MockDataHandler  # noqa: E402
+
+
+def build_users(count):
+    return [
+        {
+            "id": str(i),
+            "email": f"user{i}@example.com",
+            "phone": f"+91 9{i:09d}",
+            "name": f"User {i}",
+            "role": "patient",
+        }
+        for i in range(count)
+    ]
+
+
+async def time_lookups(handler, queries):
+    start = time.perf_counter()
+    for query in queries:
+        assert await handler.find_one("users", query) is not None
+    return (time.perf_counter() - start) / len(queries)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    users = build_users(args.documents)
+    rng = random.Random(42)
+    picks = [users[rng.randrange(len(users))] for _ in range(args.lookups)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(Path(tmp) / "users.json", "w") as f:
+            json.dump(users, f)
+
+        scan = MockDataHandler(base_path=tmp, indexes={}, auto_index_threshold=0)
+        indexed = MockDataHandler(base_path=tmp)
+
+        print(f"{args.documents} documents, {args.lookups} lookups per field")
+        print(f"{'field':<8}{'scan':>14}{'indexed':>14}{'speedup':>10}")
+        for field in ("email", "phone"):
+            queries = [{field: user[field]} for user in picks]
+            scan_time = await time_lookups(scan, queries)
+            indexed_time = await time_lookups(indexed, queries)
+            print(
+                f"{field:<8}{scan_time * 1e6:>11.1f} us{indexed_time * 1e6:>11.1f} us"
+                f"{scan_time / indexed_time:>9.0f}x"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())